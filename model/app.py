@@ -15,20 +15,23 @@ from werkzeug.exceptions import HTTPException
 import os
 import logging
 import time
-from io import BytesIO
 import threading
 from PIL import Image
 import hashlib
 import secrets
-import gc
 import socket
 
 
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
-from src.inference import TorchClassifier
+from src.inference import InteractiveCoffeeDiagnosis, TorchClassifier
+from memory_governor import MemoryGovernor
+from prediction_cache import NearDuplicateCache, PredictionCache, dhash
+from serving_utils import BATCH_POOL, ModelRunner, MultiHeadRunner, PreprocessCache
+from batching import BatchScheduler, runner_batch_fn
 from src.explanations import get_explanation, get_recommendation
+from src.preprocessing import decode_image
 from src.recommendations import get_additional_recommendations, get_structured_recommendations
 import torch
 
@@ -185,22 +188,75 @@ def validate_image_file(file):
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 disease_paths = {
+    'artifact': os.path.join(BASE_DIR, 'models/leaf_diseases/efficientnet_disease_balanced_artifact.pt'),
     'scripted': os.path.join(BASE_DIR, 'models/leaf_diseases/efficientnet_disease_balanced_scripted.pt'),
     'quant': os.path.join(BASE_DIR, 'models/leaf_diseases/efficientnet_disease_balanced_quantized.pt'),
+    'onnx': os.path.join(BASE_DIR, 'models/leaf_diseases/efficientnet_disease_balanced.onnx'),
     'pth': os.path.join(BASE_DIR, 'models/leaf_diseases/efficientnet_disease_balanced.pth'),
     'mapping': os.path.join(BASE_DIR, 'models/leaf_diseases/class_mapping_diseases.json')
 }
 deficiency_paths = {
+    'artifact': os.path.join(BASE_DIR, 'models/leaf_deficiencies/efficientnet_deficiency_balanced_artifact.pt'),
     'scripted': None,  # No scripted version exists
     'quant': None,  # No quantized version exists
+    'onnx': os.path.join(BASE_DIR, 'models/leaf_deficiencies/efficientnet_deficiency_balanced.onnx'),
     'pth': os.path.join(BASE_DIR, 'models/leaf_deficiencies/efficientnet_deficiency_balanced.pth'),
     'mapping': os.path.join(BASE_DIR, 'models/leaf_deficiencies/class_mapping_deficiencies.json')
 }
 
+# Shared-backbone checkpoint built by build_multihead.py. When present it
+# replaces both single-task models (one trunk in memory, one forward pass
+# per upload). Set USE_MULTIHEAD=0 to force the separate runners.
+multihead_path = os.path.join(BASE_DIR, 'models/efficientnet_multihead.pth')
+
+# Written by export_all.py; when present each runner serves the fastest
+# exported variant that passed the parity check
+export_manifest_path = os.path.join(BASE_DIR, 'models/export_manifest.json')
+
+# Inference backend for the single-task runners: 'auto' (default preference
+# order), 'onnx' (ONNX Runtime) or 'torch' (never ONNX). Used to A/B ONNX
+# Runtime against TorchScript.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'auto').lower()
+
+# Interactive learning loads its own pair of models, so it is opt-in
+# (INTERACTIVE_LEARNING=1). Feedback memory is persisted in
+# INTERACTIVE_STORE_DIR, survives restarts and is shared by all workers;
+# each store is compacted once it grows past INTERACTIVE_STORE_MAX_ROWS.
+# Diagnoses are recorded there too, so feedback can reach any worker.
+interactive_system = None
+if os.environ.get('INTERACTIVE_LEARNING', '0').lower() in ('1', 'true', 'yes'):
+    try:
+        interactive_system = InteractiveCoffeeDiagnosis(
+            disease_paths['pth'], disease_paths['mapping'],
+            deficiency_paths['pth'], deficiency_paths['mapping'],
+            store_dir=os.environ.get('INTERACTIVE_STORE_DIR', os.path.join(BASE_DIR, 'interactive_store')),
+            store_max_rows=int(os.environ.get('INTERACTIVE_STORE_MAX_ROWS', '4000'))
+        )
+        logger.info('Interactive learning enabled')
+    except Exception as e:
+        logger.warning(f'Interactive learning unavailable: {e}')
+
 # Create ModelRunner instances lazily but keep references for health/metrics
 _model_lock = threading.Lock()
 disease_runner = None
 deficiency_runner = None
+multihead_runner = None
+
+# Replaces per-request gc.collect(): collects above the soft RSS limit and
+# also drops caches / returns heap to the OS above the hard limit (MB).
+# Limits are raised to the post-load RSS plus headroom (capped at
+# MEMORY_MAX_MB, the hard limit by default), and ineffective collections
+# back off, so a steady state above the limits is not churned.
+memory_governor = MemoryGovernor(
+    soft_limit_mb=float(os.environ.get('MEMORY_SOFT_LIMIT_MB', '380')),
+    hard_limit_mb=float(os.environ.get('MEMORY_HARD_LIMIT_MB', '450')),
+    check_interval=float(os.environ.get('MEMORY_CHECK_INTERVAL', '1.0')),
+    soft_headroom_mb=float(os.environ.get('MEMORY_SOFT_HEADROOM_MB', '64')),
+    hard_headroom_mb=float(os.environ.get('MEMORY_HARD_HEADROOM_MB', '128')),
+    min_freed_mb=float(os.environ.get('MEMORY_MIN_FREED_MB', '8')),
+    max_backoff=float(os.environ.get('MEMORY_MAX_BACKOFF', '300')),
+    max_mb=float(os.environ['MEMORY_MAX_MB']) if os.environ.get('MEMORY_MAX_MB') else None,
+)
 
 metrics = {
     'total_requests': 0,
@@ -210,10 +266,20 @@ metrics = {
 
 
 def get_runners():
-    global disease_runner, deficiency_runner
+    global disease_runner, deficiency_runner, multihead_runner
     if disease_runner is not None and deficiency_runner is not None:
         return disease_runner, deficiency_runner
     with _model_lock:
+        use_multihead = os.environ.get('USE_MULTIHEAD', '1').lower() not in ('0', 'false', 'no')
+        if disease_runner is None and deficiency_runner is None and use_multihead and os.path.exists(multihead_path):
+            try:
+                multihead_runner = MultiHeadRunner(multihead_path, device='cpu')
+                disease_runner = multihead_runner.head('disease')
+                deficiency_runner = multihead_runner.head('deficiency')
+                logger.info('Shared-backbone multi-head model loaded')
+            except Exception as e:
+                logger.warning(f'MultiHeadRunner failed: {e}, falling back to separate models')
+                multihead_runner = None
         if disease_runner is None:
             try:
                 disease_runner = ModelRunner(
@@ -221,14 +287,17 @@ def get_runners():
                     quant_path=disease_paths['quant'],
                     pth_path=disease_paths['pth'],
                     mapping_path=disease_paths['mapping'],
-                    device='cpu'
+                    device='cpu',
+                    artifact_path=disease_paths['artifact'],
+                    onnx_path=disease_paths['onnx'],
+                    backend=MODEL_BACKEND,
+                    manifest_path=export_manifest_path if os.path.exists(export_manifest_path) else None,
+                    manifest_name='disease'
                 )
-                gc.collect()
                 logger.info('Disease model loaded')
             except Exception as e:
                 logger.warning(f'Disease ModelRunner failed: {e}, falling back to TorchClassifier')
                 disease_runner = TorchClassifier(disease_paths['pth'], disease_paths['mapping'])
-                gc.collect()
         if deficiency_runner is None:
             try:
                 deficiency_runner = ModelRunner(
@@ -236,17 +305,185 @@ def get_runners():
                     quant_path=deficiency_paths['quant'],
                     pth_path=deficiency_paths['pth'],
                     mapping_path=deficiency_paths['mapping'],
-                    device='cpu'
+                    device='cpu',
+                    artifact_path=deficiency_paths['artifact'],
+                    onnx_path=deficiency_paths['onnx'],
+                    backend=MODEL_BACKEND,
+                    manifest_path=export_manifest_path if os.path.exists(export_manifest_path) else None,
+                    manifest_name='deficiency'
                 )
-                gc.collect()
                 logger.info('Deficiency model loaded')
             except Exception as e:
                 logger.warning(f'Deficiency ModelRunner failed: {e}, falling back to TorchClassifier')
                 deficiency_runner = TorchClassifier(deficiency_paths['pth'], deficiency_paths['mapping'])
-                gc.collect()
+        memory_governor.check(force=True)
+        memory_governor.set_baseline()
     return disease_runner, deficiency_runner
 
 
+UNKNOWN_RESULT = {'class': 'Unknown', 'confidence': 0.0, 'class_index': -1, 'inference_time': 0.0}
+
+
+# Preprocessed tensors keyed by image hash so retries and interactive
+# calls for the same upload skip preprocessing (0 disables the cache).
+preprocess_cache = PreprocessCache(max_entries=int(os.environ.get('PREPROCESS_CACHE_SIZE', '8')))
+memory_governor.register_trim('preprocess_cache', preprocess_cache.clear, preprocess_cache.__len__, preprocess_cache.nbytes)
+memory_governor.register_trim('batch_buffer_pool', BATCH_POOL.clear, BATCH_POOL.pooled_bytes, BATCH_POOL.pooled_bytes)
+
+# Final upload responses keyed by image hash + model version, so a retried
+# upload of the same photo is answered without decoding or inference
+# (PREDICTION_CACHE_SIZE=0 disables it).
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', '256')),
+    max_bytes=int(float(os.environ.get('PREDICTION_CACHE_MB', '8')) * 1024 * 1024),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', '3600')),
+)
+memory_governor.register_trim('prediction_cache', prediction_cache.clear, lambda: prediction_cache.bytes)
+
+# Second tier for re-compressed / resized re-uploads: predictions keyed by a
+# perceptual hash of the decoded image. NEAR_DUPLICATE_CACHE is the safety
+# switch: 'shadow' (default) only measures agreement, 'on' serves hits
+# without running the models, 'off' disables hashing.
+near_duplicate_cache = NearDuplicateCache(
+    mode=os.environ.get('NEAR_DUPLICATE_CACHE', 'shadow').lower(),
+    max_distance=int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', '4')),
+    max_entries=int(os.environ.get('NEAR_DUPLICATE_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', '3600')),
+    min_confidence=float(os.environ.get('NEAR_DUPLICATE_MIN_CONFIDENCE', '0.6')),
+)
+memory_governor.register_trim('near_duplicate_cache', near_duplicate_cache.clear, near_duplicate_cache.__len__)
+RESPONSE_MODEL_VERSION = 'enhanced_v1.1-structured-recs'
+
+
+def model_version():
+    """Identifies the loaded models, so cached responses never outlive a model change.
+
+    Loads the runners first, so a request's cache lookup and store use the
+    same key; each runner's `version` names its backend and weights file.
+    """
+    try:
+        runners = get_runners()
+    except Exception as e:
+        logger.warning(f'Model version unavailable: {e}')
+        runners = (disease_runner, deficiency_runner)
+    parts = [RESPONSE_MODEL_VERSION]
+    for runner in runners:
+        parts.append(getattr(runner, 'version', None) or type(runner).__name__)
+    return '|'.join(parts)
+
+# Decode uploads at reduced size: JPEG DCT-domain downscaling (DECODE_DRAFT,
+# on by default) and integer box-reduce for PNG/WebP (DECODE_REDUCE, off by
+# default). Both keep the short side >= 256 before the model's resize.
+DECODE_DRAFT = os.environ.get('DECODE_DRAFT', '1').lower() in ('1', 'true', 'yes')
+DECODE_REDUCE = os.environ.get('DECODE_REDUCE', '0').lower() in ('1', 'true', 'yes')
+
+
+# Dynamic micro-batching: concurrent uploads are coalesced into one
+# predict_tensor call per model. Off by default because the gevent dev
+# server handles one request at a time; enable under a threaded server
+# (e.g. gunicorn -k gthread).
+BATCHING_ENABLED = os.environ.get('BATCHING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT = float(os.environ.get('BATCH_MAX_WAIT_MS', '10')) / 1000.0
+BATCH_DEADLINE = float(os.environ.get('BATCH_DEADLINE_MS', '15000')) / 1000.0
+_schedulers = {}
+
+
+def get_scheduler(name, runner):
+    """Return the batch scheduler serving `runner`, or None when batching is off."""
+    if not BATCHING_ENABLED or not hasattr(runner, 'predict_tensor'):
+        return None
+    entry = _schedulers.get(name)
+    if entry is None or entry[0] is not runner:
+        with _model_lock:
+            entry = _schedulers.get(name)
+            if entry is None or entry[0] is not runner:
+                if entry is not None:
+                    # Answer what is already queued on the old runner, then let its workers exit
+                    entry[1].close(drain=True, timeout=0)
+                scheduler = BatchScheduler(runner_batch_fn(runner, pool=BATCH_POOL), max_batch_size=BATCH_MAX_SIZE,
+                                           max_wait=BATCH_MAX_WAIT, name=name)
+                entry = (runner, scheduler)
+                _schedulers[name] = entry
+    return entry[1]
+
+
+def _run_model(runner, image, tensor=None, scheduler=None):
+    """Run a single runner exactly once on an in-memory image.
+
+    Uses the shared preprocessed `tensor` when the runner supports
+    `predict_tensor` (through `scheduler` when batching is enabled),
+    otherwise falls back to `predict_image`/`predict`. Returns
+    `(result, preprocess_seconds, model_seconds)`; runners that do their own
+    preprocessing and do not report it have it folded into the model stage.
+    """
+    start = time.perf_counter()
+    if tensor is not None and scheduler is not None:
+        result = scheduler.predict(tensor, timeout=BATCH_DEADLINE)
+    elif tensor is not None and hasattr(runner, 'predict_tensor'):
+        result = runner.predict_tensor(tensor)[0]
+    elif hasattr(runner, 'predict_image'):
+        result = runner.predict_image(image)
+    else:
+        result = runner.predict(image)
+    elapsed = time.perf_counter() - start
+    preprocess = float(result.get('preprocess_time', 0.0) or 0.0)
+    preprocess = min(preprocess, elapsed)
+    return result, preprocess, elapsed - preprocess
+
+
+def run_inference_pipeline(image, image_hash=''):
+    """Run the disease and deficiency models once each on a decoded image.
+
+    The image is preprocessed once and the tensor is shared by both
+    runners. Returns `(disease_result, deficiency_result, timings)` where
+    `timings` maps the `preprocess`, `disease` and `deficiency` stages to
+    seconds (or `preprocess` and `shared` when a shared-backbone model
+    serves both). Failures are counted in `metrics['errors']` and reported
+    as Unknown.
+    """
+    timings = {'preprocess': 0.0, 'disease': 0.0, 'deficiency': 0.0}
+    try:
+        disease_runner, deficiency_runner = get_runners()
+
+        tensor = None
+        if hasattr(disease_runner, 'predict_tensor') or hasattr(deficiency_runner, 'predict_tensor'):
+            start = time.perf_counter()
+            tensor = preprocess_cache.get_or_compute(image_hash or None, image)
+            timings['preprocess'] = time.perf_counter() - start
+
+        shared = getattr(disease_runner, 'shared', None)
+        if shared is not None and shared is getattr(deficiency_runner, 'shared', None):
+            # Shared backbone: both heads come out of a single forward pass,
+            # reported as one `shared` stage.
+            start = time.perf_counter()
+            scheduler = get_scheduler('shared', shared)
+            if scheduler is not None:
+                results = scheduler.predict(tensor, timeout=BATCH_DEADLINE)
+            else:
+                results = shared.predict_tensor(tensor)[0]
+            timings['shared'] = time.perf_counter() - start
+            disease_result, deficiency_result = results['disease'], results['deficiency']
+            logger.info(f'Shared-backbone preds for {image_hash}: {disease_result.get("class")} / {deficiency_result.get("class")}')
+            return disease_result, deficiency_result, timings
+
+        disease_result, prep, model_time = _run_model(disease_runner, image, tensor, get_scheduler('disease', disease_runner))
+        timings['preprocess'] += prep
+        timings['disease'] = model_time
+        logger.info(f'Disease pred for {image_hash}: {disease_result.get("class", "None")} ({disease_result.get("confidence", 0):.3f})')
+
+        deficiency_result, prep, model_time = _run_model(deficiency_runner, image, tensor, get_scheduler('deficiency', deficiency_runner))
+        timings['preprocess'] += prep
+        timings['deficiency'] = model_time
+        logger.info(f'Deficiency pred for {image_hash}: {deficiency_result.get("class", "None")} ({deficiency_result.get("confidence", 0):.3f})')
+    except Exception as pred_e:
+        metrics['errors'] += 1
+        logger.exception(f'Model prediction failed for {image_hash}: {pred_e}')
+        disease_result = dict(UNKNOWN_RESULT)
+        deficiency_result = dict(UNKNOWN_RESULT)
+    return disease_result, deficiency_result, timings
+
+
 @app.route('/api/v1/upload-image', methods=['POST', 'OPTIONS'])
 def upload_image():
     if request.method == 'OPTIONS':
@@ -276,69 +513,56 @@ def upload_image():
 
         # Read image bytes and open in-memory (data is not persisted)
         img_bytes = file.read()
-        image_hash = hashlib.sha256(img_bytes).hexdigest()[:16]  # For logging only
+        content_hash = hashlib.sha256(img_bytes).hexdigest()
+        image_hash = content_hash[:16]  # For logging
+
+        pipeline_start = time.perf_counter()
+        version = model_version()
+        cached = prediction_cache.get(prediction_cache.make_key(content_hash, version))
+        if cached is not None:
+            metrics['total_requests'] += 1
+            total_time = time.perf_counter() - pipeline_start
+            cached['processing_time'] = round(total_time, 4)
+            cached['debug'].update(total_time=round(total_time, 4), timings={}, cache='hit')
+            logger.info(f'Prediction cache hit for {image_hash}')
+            return jsonify(cached)
 
         try:
-            image = Image.open(BytesIO(img_bytes)).convert('RGB')
+            image = decode_image(img_bytes, draft=DECODE_DRAFT, reduce=DECODE_REDUCE)
             logger.info(f'Image loaded: {image.size} ({image.mode}), hash: {image_hash}')
         except Exception as e:
             logger.error(f'Invalid image {image_hash}: {e}')
             return jsonify({'error': 'Invalid image file', 'api_version': 'v1.0'}), 400
-            
-        start = time.time()
-        try:
-            metrics['total_requests'] += 1
-            disease_runner, deficiency_runner = get_runners()
-            logger.info(f'Models ready for {image_hash}: disease_runner={disease_runner is not None}, deficiency_runner={deficiency_runner is not None}')
-            
-            # Use runners' predict_image (in-memory) when available, else fallback
-            if hasattr(disease_runner, 'predict_image'):
-                disease_result = disease_runner.predict_image(image)
-            else:
-                disease_result = disease_runner.predict(image)
-            logger.info(f'Disease pred for {image_hash}: {disease_result.get("class", "None")} ({disease_result.get("confidence", 0):.3f})')
-            
-            if hasattr(deficiency_runner, 'predict_image'):
-                deficiency_result = deficiency_runner.predict_image(image)
-            else:
-                deficiency_result = deficiency_runner.predict(image)
-            logger.info(f'Deficiency pred for {image_hash}: {deficiency_result.get("class", "None")} ({deficiency_result.get("confidence", 0):.3f})')
-                
-        except Exception as pred_e:
-            metrics['errors'] += 1
-            logger.exception(f'Model prediction failed for {image_hash}: {pred_e}')
-            disease_result = {'class': 'Unknown', 'confidence': 0.0, 'class_index': -1, 'inference_time': 0.0}
-            deficiency_result = {'class': 'Unknown', 'confidence': 0.0, 'class_index': -1, 'inference_time': 0.0}
-        total_time = time.time() - start
-
-        start = time.time()
-        try:
-            metrics['total_requests'] += 1
-            disease_runner, deficiency_runner = get_runners()
-            # Use runners' predict_image (in-memory) when available, else fallback
-            if hasattr(disease_runner, 'predict_image'):
-                disease_result = disease_runner.predict_image(image)
-            else:
-                disease_result = disease_runner.predict(image)
-
-            if hasattr(deficiency_runner, 'predict_image'):
-                deficiency_result = deficiency_runner.predict_image(image)
-            else:
-                deficiency_result = deficiency_runner.predict(image)
-        except Exception:
-            metrics['errors'] += 1
-            logger.exception(f'Model prediction failed for {image_hash}')
-            disease_result = {'class': 'Unknown', 'confidence': 0.0, 'class_index': -1, 'inference_time': 0.0}
-            deficiency_result = {'class': 'Unknown', 'confidence': 0.0, 'class_index': -1, 'inference_time': 0.0}
-        total_time = time.time() - start
+        decode_time = time.perf_counter() - pipeline_start
+
+        metrics['total_requests'] += 1
+        phash, near_duplicate, near_status = None, None, 'off'
+        if near_duplicate_cache.enabled:
+            phash = dhash(image)
+            near_duplicate = near_duplicate_cache.lookup(phash, version)
+            near_status = 'miss' if near_duplicate is None else 'hit'
+        if near_duplicate is not None and near_duplicate_cache.mode == 'on':
+            disease_result, deficiency_result = near_duplicate
+            near_duplicate_cache.record_served()
+            timings = {}
+            logger.info(f'Near-duplicate cache hit for {image_hash}')
+        else:
+            disease_result, deficiency_result, timings = run_inference_pipeline(image, image_hash)
+            if near_duplicate is not None:
+                near_status = 'shadow_agree' if near_duplicate_cache.record_shadow(
+                    near_duplicate, disease_result, deficiency_result) else 'shadow_disagree'
+            if phash is not None and 'Unknown' not in (disease_result.get('class'), deficiency_result.get('class')):
+                near_duplicate_cache.put(phash, version, disease_result, deficiency_result)
+        timings = {'decode': decode_time, **timings}
 
         # Clear image data from memory immediately
         del img_bytes
         del image
 
-        # Force garbage collection to free memory
-        gc.collect()
+        # Collect / trim only when RSS is above the governor's thresholds
+        memory_governor.check()
 
+        recs_start = time.perf_counter()
         # Get enhanced structured recommendations
         try:
             structured_recs = get_structured_recommendations(
@@ -360,30 +584,14 @@ def upload_image():
         disease_recommendation = get_recommendation(disease_result.get('class', 'Unknown'), 'disease')
         deficiency_explanation = get_explanation(deficiency_result.get('class', 'Unknown'), 'deficiency')
         deficiency_recommendation = get_recommendation(deficiency_result.get('class', 'Unknown'), 'deficiency')
+        timings['recommendations'] = time.perf_counter() - recs_start
+        total_time = time.perf_counter() - pipeline_start
+        timings = {stage: round(seconds, 4) for stage, seconds in timings.items()}
+
+        # Top-3 predictions come from the same forward pass as the main result
+        disease_top3 = disease_result.pop('top_k', [])
+        deficiency_top3 = deficiency_result.pop('top_k', [])
 
-        # Add top-3 predictions for debugging
-        def get_top3(model_result, runner):
-            if hasattr(runner, 'mapping') and runner.mapping:
-                probs = None
-                try:
-                    # Try to get raw probs if available
-                    if hasattr(runner, 'predict_image_topk'):
-                        dummy_img = Image.new('RGB', (224,224), color='green')
-                        _, probs = runner.predict_image_topk(dummy_img)
-                    probs = torch.rand(len(runner.mapping))  # Fallback mock
-                except:
-                    probs = torch.rand(len(runner.mapping))
-                top3_idx = torch.topk(probs, 3).indices.tolist()
-                top3 = []
-                for i in top3_idx:
-                    cls_info = runner.mapping.get(str(i), {'name': str(i)})
-                    top3.append({'class': cls_info.get('name', str(i)), 'confidence': probs[i].item()})
-                return top3
-            return []
-        
-        disease_top3 = get_top3(disease_result, disease_runner) if 'disease_runner' in locals() else []
-        deficiency_top3 = get_top3(deficiency_result, deficiency_runner) if 'deficiency_runner' in locals() else []
-        
         response = {
             'disease_prediction': {**disease_result, 'explanation': disease_explanation, 'recommendation': disease_recommendation, 'top3': disease_top3},
             'deficiency_prediction': {**deficiency_result, 'explanation': deficiency_explanation, 'recommendation': deficiency_recommendation, 'top3': deficiency_top3},
@@ -393,19 +601,25 @@ def upload_image():
             'varieties': structured_recs['varieties'],
 'legacy_recommendations': structured_recs.get("products", []),  # Legacy compatibility
             'processing_time': round(total_time, 4),
-            'model_version': 'enhanced_v1.1-structured-recs',
+            'model_version': RESPONSE_MODEL_VERSION,
             'api_version': 'v1.1',
             'debug': {
                 'image_hash': image_hash,
                 'total_time': round(total_time, 4),
+                'timings': timings,
                 'models_used': {
                     'disease_type': type(disease_runner).__name__ if disease_runner else 'None',
                     'deficiency_type': type(deficiency_runner).__name__ if deficiency_runner else 'None'
                 },
-                'structured_recs_available': bool(structured_recs['disease_recommendations'])
+                'structured_recs_available': bool(structured_recs['disease_recommendations']),
+                'cache': 'miss',
+                'near_duplicate': near_status
             },
             'status': 'success'
         }
+        # Failed predictions are not cached so a retry gets a fresh attempt
+        if 'Unknown' not in (disease_result.get('class'), deficiency_result.get('class')):
+            prediction_cache.put(prediction_cache.make_key(content_hash, version), response)
 
         logger.info(f"Analysis completed in {total_time:.4f}s for {image_hash} - Disease: {disease_result.get('class')}, Deficiency: {deficiency_result.get('class')}")
         return jsonify(response)
@@ -425,8 +639,9 @@ def interactive_diagnose():
         if not is_valid:
             return jsonify({'error': err}), 400
         img_bytes = file.read()
+        image_hash = hashlib.sha256(img_bytes).hexdigest()[:16]
         try:
-            image = Image.open(BytesIO(img_bytes)).convert('RGB')
+            image = decode_image(img_bytes, draft=DECODE_DRAFT, reduce=DECODE_REDUCE)
         except Exception:
             return jsonify({'error': 'Invalid image file'}), 400
 
@@ -435,33 +650,32 @@ def interactive_diagnose():
         try:
             # Try interactive system if available
             if globals().get('interactive_system') is not None:
-                diagnosis_result = globals().get('interactive_system').diagnose(image)
+                diagnosis_result = globals().get('interactive_system').diagnose(image, key=image_hash)
             else:
                 raise RuntimeError('Interactive system not available')
         except Exception:
-            # Use ModelRunner predict_image in parallel
-            disease_runner, deficiency_runner = get_runners()
-            import concurrent.futures
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                d_future = executor.submit(getattr(disease_runner, 'predict_image', disease_runner.predict), image)
-                f_future = executor.submit(getattr(deficiency_runner, 'predict_image', deficiency_runner.predict), image)
-                disease_result = d_future.result()
-                deficiency_result = f_future.result()
+            # Fall back to the single-pass pipeline; the preprocessed tensor
+            # is shared with (and cached for) the upload endpoint.
+            disease_result, deficiency_result, _ = run_inference_pipeline(image, image_hash)
+            # Same top-3 shape as the upload endpoint
+            disease_top3 = disease_result.pop('top_k', [])
+            deficiency_top3 = deficiency_result.pop('top_k', [])
 
             diagnosis_result = {
-                'disease_prediction': {**disease_result, 'similar_previous_cases': 0, 'certainty_level': 'Unknown'},
-                'deficiency_prediction': {**deficiency_result, 'similar_previous_cases': 0, 'certainty_level': 'Unknown'},
+                'disease_prediction': {**disease_result, 'top3': disease_top3, 'similar_previous_cases': 0, 'certainty_level': 'Unknown'},
+                'deficiency_prediction': {**deficiency_result, 'top3': deficiency_top3, 'similar_previous_cases': 0, 'certainty_level': 'Unknown'},
                 'learning_stats': {'disease_memory_size': 0, 'deficiency_memory_size': 0, 'disease_calibration_classes': 0, 'deficiency_calibration_classes': 0},
                 'status': 'fallback_used'
             }
         total_time = time.time() - start
         diagnosis_result['processing_time'] = round(total_time, 4)
         diagnosis_result['model_version'] = 'interactive_learning_v1.0'
+        # Clients send this back to /api/feedback to refer to this diagnosis
+        diagnosis_result['image_hash'] = image_hash
 
-        # Clean up image data and force garbage collection
         del img_bytes
         del image
-        gc.collect()
+        memory_governor.check()
 
         return jsonify(diagnosis_result)
     except Exception:
@@ -612,6 +826,12 @@ def performance():
             'service_requests_total': metrics['total_requests'],
             'service_errors_total': metrics['errors'],
             'error_rate': metrics['errors'] / max(metrics['total_requests'], 1),
+            'preprocess_cache': preprocess_cache.get_stats(),
+            'batch_buffer_pool': BATCH_POOL.get_stats(),
+            'prediction_cache': prediction_cache.get_stats(),
+            'near_duplicate_cache': near_duplicate_cache.get_stats(),
+            'memory_governor': memory_governor.get_stats(),
+            'batching': {name: entry[1].get_stats() for name, entry in _schedulers.items()},
             'uptime_seconds': time.time() - app_start_time if 'app_start_time' in globals() else 0
         }
         return jsonify({
@@ -644,17 +864,21 @@ def feedback():
     """
     try:
         data = request.get_json(silent=True) or {}
+        # `image_hash` (returned by /api/interactive-diagnose) identifies the
+        # diagnosis; `image_path` is accepted from older clients
+        image_hash = data.get('image_hash')
         image_path = data.get('image_path')
         disease_feedback = data.get('disease_feedback')
         deficiency_feedback = data.get('deficiency_feedback')
 
-        if not image_path or (not disease_feedback and not deficiency_feedback):
+        if not (image_hash or image_path) or (not disease_feedback and not deficiency_feedback):
             return jsonify({'error': 'Missing required data'}), 400
 
         # If an interactive system is available, delegate feedback handling
         if globals().get('interactive_system') is not None:
             result = globals().get('interactive_system').provide_feedback(
-                image_path, disease_feedback=disease_feedback, deficiency_feedback=deficiency_feedback
+                None if image_hash else image_path, disease_feedback=disease_feedback,
+                deficiency_feedback=deficiency_feedback, image_key=image_hash
             )
             return jsonify(result)
 
@@ -676,7 +900,7 @@ def learning_stats():
         # If interactive system exists, provide its learning stats
         if globals().get('interactive_system') is not None:
             stats = {
-                'learning_statistics': globals().get('interactive_system').diagnose.__doc__ or {},
+                'learning_statistics': globals().get('interactive_system').get_learning_stats(),
                 'status': 'success'
             }
             return jsonify(stats)
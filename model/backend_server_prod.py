@@ -1,78 +1,99 @@
 """Production-ready server with in-memory batching (50ms) for `/predict`.
 
+Batching is tuned with BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS and BATCH_WORKERS.
+
 Usage:
   PORT=5001 python backend_server_prod.py
   gunicorn -w 4 -k gthread -b 0.0.0.0:5001 backend_server_prod:app
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from pathlib import Path
-import tempfile
+from io import BytesIO
 import os
 from serving_utils import ModelRunner
 import threading
 import time
-import uuid
+import atexit
 import concurrent.futures
+from batching import BatchScheduler
+from src.preprocessing import decode_image
+
+
+class InMemoryRequest(Request):
+    """Keep multipart uploads in memory instead of spooling large ones to a temp file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return BytesIO()
+
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+# Uploads are buffered in RAM, so bound the request size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '32')) * 1024 * 1024
 
 ROOT = Path(__file__).resolve().parent
 SCRIPTED = ROOT / 'models' / 'leaf_diseases' / 'efficientnet_disease_balanced_scripted.pt'
 QUANT = ROOT / 'models' / 'leaf_diseases' / 'efficientnet_disease_balanced_quantized.pt'
 
+PREDICT_TIMEOUT = 15.0
+
 runner = ModelRunner(str(SCRIPTED), str(QUANT), device='cpu', max_workers=4)
 
 
-class Batcher:
-    def __init__(self, runner, max_batch_size=16, max_latency=0.05):
+class Batcher(BatchScheduler):
+    """Per-image micro-batcher over `runner.predict_batch_pil`.
+
+    Each image is queued on its own so multi-image requests can share
+    batches with other requests; `collect(images)` gathers them back into
+    one future. Flushing is deadline based (see `BatchScheduler`), so a
+    lone request waits at most `max_latency` instead of a full window on
+    every wakeup.
+    """
+
+    def __init__(self, runner, max_batch_size=16, max_latency=0.05, num_workers=1):
+        super().__init__(runner.predict_batch_pil, max_batch_size=max_batch_size,
+                         max_wait=max_latency, name='predict', num_workers=num_workers)
         self.runner = runner
-        self.max_batch_size = max_batch_size
-        self.max_latency = max_latency
-        self.lock = threading.Condition()
-        self.queue = []  # list of (req_id, paths, future)
-        self._thread = threading.Thread(target=self._worker, daemon=True)
-        self._thread.start()
-
-    def collect(self, paths):
-        fut = concurrent.futures.Future()
-        req_id = str(uuid.uuid4())
-        with self.lock:
-            self.queue.append((req_id, list(paths), fut))
-            self.lock.notify()
-        return fut
-
-    def _worker(self):
-        while True:
-            with self.lock:
-                if not self.queue:
-                    self.lock.wait()
-                self.lock.wait(timeout=self.max_latency)
-                batch = []
-                batch_items = []
-                while self.queue and len(batch) < self.max_batch_size:
-                    req_id, paths, fut = self.queue.pop(0)
-                    batch_items.append((req_id, paths, fut))
-                    batch.extend(paths)
-
-            if not batch_items:
-                continue
-
-            try:
-                preds = self.runner.predict_batch(batch)
-            except Exception as e:
-                for _req_id, _paths, fut in batch_items:
-                    fut.set_exception(e)
-                continue
-
-            idx = 0
-            for _req_id, paths, fut in batch_items:
-                n = len(paths)
-                part = preds[idx: idx + n]
-                idx += n
-                fut.set_result(part)
-
-
-batcher = Batcher(runner, max_batch_size=16, max_latency=0.05)
+
+    def collect(self, images, deadline=None):
+        """Queue every PIL image and return one future resolving to their results in order."""
+        futures = []
+        try:
+            for img in images:
+                futures.append(self.submit(img, deadline=deadline))
+        except Exception:
+            # e.g. closed mid-request: don't leave the rest of this request queued
+            for f in futures:
+                f.cancel()
+            raise
+        gathered = concurrent.futures.Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                gathered.set_exception(errors[0])
+            else:
+                gathered.set_result([f.result() for f in futures])
+
+        for f in futures:
+            f.add_done_callback(_done)
+        return gathered
+
+
+batcher = Batcher(
+    runner,
+    max_batch_size=int(os.environ.get('BATCH_MAX_SIZE', '16')),
+    max_latency=float(os.environ.get('BATCH_MAX_WAIT_MS', '50')) / 1000.0,
+    num_workers=int(os.environ.get('BATCH_WORKERS', '1'))
+)
+# Answer whatever is still queued before the worker process exits
+atexit.register(batcher.close, drain=True, timeout=PREDICT_TIMEOUT)
 
 
 @app.route('/predict', methods=['POST'])
@@ -81,31 +102,24 @@ def predict():
     if not files:
         return jsonify({'error': 'No files received (field name "images" expected)'}), 400
 
-    tmpdir = tempfile.mkdtemp()
-    paths = []
-    try:
-        for f in files:
-            dest = os.path.join(tmpdir, f.filename)
-            f.save(dest)
-            paths.append(dest)
-
-        fut = batcher.collect(paths)
-        try:
-            results = fut.result(timeout=15.0)
-        except concurrent.futures.TimeoutError:
-            return jsonify({'error': 'Prediction timed out'}), 504
-
-        return jsonify({'results': results})
-    finally:
-        for p in paths:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
+    # Decode straight from the upload buffers; nothing touches the filesystem
+    images = []
+    for f in files:
         try:
-            os.rmdir(tmpdir)
+            images.append(decode_image(f.stream))
         except Exception:
-            pass
+            return jsonify({'error': f'Invalid image file: {f.filename}'}), 400
+
+    try:
+        fut = batcher.collect(images, deadline=time.monotonic() + PREDICT_TIMEOUT)
+    except RuntimeError:
+        return jsonify({'error': 'Server is shutting down'}), 503
+    try:
+        results = fut.result(timeout=PREDICT_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return jsonify({'error': 'Prediction timed out'}), 504
+
+    return jsonify({'results': results})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+"""In-process dynamic micro-batching for the inference endpoints.
+
+`BatchScheduler` collects single-item requests from concurrent request
+threads and hands them to a batch function in groups. A batch is flushed
+as soon as it is full or when its oldest request has waited `max_wait`
+seconds, so a lone request under light load pays at most `max_wait`.
+
+Several worker threads can drain the same queue (PyTorch releases the GIL
+during the forward pass), and `close()` stops the scheduler after
+finishing or failing whatever is still queued.
+
+Usage:
+    scheduler = BatchScheduler(runner_batch_fn(runner), max_batch_size=8, max_wait=0.01)
+    result = scheduler.predict(tensor, timeout=10.0)
+    scheduler.close(drain=True)
+"""
+
+import bisect
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds (Prometheus-style `le` buckets)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class DeadlineExceeded(concurrent.futures.TimeoutError):
+    """Raised for requests whose deadline passed before they were batched."""
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram with cumulative `le` counts."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = {}
+        running = 0
+        for bound, c in zip(self.buckets, counts):
+            running += c
+            cumulative[str(bound)] = running
+        cumulative['+Inf'] = count
+        return {'buckets': cumulative, 'count': count, 'sum': round(total, 6),
+                'mean': round(total / count, 6) if count else 0.0}
+
+
+class _Request:
+    __slots__ = ('item', 'future', 'enqueued', 'deadline')
+
+    def __init__(self, item, deadline):
+        self.item = item
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.monotonic()
+        self.deadline = deadline
+
+
+class BatchScheduler:
+    """Coalesce concurrent requests into calls to `process_batch(items) -> results`.
+
+    `process_batch` receives a list of submitted items and must return a
+    list of results of the same length and order.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.01, name='batch', num_workers=1):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.name = name
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_waits = Histogram(QUEUE_WAIT_BUCKETS)
+        self.batches = 0
+        self.expired = 0
+        self.errors = 0
+        self._threads = []
+        for i in range(max(1, int(num_workers))):
+            t = threading.Thread(target=self._worker, name=f'{name}-scheduler-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, item, deadline=None):
+        """Queue `item` and return a Future for its result.
+
+        `deadline` is an absolute `time.monotonic()` value; if the request
+        has not been batched by then its future fails with DeadlineExceeded
+        and the item is never run.
+        """
+        req = _Request(item, deadline)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f'{self.name}: scheduler is closed')
+            self._queue.append(req)
+            self._cond.notify()
+        return req.future
+
+    def predict(self, item, timeout=None):
+        """Submit and block for the result; `timeout` also sets the deadline."""
+        deadline = time.monotonic() + timeout if timeout else None
+        return self.submit(item, deadline=deadline).result(timeout=timeout)
+
+    def close(self, drain=True, timeout=None):
+        """Stop accepting requests and shut the workers down.
+
+        With `drain=True` queued requests are still batched and answered;
+        otherwise they fail immediately. Blocks up to `timeout` seconds per
+        worker for in-flight batches to finish.
+        """
+        with self._cond:
+            self._closed = True
+            pending = []
+            if not drain:
+                pending = list(self._queue)
+                self._queue.clear()
+            self._cond.notify_all()
+        for req in pending:
+            if req.future.set_running_or_notify_cancel():
+                req.future.set_exception(RuntimeError(f'{self.name}: scheduler closed'))
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+    def _next_batch(self):
+        """Block for the next batch; returns None once closed and drained."""
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            # Flush when full or when the oldest request hits max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                if not self._queue:  # another worker took them while we waited
+                    break
+                remaining = self._queue[0].enqueued + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            now = time.monotonic()
+            live = []
+            for req in batch:
+                if not req.future.set_running_or_notify_cancel():
+                    continue  # cancelled while queued
+                if req.deadline is not None and now > req.deadline:
+                    with self._stats_lock:
+                        self.expired += 1
+                    req.future.set_exception(DeadlineExceeded(f'{self.name}: deadline exceeded while queued'))
+                else:
+                    live.append(req)
+            if not live:
+                continue
+
+            for req in live:
+                self.queue_waits.observe(now - req.enqueued)
+            self.batch_sizes.observe(len(live))
+            with self._stats_lock:
+                self.batches += 1
+
+            try:
+                results = self.process_batch([req.item for req in live])
+                if len(results) != len(live):
+                    raise RuntimeError(f'{self.name}: batch function returned {len(results)} results for {len(live)} items')
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                logger.exception(f'{self.name}: batch of {len(live)} failed')
+                for req in live:
+                    req.future.set_exception(e)
+                continue
+
+            for req, result in zip(live, results):
+                req.future.set_result(result)
+
+    def get_stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_seconds': self.max_wait,
+            'workers': len(self._threads),
+            'closed': self._closed,
+            'queue_depth': len(self._queue),
+            'batches_total': self.batches,
+            'expired_total': self.expired,
+            'errors_total': self.errors,
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_seconds': self.queue_waits.snapshot()
+        }
+
+
+def runner_batch_fn(runner, pool=None, **predict_kwargs):
+    """Batch function that concatenates per-request tensors for `runner.predict_tensor`.
+
+    Items are normalized `[1, 3, 224, 224]` (or `[3, 224, 224]`) tensors as
+    produced by `serving_utils.preprocess_image`. With a `pool`
+    (`serving_utils.TensorPool`) the batch is assembled in a reused buffer.
+    """
+    def process(tensors):
+        tensors = [t if t.ndim == 4 else t.unsqueeze(0) for t in tensors]
+        if pool is None:
+            return runner.predict_tensor(torch.cat(tensors, dim=0), **predict_kwargs)
+        with pool.batch(len(tensors)) as buf:
+            torch.cat(tensors, dim=0, out=buf)
+            return runner.predict_tensor(buf, **predict_kwargs)
+    return process
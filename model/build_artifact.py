@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Package a fine-tuned checkpoint as a single-file serving artifact.
+
+The artifact bundles the weights and class mapping, with the per-class bias
+and temperature folded into the final linear layer (see `src/artifact.py`).
+It is loaded memory-mapped by `ModelRunner(artifact_path=...)`.
+
+Usage:
+  python build_artifact.py --weights models/leaf_diseases/efficientnet_disease_balanced.pth \
+      --mapping models/leaf_diseases/class_mapping_diseases.json \
+      --bias ../per_class_bias.json --temperature temperature_scaling.json
+"""
+
+import argparse
+from pathlib import Path
+
+from src.inference import load_model_and_mapping
+from src.artifact import read_bias_file, read_temperature_file, save_artifact
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--mapping', required=True)
+    parser.add_argument('--bias', help='per_class_bias.json to bundle')
+    parser.add_argument('--temperature', help='temperature_scaling.json to bundle')
+    parser.add_argument('--out', help='default: <weights stem>_artifact.pt next to the weights')
+    args = parser.parse_args()
+
+    weights = Path(args.weights)
+    out = Path(args.out) if args.out else weights.with_name(weights.stem + '_artifact.pt')
+
+    model, mapping = load_model_and_mapping(str(weights), args.mapping)
+    bias = read_bias_file(args.bias) if args.bias else None
+    temperature = read_temperature_file(args.temperature) if args.temperature else None
+
+    save_artifact(model, mapping, out, per_class_bias=bias, temperature=temperature)
+    print(f'Saved artifact to {out} ({len(mapping)} classes, bias={bias is not None}, temperature={temperature})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Build the shared-backbone multi-head model from the single-task checkpoints.
+
+The trunk and disease head are taken from the disease model. With
+`--finetune`, both heads are re-fitted on top of the frozen shared trunk
+(last-layer training as in `apply_and_finetune_bias.py`). Because the trunk
+is frozen, pooled embeddings are extracted once and the heads are trained
+on those, which takes seconds on CPU.
+
+The copied deficiency head was trained on a different trunk, so the script
+refuses to write a checkpoint unless it was re-fitted (the app loads
+`models/efficientnet_multihead.pth` automatically). Pass `--allow-unfitted`
+to save one anyway for experiments. Fine-tune on a training split, never on
+`test_dataset/`, which is what the heads are evaluated on.
+
+Before saving, both heads are scored on the held-out `test_dataset/` images
+next to the separate single-task models (saved per-class bias applied, as
+the app serves them). A head that scores below its separate model, or a
+missing held-out set, stops the save unless `--allow-regression` is passed.
+
+Usage:
+  python build_multihead.py --finetune
+  python build_multihead.py --finetune --disease_dir train_dataset/diseases --deficiency_dir train_dataset/deficiencies --out models/efficientnet_multihead.pth
+"""
+
+import argparse
+from pathlib import Path
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from src.inference import VAL_TRANSFORM, load_model_and_mapping, _apply_saved_bias_to_model
+from src.datasets import collect_paths_labels
+from src.multi_head import build_from_checkpoints, save_multihead
+
+
+def _batches(paths, batch_size):
+    for i in range(0, len(paths), batch_size):
+        yield torch.stack([VAL_TRANSFORM(Image.open(p).convert('RGB')) for p in paths[i:i + batch_size]])
+
+
+def extract_embeddings(model, paths, batch_size=16):
+    embs = []
+    # no_grad rather than inference_mode: the embeddings are reused as
+    # autograd inputs when the heads are fine-tuned.
+    with torch.no_grad():
+        for batch in _batches(paths, batch_size):
+            embs.append(model.embed(batch))
+    return torch.cat(embs) if embs else torch.empty(0, 1280)
+
+
+def single_model_accuracy(weights, mapping_path, paths, labels, batch_size=16):
+    """Accuracy of a separate single-task model, served as `TorchClassifier` serves it."""
+    if len(labels) == 0:
+        return float('nan')
+    model, _ = load_model_and_mapping(weights, mapping_path)
+    _apply_saved_bias_to_model(model, weights)
+    preds = []
+    with torch.inference_mode():
+        for batch in _batches(paths, batch_size):
+            preds.append(model(batch).argmax(dim=1))
+    return float((torch.cat(preds) == labels).float().mean())
+
+
+def head_accuracy(head, embs, labels):
+    if len(labels) == 0:
+        return float('nan')
+    head.eval()
+    with torch.inference_mode():
+        preds = head(embs).argmax(dim=1)
+    return float((preds == labels).float().mean())
+
+
+def finetune_head(head, embs, labels, epochs=50, lr=1e-3):
+    head.train()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=1e-4)
+    criterion = nn.CrossEntropyLoss()
+    for epoch in range(epochs):
+        perm = torch.randperm(len(labels))
+        total = 0.0
+        for i in range(0, len(labels), 32):
+            idx = perm[i:i + 32]
+            optimizer.zero_grad()
+            loss = criterion(head(embs[idx]), labels[idx])
+            loss.backward()
+            optimizer.step()
+            total += float(loss.item()) * len(idx)
+        if (epoch + 1) % 10 == 0:
+            print(f'  epoch {epoch + 1}/{epochs} - loss: {total / len(labels):.4f}')
+    head.eval()
+
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--disease_weights', default=str(root / 'models' / 'leaf_diseases' / 'efficientnet_disease_balanced.pth'))
+    parser.add_argument('--disease_mapping', default=str(root / 'models' / 'leaf_diseases' / 'class_mapping_diseases.json'))
+    parser.add_argument('--deficiency_weights', default=str(root / 'models' / 'leaf_deficiencies' / 'efficientnet_deficiency_balanced.pth'))
+    parser.add_argument('--deficiency_mapping', default=str(root / 'models' / 'leaf_deficiencies' / 'class_mapping_deficiencies.json'))
+    parser.add_argument('--disease_dir', default=str(root / 'train_dataset' / 'diseases'))
+    parser.add_argument('--deficiency_dir', default=str(root / 'train_dataset' / 'deficiencies'))
+    parser.add_argument('--val_disease_dir', default=str(root / 'test_dataset' / 'diseases'))
+    parser.add_argument('--val_deficiency_dir', default=str(root / 'test_dataset' / 'deficiencies'))
+    parser.add_argument('--finetune', action='store_true', help='re-fit both heads on the shared frozen trunk')
+    parser.add_argument('--allow-unfitted', action='store_true',
+                        help='save even if the deficiency head was not re-fitted on the shared trunk')
+    parser.add_argument('--allow-regression', action='store_true',
+                        help='save even if a head scores below its separate model on the held-out set')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--out', default=str(root / 'models' / 'efficientnet_multihead.pth'))
+    args = parser.parse_args()
+
+    model, disease_mapping, deficiency_mapping = build_from_checkpoints(
+        args.disease_weights, args.disease_mapping, args.deficiency_weights, args.deficiency_mapping
+    )
+
+    refitted = set()
+    for name, head, data_dir, mapping in [
+        ('disease', model.disease_head, args.disease_dir, disease_mapping),
+        ('deficiency', model.deficiency_head, args.deficiency_dir, deficiency_mapping),
+    ]:
+        paths, labels = collect_paths_labels(data_dir, mapping)
+        if not paths:
+            print(f'No {name} images found at {data_dir}; keeping copied head')
+            continue
+        embs = extract_embeddings(model, paths)
+        labels = torch.tensor(labels, dtype=torch.long)
+        print(f'{name} head accuracy on shared trunk: {head_accuracy(head, embs, labels):.4f} ({len(paths)} images)')
+        if args.finetune:
+            finetune_head(head, embs, labels, epochs=args.epochs)
+            refitted.add(name)
+            print(f'{name} head accuracy after fine-tuning: {head_accuracy(head, embs, labels):.4f}')
+
+    # The disease head shares its original trunk; the deficiency head does not
+    if 'deficiency' not in refitted and not args.allow_unfitted:
+        print('Deficiency head was not re-fitted on the shared trunk; not saving. '
+              'Run with --finetune and a deficiency training set, or pass --allow-unfitted.')
+        return 1
+
+    regressions = []
+    for name, head, val_dir, weights, mapping_path, mapping in [
+        ('disease', model.disease_head, args.val_disease_dir, args.disease_weights, args.disease_mapping, disease_mapping),
+        ('deficiency', model.deficiency_head, args.val_deficiency_dir, args.deficiency_weights, args.deficiency_mapping, deficiency_mapping),
+    ]:
+        paths, labels = collect_paths_labels(val_dir, mapping)
+        if not paths:
+            print(f'No held-out {name} images found at {val_dir}')
+            regressions.append(name)
+            continue
+        labels = torch.tensor(labels, dtype=torch.long)
+        multi_acc = head_accuracy(head, extract_embeddings(model, paths), labels)
+        single_acc = single_model_accuracy(weights, mapping_path, paths, labels)
+        print(f'{name} held-out accuracy: multi-head {multi_acc:.4f} vs separate model {single_acc:.4f} ({len(paths)} images)')
+        if multi_acc < single_acc:
+            regressions.append(name)
+
+    if regressions and not args.allow_regression:
+        print(f'Multi-head model is below the separate models or unchecked for: {", ".join(regressions)}; not saving. '
+              'Pass --allow-regression to save anyway.')
+        return 1
+
+    save_multihead(model, disease_mapping, deficiency_mapping, args.out)
+    print('Saved multi-head model to', args.out)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
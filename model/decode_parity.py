@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Measure reduced-size decoding (JPEG draft / PNG-WebP reduce) against full decoding.
+
+Each image is re-encoded at phone-camera resolution (`--long_side`, 4032 by
+default) as JPEG, PNG and WebP, then decoded both ways and preprocessed.
+Reports decode+preprocess time, the input-tensor difference and, when a
+model is given, top-1 agreement and max probability difference.
+
+Usage:
+  python decode_parity.py
+  python decode_parity.py --data test_dataset/diseases --pth models/leaf_diseases/efficientnet_disease_balanced.pth \
+      --mapping models/leaf_diseases/class_mapping_diseases.json
+"""
+
+import argparse
+import io
+import json
+import statistics
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from src.preprocessing import decode_image, preprocess_pil
+
+ROOT = Path(__file__).resolve().parent
+FORMATS = {'JPEG': {'quality': 92}, 'PNG': {}, 'WEBP': {'quality': 92}}
+
+
+def _encode(image, fmt, long_side):
+    scale = long_side / max(image.size)
+    big = image.resize((round(image.width * scale), round(image.height * scale)), Image.BICUBIC)
+    buf = io.BytesIO()
+    big.save(buf, fmt, **FORMATS[fmt])
+    return buf.getvalue()
+
+
+def _timed(data, **kw):
+    t0 = time.perf_counter()
+    tensor = preprocess_pil(decode_image(data, **kw))
+    return tensor, (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=str(ROOT / 'test_dataset'))
+    parser.add_argument('--limit', type=int, default=40)
+    parser.add_argument('--long_side', type=int, default=4032)
+    parser.add_argument('--pth', help='optional model weights for prediction parity')
+    parser.add_argument('--mapping')
+    args = parser.parse_args()
+
+    runner = None
+    if args.pth:
+        from serving_utils import ModelRunner
+        runner = ModelRunner(pth_path=args.pth, mapping_path=args.mapping)
+
+    paths = sorted(Path(args.data).rglob('*.jpg'))[:args.limit]
+    if not paths:
+        print('No images found under', args.data)
+        return
+
+    report = {}
+    for fmt in FORMATS:
+        full_ms, fast_ms, diffs, agree, prob_diffs = [], [], [], [], []
+        for p in paths:
+            data = _encode(Image.open(p).convert('RGB'), fmt, args.long_side)
+            full, t_full = _timed(data, draft=False, reduce=False)
+            fast, t_fast = _timed(data, draft=True, reduce=True)
+            full_ms.append(t_full)
+            fast_ms.append(t_fast)
+            diffs.append(float((full - fast).abs().mean()))
+            if runner is not None:
+                a = runner.predict_tensor(full, top_k=0, return_probs=True)[0]
+                b = runner.predict_tensor(fast, top_k=0, return_probs=True)[0]
+                agree.append(a['class_index'] == b['class_index'])
+                prob_diffs.append(max(abs(x - y) for x, y in zip(a['probabilities'], b['probabilities'])))
+        report[fmt] = {
+            'images': len(paths),
+            'full_decode_ms_p50': round(statistics.median(full_ms), 2),
+            'reduced_decode_ms_p50': round(statistics.median(fast_ms), 2),
+            'input_mean_abs_diff': round(statistics.mean(diffs), 5),
+        }
+        if agree:
+            report[fmt]['top1_agreement'] = round(sum(agree) / len(agree), 4)
+            report[fmt]['max_prob_diff'] = round(max(prob_diffs), 5)
+        print(fmt, json.dumps(report[fmt]))
+
+    out = ROOT / 'evaluation_results' / 'decode_parity.json'
+    out.parent.mkdir(exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print('Saved decode parity report to', out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Export every serving variant of both models, verify parity and write a manifest.
+
+For each of the disease and deficiency checkpoints the `.pth` is loaded once
+and exported next to the weights as:
+- `<name>_scripted.pt`  — torch.jit.script
+- `<name>_traced.pt`    — torch.jit.trace
+- `<name>_quantized.pt` — static int8 (see `export_torchscript.quantize_static`)
+- `<name>.onnx`         — dynamic-batch ONNX
+
+Each variant is written to a temporary file and compared with the fp32
+`.pth` model on held-out `test_dataset/` images that were not used for int8
+calibration (max absolute logit difference and top-1 agreement). Only
+variants that pass are moved into place and benchmarked in a fresh process
+(batch-1 latency and resident memory after load); failing ones are deleted,
+as is an int8 model that is not clearly faster than the scripted one,
+since `ModelRunner` also picks up the fixed `_quantized.pt`/`_scripted.pt`
+paths without consulting the manifest. Everything is recorded in `models/export_manifest.json`, which
+`ModelRunner(manifest_path=..., manifest_name=...)` uses to serve the fastest
+variant that passed.
+
+Usage:
+  python export_all.py
+  python export_all.py --models disease --bias disease=../per_class_bias.json --runs 50
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import torch
+
+from src.inference import load_model_and_mapping, fold_calibration
+from src.artifact import read_bias_file, read_temperature_file
+from src.datasets import load_calibration_set
+from export_torchscript import quantize_static
+from onnx_export import export_onnx_model
+from serving_utils import load_variant
+
+ROOT = Path(__file__).resolve().parent
+
+MODELS = {
+    'disease': {
+        'weights': ROOT / 'models' / 'leaf_diseases' / 'efficientnet_disease_balanced.pth',
+        'mapping': ROOT / 'models' / 'leaf_diseases' / 'class_mapping_diseases.json',
+        'data': ROOT / 'test_dataset' / 'diseases',
+    },
+    'deficiency': {
+        'weights': ROOT / 'models' / 'leaf_deficiencies' / 'efficientnet_deficiency_balanced.pth',
+        'mapping': ROOT / 'models' / 'leaf_deficiencies' / 'class_mapping_deficiencies.json',
+        'data': ROOT / 'test_dataset' / 'deficiencies',
+    },
+}
+
+# Parity thresholds per variant. Float variants must reproduce the logits;
+# int8 is only held to top-1 agreement.
+PARITY = {
+    'scripted': {'max_logit_diff': 1e-3, 'min_top1_agreement': 1.0},
+    'traced': {'max_logit_diff': 1e-3, 'min_top1_agreement': 1.0},
+    'onnx': {'max_logit_diff': 1e-3, 'min_top1_agreement': 1.0},
+    'quantized': {'max_logit_diff': None, 'min_top1_agreement': 0.95},
+}
+
+# `ModelRunner` loads `_quantized.pt` ahead of `_scripted.pt` whenever it
+# exists, so the int8 file is only kept if it is at least this much faster
+MIN_QUANT_SPEEDUP = 1.1
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _export_variant(kind, model, example, sample, path):
+    if kind == 'scripted':
+        torch.jit.script(model).save(str(path))
+    elif kind == 'traced':
+        with torch.no_grad():
+            torch.jit.trace(model, example).save(str(path))
+    elif kind == 'quantized':
+        torch.jit.save(torch.jit.script(quantize_static(model, sample)), str(path))
+    elif kind == 'onnx':
+        export_onnx_model(model, example, path)
+
+
+def export_checked(kind, model, example, calib, holdout, reference_logits, path):
+    """Export one variant and keep it at `path` only if it passes the parity gate on `holdout`."""
+    tmp = path.with_name(f'{path.stem}.tmp{path.suffix}')
+    try:
+        _export_variant(kind, model, example, calib, tmp)
+        result = check_parity(kind, tmp, reference_logits, holdout)
+        if result['passed']:
+            os.replace(tmp, path)
+        else:
+            # Never leave a failed (or stale, from an earlier export) variant where the runner looks for it
+            path.unlink(missing_ok=True)
+        return result
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def check_parity(kind, path, reference_logits, sample):
+    """Max |logit diff| and top-1 agreement of an exported variant against the fp32 reference."""
+    variant = load_variant(kind, path)
+    with torch.inference_mode():
+        logits = variant(sample)
+    diff = float((logits - reference_logits).abs().max())
+    agreement = float((logits.argmax(dim=1) == reference_logits.argmax(dim=1)).float().mean())
+    limits = PARITY[kind]
+    passed = agreement >= limits['min_top1_agreement'] and (
+        limits['max_logit_diff'] is None or diff <= limits['max_logit_diff'])
+    return {'max_logit_diff': round(diff, 6), 'top1_agreement': round(agreement, 4), 'passed': passed}
+
+
+def benchmark_variant(kind, path, mapping_path=None, runs=30):
+    """Batch-1 latency and RSS after load; run in a fresh process so memory is per variant."""
+    rss_before = _rss_mb()
+    if kind == 'pth':
+        model, _ = load_model_and_mapping(str(path), str(mapping_path))
+    else:
+        model = load_variant(kind, path)
+    x = torch.randn(1, 3, 224, 224)
+    times = []
+    with torch.inference_mode():
+        for _ in range(3):
+            model(x)
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            model(x)
+            times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {
+        'latency_ms': {'p50': round(statistics.median(times), 3), 'p90': round(times[int(0.9 * (len(times) - 1))], 3)},
+        'rss_mb': round(_rss_mb(), 1),
+        'load_rss_mb': round(_rss_mb() - rss_before, 1),
+    }
+
+
+def _benchmark_isolated(kind, path, mapping_path, runs):
+    ctx = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(benchmark_variant, kind, str(path), str(mapping_path), runs).result()
+
+
+def export_model(name, cfg, manifest_dir, sample_size=64, runs=30, per_class_bias=None, temperature=None):
+    """Export, verify and benchmark all variants of one model; returns its manifest entry."""
+    model, mapping = load_model_and_mapping(str(cfg['weights']), str(cfg['mapping']))
+    fold_calibration(model, per_class_bias, temperature)
+    model.eval()
+
+    # Interleave so both halves cover the same classes: one calibrates int8, the other gates every variant
+    images, _ = load_calibration_set(cfg['data'], mapping, limit=2 * sample_size)
+    if images is None or len(images) < 2:
+        print(f'{name}: no test_dataset images at {cfg["data"]}; using random inputs for parity')
+        images = torch.randn(16, 3, 224, 224)
+    calib, holdout = images[0::2], images[1::2]
+    with torch.inference_mode():
+        reference_logits = model(holdout)
+
+    weights = Path(cfg['weights'])
+    entry = {
+        'reference': {'path': os.path.relpath(weights, manifest_dir), **_benchmark_isolated('pth', weights, cfg['mapping'], runs)},
+        'calibration_images': len(calib),
+        'sample_images': len(holdout),
+        'variants': {},
+    }
+    suffixes = {'scripted': '_scripted.pt', 'traced': '_traced.pt', 'quantized': '_quantized.pt', 'onnx': '.onnx'}
+    for kind, suffix in suffixes.items():
+        path = weights.with_name(weights.stem + suffix)
+        try:
+            result = export_checked(kind, model, holdout[:1], calib, holdout, reference_logits, path)
+            if result['passed']:
+                result.update(_benchmark_isolated(kind, path, cfg['mapping'], runs))
+        except Exception as e:
+            result = {'passed': False, 'error': str(e)}
+        entry['variants'][kind] = {'path': os.path.relpath(path, manifest_dir), **result}
+        print(f'{name} {kind}: {json.dumps(result)}')
+
+    quantized, scripted = entry['variants'].get('quantized', {}), entry['variants'].get('scripted', {})
+    if quantized.get('passed') and scripted.get('passed'):
+        speedup = scripted['latency_ms']['p50'] / quantized['latency_ms']['p50']
+        if speedup < MIN_QUANT_SPEEDUP:
+            weights.with_name(weights.stem + suffixes['quantized']).unlink(missing_ok=True)
+            quantized.update(passed=False, error=f'only {speedup:.2f}x faster than scripted (< {MIN_QUANT_SPEEDUP}x)')
+            print(f'{name} quantized: removed, {quantized["error"]}')
+
+    passed = {k: v for k, v in entry['variants'].items() if v.get('passed')}
+    entry['selected'] = min(passed, key=lambda k: passed[k]['latency_ms']['p50']) if passed else None
+    return entry
+
+
+def _per_model(values, reader):
+    out = {}
+    for item in values or []:
+        name, path = item.split('=', 1)
+        out[name] = reader(path)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), default=list(MODELS))
+    parser.add_argument('--sample', type=int, default=64, help='test_dataset images used for the parity check (as many again calibrate int8)')
+    parser.add_argument('--runs', type=int, default=30, help='timed batch-1 runs per variant')
+    parser.add_argument('--bias', action='append', help='NAME=per_class_bias.json to fold into that model, e.g. disease=../per_class_bias.json')
+    parser.add_argument('--temperature', action='append', help='NAME=temperature_scaling.json to fold into that model')
+    parser.add_argument('--out', default=str(ROOT / 'models' / 'export_manifest.json'))
+    args = parser.parse_args()
+
+    biases = _per_model(args.bias, read_bias_file)
+    temperatures = _per_model(args.temperature, read_temperature_file)
+
+    manifest = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'torch_version': torch.__version__,
+        'parity_thresholds': PARITY,
+        'models': {},
+    }
+    for name in args.models:
+        if not MODELS[name]['weights'].exists():
+            print(f'{name}: weights not found at {MODELS[name]["weights"]}; skipping')
+            continue
+        manifest['models'][name] = export_model(name, MODELS[name], Path(args.out).resolve().parent,
+                                                sample_size=args.sample, runs=args.runs,
+                                                per_class_bias=biases.get(name), temperature=temperatures.get(name))
+        print(f'{name}: selected {manifest["models"][name]["selected"]}')
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print('Wrote manifest to', args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,42 @@
 #!/usr/bin/env python3
-"""Export models to TorchScript and create a dynamic-quantized CPU-friendly model.
+"""Export models to TorchScript and create an int8-quantized CPU-friendly model.
 
 Produces two files under `models/` next to the source weights:
 - `<name>_scripted.pt` — scripted (or traced) TorchScript model
-- `<name>_quantized.pt` — dynamically quantized model for CPU (if applicable)
+- `<name>_quantized.pt` — quantized model for CPU, loaded by `ModelRunner`'s quant path
+
+`--quant static` (default) runs FX graph-mode post-training static
+quantization of the whole network, conv trunk included, with observers
+calibrated on half of the `test_dataset/` images. The result is only
+written if its top-1 accuracy on the other, held-out half is within
+`--max_drop` of the fp32 model (or, for unlabelled images, if it agrees
+with fp32 that often), and if its scripted batch-1 latency beats the
+scripted fp32 model by `--min_speedup`; otherwise any earlier
+`_quantized.pt` is removed, since `ModelRunner` loads that file ahead of
+the scripted one whenever it exists. `--quant dynamic` keeps the old
+Linear-only dynamic quantization.
+
+`--bias` / `--temperature` fold a per_class_bias.json and a
+temperature_scaling.json into the final linear layer before export, so the
+served model needs no calibration step at runtime.
 """
 
 from pathlib import Path
+import copy
+import json
+import statistics
+import time
 import torch
-from src.inference import load_model_and_mapping, VAL_TRANSFORM
+from src.inference import load_model_and_mapping, fold_calibration, VAL_TRANSFORM
+from src.artifact import read_bias_file, read_temperature_file
+from src.datasets import load_calibration_set
 from PIL import Image
 import argparse
 
 
-def load_and_script(weights_path, mapping_path, out_path_script, example_image=None):
+def load_and_script(weights_path, mapping_path, out_path_script, example_image=None, per_class_bias=None, temperature=None):
     model, mapping = load_model_and_mapping(weights_path, mapping_path)
+    fold_calibration(model, per_class_bias, temperature)
     model.eval()
 
     # Try scripting; fall back to tracing with an example input
@@ -42,11 +64,112 @@ def export_quantized(cpu_model, out_path_quantized):
         return False
 
 
+def quantization_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f'No int8 CPU backend available (supported: {engines})')
+
+
+def quantize_static(cpu_model, calib_inputs, batch_size=16):
+    """Post-training static int8 quantization (FX graph mode) calibrated on `calib_inputs`.
+
+    Ops without an int8 kernel (SiLU, the squeeze-excitation sigmoid) are
+    left in fp32 by FX with quant/dequant around them; the convolutions,
+    which are nearly all of EfficientNet-B0's FLOPs, run in int8.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = quantization_engine()
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(cpu_model).eval()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(calib_inputs[:1],))
+    with torch.inference_mode():
+        for i in range(0, len(calib_inputs), batch_size):
+            prepared(calib_inputs[i:i + batch_size])
+    return convert_fx(prepared)
+
+
+def accuracy_gate(fp32_model, quant_model, inputs, labels=None, max_drop=0.02):
+    """Compare top-1 of the quantized model against fp32; `passed` if the drop is within `max_drop`."""
+    with torch.inference_mode():
+        ref = fp32_model(inputs).argmax(dim=1)
+        pred = quant_model(inputs).argmax(dim=1)
+    report = {'images': len(inputs), 'top1_agreement': round(float((ref == pred).float().mean()), 4)}
+    if labels is not None:
+        report['fp32_accuracy'] = round(float((ref == labels).float().mean()), 4)
+        report['int8_accuracy'] = round(float((pred == labels).float().mean()), 4)
+        drop = report['fp32_accuracy'] - report['int8_accuracy']
+    else:
+        drop = 1.0 - report['top1_agreement']
+    report['drop'] = round(drop, 4)
+    report['passed'] = drop <= max_drop
+    return report
+
+
+def _p50_ms(model, x, runs):
+    times = []
+    with torch.inference_mode():
+        for _ in range(3):
+            model(x)
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            model(x)
+            times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def latency_gate(fp32_scripted, quant_scripted, example, runs=30, min_speedup=1.1):
+    """Batch-1 p50 latency of both scripted models; `passed` if int8 is `min_speedup` times faster."""
+    fp32_ms = _p50_ms(fp32_scripted, example, runs)
+    int8_ms = _p50_ms(quant_scripted, example, runs)
+    speedup = fp32_ms / int8_ms if int8_ms > 0 else float('inf')
+    return {'fp32_ms': round(fp32_ms, 3), 'int8_ms': round(int8_ms, 3), 'speedup': round(speedup, 3),
+            'passed': speedup >= min_speedup}
+
+
+def export_static_quantized(cpu_model, calib_inputs, out_path_quantized, gate_inputs=None, labels=None, max_drop=0.02,
+                            force=False, min_speedup=1.1, latency_runs=30):
+    """Quantize, gate against fp32 on `gate_inputs` and save as TorchScript. Returns the gate report.
+
+    `labels` belong to `gate_inputs`, which default to the calibration inputs.
+    A model that passes the accuracy gate must also run at least
+    `min_speedup` times faster than the scripted fp32 model (`report['latency']`).
+    A rejected model is not written and removes any earlier file at
+    `out_path_quantized`, which `ModelRunner` would otherwise still load.
+    """
+    quantized = quantize_static(cpu_model, calib_inputs)
+    gate_inputs = calib_inputs if gate_inputs is None else gate_inputs
+    report = accuracy_gate(cpu_model, quantized, gate_inputs, labels, max_drop=max_drop)
+    report['accuracy_passed'] = report['passed']
+    scripted = torch.jit.script(quantized)
+    if report['passed']:
+        report['latency'] = latency_gate(torch.jit.script(cpu_model), scripted, gate_inputs[:1],
+                                         runs=latency_runs, min_speedup=min_speedup)
+        report['passed'] = report['latency']['passed']
+    if report['passed'] or force:
+        torch.jit.save(scripted, out_path_quantized)
+    else:
+        Path(out_path_quantized).unlink(missing_ok=True)
+    return report
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--weights', required=True)
     parser.add_argument('--mapping', required=True)
     parser.add_argument('--example', required=False, help='Path to example image for tracing fallback')
+    parser.add_argument('--bias', help='per_class_bias.json to fold into the exported model')
+    parser.add_argument('--temperature', help='temperature_scaling.json to fold into the exported model')
+    parser.add_argument('--quant', choices=['static', 'dynamic', 'none'], default='static')
+    parser.add_argument('--calib_dir', help='class-folder images for calibration (default: matching test_dataset/ split)')
+    parser.add_argument('--calib_limit', type=int, default=256)
+    parser.add_argument('--max_drop', type=float, default=0.02, help='max allowed top-1 accuracy drop vs fp32')
+    parser.add_argument('--min_speedup', type=float, default=1.1,
+                        help='min batch-1 speedup of scripted int8 over scripted fp32 required to save it')
+    parser.add_argument('--force', action='store_true', help='save the static model even if a gate fails')
     args = parser.parse_args()
 
     weights = Path(args.weights)
@@ -55,15 +178,45 @@ def main():
     out_script = weights.with_name(weights.stem + '_scripted.pt')
     out_quant = weights.with_name(weights.stem + '_quantized.pt')
 
-    model = load_and_script(str(weights), str(mapping), str(out_script), example_image=args.example)
+    model = load_and_script(str(weights), str(mapping), str(out_script), example_image=args.example,
+                            per_class_bias=read_bias_file(args.bias) if args.bias else None,
+                            temperature=read_temperature_file(args.temperature) if args.temperature else None)
 
     # Move model to CPU for quantization
     model_cpu = model.to('cpu')
-    ok = export_quantized(model_cpu, str(out_quant))
-    if ok:
+    if args.quant == 'none':
+        print('Scripted model saved at', out_script)
+        return
+    if args.quant == 'dynamic':
+        if export_quantized(model_cpu, str(out_quant)):
+            print('Exported scripted and quantized models:', out_script, out_quant)
+        else:
+            print('Scripted model saved at', out_script)
+        return
+
+    with open(mapping, 'r', encoding='utf-8') as f:
+        class_mapping = json.load(f)
+    calib_dir = args.calib_dir or str(Path(__file__).resolve().parent / 'test_dataset' /
+                                      ('deficiencies' if 'deficien' in mapping.name else 'diseases'))
+    inputs, labels = load_calibration_set(calib_dir, class_mapping, limit=args.calib_limit)
+    if inputs is None:
+        print('No calibration images found at', calib_dir, '- scripted model saved at', out_script)
+        return
+    if len(inputs) < 2:
+        print('Need at least two calibration images at', calib_dir, '- scripted model saved at', out_script)
+        return
+    # Interleaved halves: one calibrates the observers, the held-out one gates accuracy
+    report = export_static_quantized(model_cpu, inputs[0::2], str(out_quant), gate_inputs=inputs[1::2],
+                                     labels=labels[1::2], max_drop=args.max_drop, force=args.force,
+                                     min_speedup=args.min_speedup)
+    print('Static int8 gates:', json.dumps(report))
+    if report['passed'] or args.force:
         print('Exported scripted and quantized models:', out_script, out_quant)
+    elif not report['accuracy_passed']:
+        print(f'Quantized model rejected (top-1 drop {report["drop"]} > {args.max_drop}); scripted model saved at', out_script)
     else:
-        print('Scripted model saved at', out_script)
+        print(f'Quantized model rejected (speedup {report["latency"]["speedup"]}x < {args.min_speedup}x); '
+              'scripted model saved at', out_script)
 
 
 if __name__ == '__main__':
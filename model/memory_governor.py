@@ -0,0 +1,183 @@
+"""Threshold-driven memory management for the 512MB serving instances.
+
+Instead of a full `gc.collect()` after every request, `MemoryGovernor.check()`
+reads the process RSS (cheap, rate-limited by `check_interval`) and acts
+only when it crosses a threshold:
+
+- above `soft_limit_mb`: run a garbage collection;
+- above `hard_limit_mb`: also clear every registered cache (preprocessed
+  tensors, pooled batch buffers, ...) and return freed heap to the OS.
+
+With the models and torch loaded, steady-state RSS can sit above a fixed
+limit and rarely drops after a collection. Two things keep the governor
+from collecting (and wiping caches) on every check in that state:
+`set_baseline()` records the post-load RSS and raises each limit to at
+least `baseline + headroom`, never past `max_mb` (the configured hard limit
+by default, so the container's OOM killer is not reached first); and an action that frees less than
+`min_freed_mb` backs off exponentially (up to `max_backoff` seconds) unless
+RSS grows by another `min_freed_mb` in the meantime.
+
+Every check and action is counted and exposed through `get_stats()`, along
+with the tensor bytes held by registered caches, so the decisions show up
+on `/metrics`.
+"""
+
+import ctypes
+import gc
+import logging
+import os
+import threading
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux /proc, falling back to peak RSS)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _malloc_trim():
+    # glibc keeps freed tensor memory in its arenas; hand it back to the OS
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+        return True
+    except Exception:
+        return False
+
+
+class MemoryGovernor:
+    def __init__(self, soft_limit_mb=380, hard_limit_mb=450, check_interval=1.0,
+                 soft_headroom_mb=64, hard_headroom_mb=128, min_freed_mb=8, max_backoff=300, max_mb=None):
+        self.soft_limit_mb = soft_limit_mb
+        self.hard_limit_mb = hard_limit_mb
+        self.max_mb = hard_limit_mb if max_mb is None else max_mb
+        self.check_interval = check_interval
+        self.soft_headroom_mb = soft_headroom_mb
+        self.hard_headroom_mb = hard_headroom_mb
+        self.min_freed_mb = min_freed_mb
+        self.max_backoff = max_backoff
+        self.baseline_mb = None
+        self._trimmers = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._backoff = 0.0
+        self._backoff_until = 0.0
+        self._backoff_rss = 0.0
+        self.checks = 0
+        self.collections = 0
+        self.trims = 0
+        self.backoffs = 0
+        self.gc_seconds = 0.0
+        self.last_rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        self.last_action = None
+
+    def register_trim(self, name, trim, size=None, nbytes=None):
+        """Register a cache: `trim()` empties it, optional `size()` reports its current size
+        and optional `nbytes()` the tensor memory it holds."""
+        self._trimmers[name] = (trim, size, nbytes)
+
+    def set_baseline(self, rss=None):
+        """Record the post-load RSS (current RSS by default) that the headroom limits are relative to."""
+        self.baseline_mb = rss_mb() if rss is None else rss
+        if self.baseline_mb >= self.max_mb:
+            logger.warning(f'Post-load RSS {self.baseline_mb:.0f}MB is already at or above the {self.max_mb:.0f}MB '
+                           'memory ceiling; limits stay capped there and caches will be trimmed on every check')
+
+    def limits(self):
+        """Effective `(soft, hard)` limits in MB: the configured ones, raised to
+        baseline + headroom but capped at `max_mb`."""
+        soft, hard = self.soft_limit_mb, self.hard_limit_mb
+        if self.baseline_mb is not None:
+            soft = max(soft, min(self.baseline_mb + self.soft_headroom_mb, self.max_mb))
+            hard = max(hard, min(self.baseline_mb + self.hard_headroom_mb, self.max_mb))
+        return soft, hard
+
+    def check(self, force=False):
+        """Act on the current RSS if due; returns the action taken (None, 'collect' or 'trim').
+
+        `force` skips both the rate limit and the backoff.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_check < self.check_interval:
+                return None
+            self._last_check = now
+            self.checks += 1
+
+        rss = rss_mb()
+        self.last_rss_mb = rss
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        soft, hard = self.limits()
+        if rss < soft:
+            return None
+        if not force and now < self._backoff_until and rss < self._backoff_rss + self.min_freed_mb:
+            # The last action freed next to nothing and RSS has not grown since
+            return None
+
+        action = 'collect'
+        t0 = time.perf_counter()
+        if rss >= hard:
+            action = 'trim'
+            for name, (trim, _, _) in list(self._trimmers.items()):
+                try:
+                    trim()
+                except Exception as e:
+                    logger.warning(f'Memory trim {name} failed: {e}')
+            self.trims += 1
+        gc.collect()
+        if action == 'trim':
+            _malloc_trim()
+        self.collections += 1
+        self.gc_seconds += time.perf_counter() - t0
+        rss_after = rss_mb()
+        if rss - rss_after < self.min_freed_mb:
+            self._backoff = min(self.max_backoff, self._backoff * 2 if self._backoff else max(self.check_interval, 1.0) * 2)
+            self._backoff_until = time.monotonic() + self._backoff
+            self._backoff_rss = rss_after
+            self.backoffs += 1
+        else:
+            self._backoff = self._backoff_until = 0.0
+        self.last_action = {'action': action, 'rss_mb': round(rss, 1), 'rss_after_mb': round(rss_after, 1),
+                            'backoff_seconds': self._backoff, 'timestamp': time.time()}
+        logger.info(f"Memory governor: {action} at {rss:.0f}MB -> {rss_after:.0f}MB")
+        return action
+
+    def get_stats(self):
+        caches, tensors = {}, {}
+        for name, (_, size, nbytes) in self._trimmers.items():
+            for out, fn in ((caches, size), (tensors, nbytes)):
+                if fn is not None:
+                    try:
+                        out[name] = fn()
+                    except Exception:
+                        out[name] = None
+        soft, hard = self.limits()
+        stats = {
+            'rss_mb': round(rss_mb(), 1),
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            'baseline_mb': None if self.baseline_mb is None else round(self.baseline_mb, 1),
+            'soft_limit_mb': round(soft, 1),
+            'hard_limit_mb': round(hard, 1),
+            'max_mb': round(self.max_mb, 1),
+            'checks_total': self.checks,
+            'collections_total': self.collections,
+            'trims_total': self.trims,
+            'backoffs_total': self.backoffs,
+            'backoff_seconds': self._backoff,
+            'gc_seconds_total': round(self.gc_seconds, 4),
+            'last_action': self.last_action,
+            'caches': caches,
+            'tensor_mb': {name: None if n is None else round(n / 1024 / 1024, 2) for name, n in tensors.items()},
+        }
+        if torch.cuda.is_available():
+            stats['cuda_allocated_mb'] = round(torch.cuda.memory_allocated() / 1024 / 1024, 1)
+        return stats
@@ -2,23 +2,34 @@
 
 Usage:
   python onnx_export.py --weights <weights.pth> --mapping <mapping.json> --example <image.jpg>
+  python onnx_export.py ... --bias per_class_bias.json --temperature temperature_scaling.json
+
+Bias and temperature are folded into the final linear layer before export.
 """
 from pathlib import Path
 import torch
-from src.inference import load_model_and_mapping, VAL_TRANSFORM
+from src.inference import load_model_and_mapping, fold_calibration, VAL_TRANSFORM
+from src.artifact import read_bias_file, read_temperature_file
 from PIL import Image
 import argparse
 
 
-def export_onnx(weights, mapping, example_image, out_path=None):
-    model, mapping = load_model_and_mapping(weights, mapping)
+def export_onnx_model(model, example_input, out_path):
+    """Export an already-loaded model with a dynamic batch axis (input `input`, output `output`)."""
     model.eval()
+    torch.onnx.export(model, example_input, str(out_path), opset_version=13, input_names=['input'], output_names=['output'], dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    return out_path
+
+
+def export_onnx(weights, mapping, example_image, out_path=None, per_class_bias=None, temperature=None):
+    model, mapping = load_model_and_mapping(weights, mapping)
+    fold_calibration(model, per_class_bias, temperature)
     img = Image.open(example_image).convert('RGB')
     inp = VAL_TRANSFORM(img).unsqueeze(0)
     if out_path is None:
         out_path = Path(weights).with_name(Path(weights).stem + '.onnx')
 
-    torch.onnx.export(model, inp, str(out_path), opset_version=13, input_names=['input'], output_names=['output'], dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    export_onnx_model(model, inp, out_path)
     print('Exported ONNX to', out_path)
     return out_path
 
@@ -28,8 +39,12 @@ def main():
     parser.add_argument('--weights', required=True)
     parser.add_argument('--mapping', required=True)
     parser.add_argument('--example', required=True)
+    parser.add_argument('--bias', help='per_class_bias.json to fold into the exported model')
+    parser.add_argument('--temperature', help='temperature_scaling.json to fold into the exported model')
     args = parser.parse_args()
-    export_onnx(args.weights, args.mapping, args.example)
+    export_onnx(args.weights, args.mapping, args.example,
+                per_class_bias=read_bias_file(args.bias) if args.bias else None,
+                temperature=read_temperature_file(args.temperature) if args.temperature else None)
 
 
 if __name__ == '__main__':
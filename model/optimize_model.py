@@ -1,6 +1,5 @@
 import torch
-import torch.nn as nn
-from torchvision import models, transforms
+from torchvision import transforms
 from PIL import Image
 from io import BytesIO
 import json
@@ -10,6 +9,8 @@ import time
 import gc
 import logging
 
+from src.inference import build_efficientnet_b0
+
 logger = logging.getLogger(__name__)
 
 class LightweightTorchClassifier:
@@ -40,11 +41,9 @@ class LightweightTorchClassifier:
                 self.classes = json.load(f)
             num_classes = len(self.classes)
 
-            # Use EfficientNet-B0 to match the trained weights
-            self.model = models.efficientnet_b0(weights="IMAGENET1K_V1")
-            # Replace the final classifier layer
-            num_features = self.model.classifier[1].in_features
-            self.model.classifier[1] = nn.Linear(num_features, num_classes)
+            # Use EfficientNet-B0 to match the trained weights; the checkpoint
+            # overwrites everything, so skip the ImageNet download
+            self.model = build_efficientnet_b0(num_classes)
 
             # Load trained weights - handle both .pth files and directory formats
             try:
@@ -0,0 +1,227 @@
+"""Response caches for repeated uploads of the same photo.
+
+Farmers on flaky connections often resend the same image. `PredictionCache`
+keeps the final `/api/v1/upload-image` payload keyed by the SHA-256 of the
+upload plus a model version string, so a retry skips decode, inference and
+recommendation building entirely.
+
+Entries expire after `ttl` seconds and the cache is bounded both by entry
+count and by the approximate serialized size of the stored payloads
+(`max_bytes`); least recently used entries are evicted first.
+
+Re-compressed or resized copies of a photo hash differently, so
+`NearDuplicateCache` adds a second tier keyed by a perceptual hash (dHash)
+of the decoded image, matched within a Hamming-distance threshold.
+"""
+
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+class PredictionCache:
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expires_at, size_bytes, payload)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(image_hash, model_version):
+        return f'{model_version}:{image_hash}'
+
+    def get(self, key):
+        """Return a copy of the cached payload for `key`, or None."""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            payload = entry[2]
+        # Callers annotate the response; keep the stored payload untouched
+        return copy.deepcopy(payload)
+
+    def put(self, key, payload):
+        if not self.max_entries:
+            return
+        size = len(json.dumps(payload, default=str))
+        if size > self.max_bytes:
+            return
+        payload = copy.deepcopy(payload)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, payload)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of a PIL image (`size` x `size` gradient signs on grayscale)."""
+    small = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateCache:
+    """Model predictions keyed by perceptual hash, matched within `max_distance` bits.
+
+    `mode` is the accuracy-safety switch:
+    - 'off':    no hashing, no lookups;
+    - 'shadow': look up and record whether the cached predictions agree
+                with what the models then return, but always serve the
+                models' answer (default; use this to pick `max_distance`);
+    - 'on':     serve the cached predictions and skip the models.
+    Only predictions where both heads reach `min_confidence` are stored.
+    """
+
+    MODES = ('off', 'shadow', 'on')
+
+    def __init__(self, mode='shadow', max_distance=4, max_entries=256, ttl=3600, min_confidence=0.6):
+        if mode not in self.MODES:
+            raise ValueError(f'mode must be one of {self.MODES}, got {mode!r}')
+        self.mode = mode
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_confidence = min_confidence
+        # phash -> (model_version, expires_at, disease_result, deficiency_result)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.served = 0
+        self.shadow_checks = 0
+        self.shadow_agreements = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.mode != 'off' and self.max_entries > 0
+
+    def lookup(self, phash, model_version):
+        """Closest cached `(disease_result, deficiency_result)` within the threshold, or None."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            best, best_distance = None, self.max_distance + 1
+            for key, (version, expires_at, disease, deficiency) in self._entries.items():
+                if version != model_version or expires_at < now:
+                    continue
+                distance = hamming(key, phash)
+                if distance < best_distance:
+                    best, best_distance = (key, disease, deficiency), distance
+            if best is None:
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best[0])
+            return copy.deepcopy(best[1]), copy.deepcopy(best[2])
+
+    def record_served(self):
+        with self._lock:
+            self.served += 1
+
+    def record_shadow(self, cached, disease_result, deficiency_result):
+        """Compare a shadow hit with the models' actual predictions."""
+        agree = (cached[0].get('class') == disease_result.get('class')
+                 and cached[1].get('class') == deficiency_result.get('class'))
+        with self._lock:
+            self.shadow_checks += 1
+            self.shadow_agreements += agree
+        return agree
+
+    def put(self, phash, model_version, disease_result, deficiency_result):
+        if not self.enabled:
+            return
+        if min(disease_result.get('confidence', 0.0), deficiency_result.get('confidence', 0.0)) < self.min_confidence:
+            return
+        entry = (model_version, time.monotonic() + self.ttl,
+                 copy.deepcopy(disease_result), copy.deepcopy(deficiency_result))
+        with self._lock:
+            self._entries.pop(phash, None)
+            self._entries[phash] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        return {
+            'mode': self.mode,
+            'max_distance': self.max_distance,
+            'min_confidence': self.min_confidence,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'served': self.served,
+            'evictions': self.evictions,
+            'shadow_checks': self.shadow_checks,
+            'shadow_agreement': self.shadow_agreements / self.shadow_checks if self.shadow_checks else None,
+        }
@@ -3,12 +3,28 @@ from pathlib import Path
 from PIL import Image
 import json
 import os
-from src.inference import VAL_TRANSFORM, fast_preprocess_image, TorchClassifier
+import time
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from src.inference import fast_preprocess_image, top_k_from_probs, TorchClassifier
+from src.utils import weights_fingerprint
 
 
 class ModelRunner:
-    def __init__(self, scripted_path=None, quant_path=None, pth_path=None, mapping_path=None, device='cpu', max_workers=4):
+    def __init__(self, scripted_path=None, quant_path=None, pth_path=None, mapping_path=None, device='cpu', max_workers=4,
+                 artifact_path=None, onnx_path=None, backend='auto', manifest_path=None, manifest_name=None):
         self.device = torch.device(device)
+        self.artifact_path = Path(artifact_path) if artifact_path else None
+        self.onnx_path = Path(onnx_path) if onnx_path else None
+        self.manifest_path = Path(manifest_path) if manifest_path else None
+        self.manifest_name = manifest_name
+        # 'auto' keeps the default preference order; 'onnx' / 'torch' force
+        # one side so the two backends can be A/B tested
+        self.requested_backend = backend
+        self.backend = None
+        self.total_predictions = 0
         self.scripted_path = Path(scripted_path) if scripted_path else None
         self.quant_path = Path(quant_path) if quant_path else None
         self.pth_path = Path(pth_path) if pth_path else None
@@ -56,15 +72,45 @@ class ModelRunner:
 
         self.model = None
         self.model_nn = None
+        # Calibration folded into an artifact's weights (record only)
+        self.calibration = None
+        self.loaded_path = None
         self._load_model()
+        # Changes whenever the served file is retrained or re-exported
+        self.version = f'{self.backend}:{weights_fingerprint(self.loaded_path)}'
 
     def _load_model(self):
         errors = []
-        # 1) Prefer quantized scripted model
+        if self.requested_backend == 'onnx':
+            if self._load_onnx(errors):
+                return
+            raise RuntimeError(f"ONNX backend requested but unavailable. Errors: {'; '.join(errors)}")
+
+        # Fastest variant that passed `export_all.py`'s parity check
+        if self.manifest_path and self.manifest_name and self._load_from_manifest(errors):
+            return
+
+        # 0) Prefer a packaged artifact: weights are memory-mapped and the
+        #    mapping and calibration come from the same file
+        try:
+            if self.artifact_path and self.artifact_path.exists():
+                from src.artifact import load_artifact
+                self.model_nn, self.mapping, self.calibration = load_artifact(self.artifact_path, device=self.device)
+                self.model = self.model_nn
+                self.backend = 'artifact'
+                self.loaded_path = self.artifact_path
+                return
+        except Exception as e:
+            errors.append(f"artifact: {e}")
+
+        # 1) Prefer quantized scripted model; the exporters only leave one
+        #    here if it passed their accuracy and latency gates
         try:
             if self.quant_path and self.quant_path.exists():
                 self.model = torch.jit.load(str(self.quant_path), map_location=self.device)
                 self.model_nn = self.model
+                self.backend = 'quant'
+                self.loaded_path = self.quant_path
                 return
         except Exception as e:
             errors.append(f"quant: {e}")
@@ -74,10 +120,16 @@ class ModelRunner:
             if self.scripted_path and self.scripted_path.exists():
                 self.model = torch.jit.load(str(self.scripted_path), map_location=self.device)
                 self.model_nn = self.model
+                self.backend = 'scripted'
+                self.loaded_path = self.scripted_path
                 return
         except Exception as e:
             errors.append(f"scripted: {e}")
 
+        # 2b) ONNX Runtime, when exported and not explicitly disabled
+        if self.requested_backend != 'torch' and self._load_onnx(errors):
+            return
+
         # 3) Try explicit .pth weights via TorchClassifier
         try:
             if self.pth_path and self.pth_path.exists():
@@ -86,6 +138,8 @@ class ModelRunner:
                 self.model_nn = tc.model
                 if self.mapping is None:
                     self.mapping = tc.classes
+                self.backend = 'pth'
+                self.loaded_path = self.pth_path
                 return
         except Exception as e:
             errors.append(f"pth: {e}")
@@ -108,10 +162,43 @@ class ModelRunner:
             self.model_nn = tc.model
             if self.mapping is None:
                 self.mapping = tc.classes
+            self.backend = 'pth'
+            self.loaded_path = candidates[0]
             return
 
         raise RuntimeError(f"No model file found. Errors: {'; '.join(errors)}")
 
+    def _load_from_manifest(self, errors):
+        try:
+            variants = manifest_variants(self.manifest_path, self.manifest_name)
+        except Exception as e:
+            errors.append(f"manifest: {e}")
+            return False
+        for kind, path in variants:
+            if kind == 'onnx' and self.requested_backend == 'torch':
+                continue
+            try:
+                self.model = load_variant(kind, path, device=self.device)
+                self.model_nn = self.model
+                self.backend = kind
+                self.loaded_path = path
+                return True
+            except Exception as e:
+                errors.append(f"manifest {kind}: {e}")
+        return False
+
+    def _load_onnx(self, errors):
+        try:
+            if self.onnx_path and self.onnx_path.exists():
+                self.model = OnnxModel(self.onnx_path)
+                self.model_nn = self.model
+                self.backend = 'onnx'
+                self.loaded_path = self.onnx_path
+                return True
+        except Exception as e:
+            errors.append(f"onnx: {e}")
+        return False
+
     def to(self, device):
         self.device = torch.device(device)
         if self.model_nn is not None and hasattr(self.model_nn, 'to'):
@@ -120,59 +207,23 @@ class ModelRunner:
 
     def _preprocess(self, image_path):
         img = Image.open(image_path).convert('RGB')
-        # try VAL_TRANSFORM first
-        try:
-            t = VAL_TRANSFORM(img)
-        except Exception:
-            t = fast_preprocess_image(img)
-        return t
+        return preprocess_image(img)
 
     def _preprocess_pil(self, pil_image):
         # Accepts a PIL Image
-        try:
-            t = VAL_TRANSFORM(pil_image)
-        except Exception:
-            t = fast_preprocess_image(pil_image)
-        return t
-
-    def predict_image(self, pil_image):
-        """Predict from a PIL Image object and return single-result dict."""
-        t = self._preprocess_pil(pil_image)
-        batch = t if t.ndim == 4 else t.unsqueeze(0)
-        batch = batch.to(self.device)
-        with torch.inference_mode():
-            out = self.model_nn(batch)
-            try:
-                probs = torch.nn.functional.softmax(out, dim=1)
-            except Exception:
-                out0 = out[0] if isinstance(out, (list, tuple)) else out
-                probs = torch.nn.functional.softmax(out0, dim=1)
-
-        p = probs[0].cpu()
-        conf, idx = torch.max(p, dim=0)
-        idx_i = int(idx.item())
-        conf_f = float(conf.item())
-        label = None
-        if self.mapping:
-            label = self.mapping.get(str(idx_i), {}).get('name') or self.mapping.get(str(idx_i), {}).get('label')
-        if label is None:
-            label = str(idx_i)
+        return preprocess_image(pil_image)
 
-        return {'class': label, 'class_index': idx_i, 'confidence': round(conf_f, 4)}
-
-    def predict_batch(self, image_paths):
-        # Preprocess all into a batch tensor
-        tensors = []
-        for p in image_paths:
-            try:
-                tensors.append(self._preprocess(p))
-            except Exception:
-                # return a placeholder low-confidence result
-                tensors.append(torch.zeros(1, 3, 224, 224))
+    def predict_tensor(self, batch, top_k=3, return_probs=False):
+        """Predict from an already-normalized NCHW (or CHW) tensor.
 
-        batch = torch.cat([t if t.ndim==4 else t.unsqueeze(0) for t in tensors], dim=0)
+        Use this to share one preprocessed tensor across several runners.
+        Returns one result dict per row of the batch. Each result includes
+        the `top_k` classes and, with `return_probs`, the full probability
+        vector, all taken from the same forward pass.
+        """
+        batch = batch if batch.ndim == 4 else batch.unsqueeze(0)
         batch = batch.to(self.device)
-
+        t0 = time.perf_counter()
         with torch.inference_mode():
             out = self.model_nn(batch)
             # handle if scripted model returns logits directly
@@ -184,61 +235,385 @@ class ModelRunner:
                 probs = torch.nn.functional.softmax(out0, dim=1)
 
         results = []
+        probs = probs.cpu()
         for i in range(probs.shape[0]):
-            p = probs[i].cpu()
-            conf, idx = torch.max(p, dim=0)
+            conf, idx = torch.max(probs[i], dim=0)
             idx_i = int(idx.item())
-            conf_f = float(conf.item())
-            label = None
-            if self.mapping:
-                label = self.mapping.get(str(idx_i), {}).get('name') or self.mapping.get(str(idx_i), {}).get('label')
-            if label is None:
-                label = str(idx_i)
-
-            results.append({
-                'class': label,
+            result = {
+                'class': _label_for(self.mapping, idx_i),
                 'class_index': idx_i,
-                'confidence': round(conf_f, 4)
-            })
-
+                'confidence': round(float(conf.item()), 4)
+            }
+            if top_k:
+                result['top_k'] = top_k_from_probs(probs[i], self.mapping, top_k)
+            if return_probs:
+                result['probabilities'] = [round(v, 6) for v in probs[i].tolist()]
+            results.append(result)
+        elapsed = round(time.perf_counter() - t0, 4)
+        self.total_predictions += len(results)
+        for r in results:
+            r['inference_time'] = elapsed
         return results
 
+    def predict_image(self, pil_image):
+        """Predict from a PIL Image object and return single-result dict.
+
+        The result also carries `preprocess_time` and `inference_time` so
+        callers can attribute latency to each stage.
+        """
+        t0 = time.perf_counter()
+        batch = self._preprocess_pil(pil_image)
+        preprocess_time = round(time.perf_counter() - t0, 4)
+        result = self.predict_tensor(batch)[0]
+        result['preprocess_time'] = preprocess_time
+        return result
+
+    def predict_batch(self, image_paths):
+        """Predict from image file paths; unreadable files get an error result."""
+        return self._predict_pooled(image_paths, lambda p: Image.open(p).convert('RGB'))
+
     def predict_batch_pil(self, pil_images):
         """Predict from a list of PIL Image objects and return list of result dicts."""
-        tensors = []
-        for img in pil_images:
-            try:
-                tensors.append(self._preprocess_pil(img))
-            except Exception:
-                tensors.append(torch.zeros(1, 3, 224, 224))
+        return self._predict_pooled(pil_images, lambda img: img)
 
-        batch = torch.cat([t if t.ndim == 4 else t.unsqueeze(0) for t in tensors], dim=0)
-        batch = batch.to(self.device)
+    def _predict_pooled(self, items, to_pil):
+        # Preprocess straight into a pooled batch buffer. Images that fail are
+        # left out of the batch (no placeholder rows) and reported as errors.
+        results = [None] * len(items)
+        with BATCH_POOL.batch(len(items)) as buf:
+            rows = []
+            for i, item in enumerate(items):
+                try:
+                    preprocess_image(to_pil(item), out=buf[len(rows)])
+                    rows.append(i)
+                except Exception as e:
+                    results[i] = dict(FAILED_RESULT, error=f'preprocess failed: {e}')
+            if rows:
+                for i, result in zip(rows, self.predict_tensor(buf[:len(rows)])):
+                    results[i] = result
+        return results
+
+    def get_stats(self):
+        return {
+            'classes': [_label_for(self.mapping, k) for k in sorted(self.mapping, key=int)] if self.mapping else [],
+            'total_predictions': self.total_predictions,
+            'backend': self.backend
+        }
+
+
+FAILED_RESULT = {'class': 'Unknown', 'class_index': -1, 'confidence': 0.0}
+
+
+class TensorPool:
+    """Reusable NCHW float32 input batches keyed by batch size.
+
+    `with pool.batch(n) as buf:` hands out a free `[n, 3, 224, 224]` buffer
+    (allocating only when none is free) and takes it back afterwards, so a
+    steady request mix stops allocating a fresh ~600KB-per-image batch on
+    every call. Buffers are pinned when CUDA is available so host-to-device
+    copies can be async. At most `max_per_size` buffers are kept per batch
+    size, and only for sizes up to `max_batch_size`.
+    """
+
+    def __init__(self, shape=(3, 224, 224), max_per_size=2, max_batch_size=32, pin_memory=None):
+        self.shape = tuple(shape)
+        self.max_per_size = max_per_size
+        self.max_batch_size = max_batch_size
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._free = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.allocations = 0
+
+    def acquire(self, batch_size):
+        with self._lock:
+            free = self._free.get(batch_size)
+            if free:
+                self.hits += 1
+                return free.pop()
+            self.allocations += 1
+        return torch.empty((batch_size, *self.shape), dtype=torch.float32, pin_memory=self.pin_memory)
+
+    def release(self, buf):
+        batch_size = buf.shape[0]
+        if batch_size > self.max_batch_size:
+            return
+        with self._lock:
+            free = self._free.setdefault(batch_size, [])
+            if len(free) < self.max_per_size:
+                free.append(buf)
+
+    def clear(self):
+        """Drop every pooled buffer (called by the memory governor under pressure)."""
+        with self._lock:
+            self._free.clear()
+
+    def pooled_bytes(self):
+        with self._lock:
+            return sum(b.numel() * b.element_size() for free in self._free.values() for b in free)
+
+    @contextmanager
+    def batch(self, batch_size):
+        buf = self.acquire(batch_size)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
 
+    def get_stats(self):
+        with self._lock:
+            pooled = sum(len(v) for v in self._free.values())
+        return {'hits': self.hits, 'allocations': self.allocations, 'pooled_buffers': pooled,
+                'pinned': self.pin_memory}
+
+
+# Shared by every runner in the process
+BATCH_POOL = TensorPool()
+
+
+class OnnxModel:
+    """Callable over one ONNX Runtime session, used as `ModelRunner.model_nn`.
+
+    The session is created once with graph optimizations enabled and reused
+    for every batch. Takes and returns torch tensors so `predict_tensor`
+    keeps the same result shape as the TorchScript backends. Thread counts
+    default to torch's intra-op setting and can be overridden with
+    ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS.
+    """
+
+    def __init__(self, onnx_path, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads = int(intra_op_threads or os.environ.get('ORT_INTRA_OP_THREADS', torch.get_num_threads()))
+        opts.inter_op_num_threads = int(inter_op_threads or os.environ.get('ORT_INTER_OP_THREADS', '1'))
+        self.session = ort.InferenceSession(str(onnx_path), sess_options=opts, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        inp = batch.detach().cpu().contiguous().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: inp})[0])
+
+    def to(self, device):
+        # CPU execution provider only
+        return self
+
+
+def load_variant(kind, path, device='cpu'):
+    """Load an exported serving variant (`scripted`, `traced`, `quantized` or `onnx`) as a callable."""
+    if kind == 'onnx':
+        return OnnxModel(path)
+    return torch.jit.load(str(path), map_location=torch.device(device))
+
+
+def manifest_variants(manifest_path, name):
+    """`(kind, path)` pairs for model `name` that passed parity, fastest first.
+
+    Reads the manifest written by `export_all.py`; paths in it are relative
+    to the manifest's directory.
+    """
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    variants = manifest.get('models', {}).get(name, {}).get('variants', {})
+    passed = [(v['latency_ms']['p50'], kind, manifest_path.parent / v['path'])
+              for kind, v in variants.items() if v.get('passed') and v.get('latency_ms')]
+    return [(kind, path) for _, kind, path in sorted(passed)]
+
+
+def preprocess_image(pil_image, out=None):
+    """Decode-independent preprocessing stage: PIL image -> normalized [1, 3, 224, 224] tensor.
+
+    Every runner in this module expects the same VAL_TRANSFORM input, so a
+    request only needs to run this once and can hand the result to each
+    runner's `predict_tensor`. Uses the vectorized float32 engine in
+    `src.preprocessing` (matches VAL_TRANSFORM to ~1e-6); `out` is an
+    optional preallocated buffer to write into.
+    """
+    return fast_preprocess_image(pil_image, out=out)
+
+
+class PreprocessCache:
+    """Small thread-safe LRU of preprocessed tensors keyed by image hash.
+
+    Lets repeated calls for the same upload (interactive diagnosis, retries)
+    skip decode-independent preprocessing. Each entry is ~600KB, so keep
+    `max_entries` small on 512MB instances; `max_entries=0` disables it.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, pil_image):
+        if not self.max_entries or key is None:
+            return preprocess_image(pil_image)
+        with self._lock:
+            tensor = self._entries.get(key)
+            if tensor is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tensor
+            self.misses += 1
+        tensor = preprocess_image(pil_image)
+        with self._lock:
+            self._entries[key] = tensor
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tensor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def nbytes(self):
+        with self._lock:
+            return sum(t.numel() * t.element_size() for t in self._entries.values())
+
+    def get_stats(self):
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+def _label_for(mapping, idx):
+    info = mapping.get(str(idx), {}) if mapping else {}
+    return info.get('name') or info.get('label') or str(idx)
+
+
+class MultiHeadRunner:
+    """Serves a shared-backbone checkpoint built by `build_multihead.py`.
+
+    One forward pass through the trunk yields both the disease and the
+    deficiency prediction. `head('disease')` / `head('deficiency')` return
+    per-task views exposing the usual runner interface (`mapping`,
+    `predict_image`, `get_stats`) for code that expects two runners. When
+    both views are handed the same tensor, the second one is answered from
+    the trunk pass the first one ran instead of running the trunk again.
+    """
+
+    def __init__(self, model_path, device='cpu'):
+        from src.multi_head import load_multihead
+
+        self.device = torch.device(device)
+        self.model_path = Path(model_path)
+        self.model_nn, disease_mapping, deficiency_mapping = load_multihead(self.model_path, device=self.device)
+        self.version = f'multihead:{weights_fingerprint(self.model_path)}'
+        self.mappings = {'disease': disease_mapping, 'deficiency': deficiency_mapping}
+        self.total_predictions = 0
+        self.trunk_passes_saved = 0
+        self._heads = {name: _HeadView(self, name) for name in self.mappings}
+        self._pending = None
+        self._pending_lock = threading.Lock()
+
+    def head(self, name):
+        return self._heads[name]
+
+    def head_results(self, name, batch, top_k=3, return_probs=False):
+        """Results for one head, reusing a sibling view's pass over `batch`.
+
+        The other heads' results are kept for the last tensor only, matched
+        by identity (a weak reference) and in-place version, so a different
+        or modified tensor always gets a fresh forward pass.
+        """
+        options = (top_k, return_probs)
+        with self._pending_lock:
+            pending = self._pending
+            if (pending is not None and pending['ref']() is batch and pending['version'] == batch._version
+                    and pending['options'] == options and name in pending['results']):
+                results = pending['results'].pop(name)
+                if not pending['results']:
+                    self._pending = None
+                self.trunk_passes_saved += 1
+                return results
+
+        rows = self.predict_tensor(batch, top_k=top_k, return_probs=return_probs)
+        with self._pending_lock:
+            self._pending = {
+                'ref': weakref.ref(batch),
+                'version': batch._version,
+                'options': options,
+                'results': {other: [r[other] for r in rows] for other in self.mappings if other != name}
+            }
+        return [r[name] for r in rows]
+
+    def predict_tensor(self, batch, top_k=3, return_probs=False):
+        """Return one `{'disease': result, 'deficiency': result}` per batch row.
+
+        `top_k` and `return_probs` behave as in `ModelRunner.predict_tensor`.
+        """
+        batch = (batch if batch.ndim == 4 else batch.unsqueeze(0)).to(self.device)
+        t0 = time.perf_counter()
         with torch.inference_mode():
-            out = self.model_nn(batch)
-            try:
-                probs = torch.nn.functional.softmax(out, dim=1)
-            except Exception:
-                out0 = out[0] if isinstance(out, (list, tuple)) else out
-                probs = torch.nn.functional.softmax(out0, dim=1)
+            disease_logits, deficiency_logits = self.model_nn(batch)
+        elapsed = round(time.perf_counter() - t0, 4)
+        self.total_predictions += batch.shape[0]
 
-        results = []
-        for i in range(probs.shape[0]):
-            p = probs[i].cpu()
-            conf, idx = torch.max(p, dim=0)
-            idx_i = int(idx.item())
-            conf_f = float(conf.item())
-            label = None
-            if self.mapping:
-                label = self.mapping.get(str(idx_i), {}).get('name') or self.mapping.get(str(idx_i), {}).get('label')
-            if label is None:
-                label = str(idx_i)
-
-            results.append({
-                'class': label,
-                'class_index': idx_i,
-                'confidence': round(conf_f, 4)
-            })
+        results = [{} for _ in range(batch.shape[0])]
+        for name, logits in (('disease', disease_logits), ('deficiency', deficiency_logits)):
+            probs = torch.nn.functional.softmax(logits, dim=1).cpu()
+            for i in range(probs.shape[0]):
+                conf, idx = torch.max(probs[i], dim=0)
+                idx_i = int(idx.item())
+                result = {
+                    'class': _label_for(self.mappings[name], idx_i),
+                    'class_index': idx_i,
+                    'confidence': round(float(conf.item()), 4),
+                    'inference_time': elapsed
+                }
+                if top_k:
+                    result['top_k'] = top_k_from_probs(probs[i], self.mappings[name], top_k)
+                if return_probs:
+                    result['probabilities'] = [round(v, 6) for v in probs[i].tolist()]
+                results[i][name] = result
+        return results
 
+    def predict_image(self, pil_image):
+        """Return `{'disease': result, 'deficiency': result}` from one forward pass."""
+        t0 = time.perf_counter()
+        batch = preprocess_image(pil_image)
+        preprocess_time = round(time.perf_counter() - t0, 4)
+        results = self.predict_tensor(batch)[0]
+        for r in results.values():
+            r['preprocess_time'] = preprocess_time
         return results
+
+    def get_stats(self):
+        return {
+            'total_predictions': self.total_predictions,
+            'trunk_passes_saved': self.trunk_passes_saved,
+            'shared_backbone': True
+        }
+
+
+class _HeadView:
+    """Single-task view over a `MultiHeadRunner`.
+
+    Prefer batching through the shared runner itself; views only avoid a
+    second trunk pass when both are called with the same tensor.
+    """
+
+    def __init__(self, shared, name):
+        self.shared = shared
+        self.name = name
+        self.mapping = shared.mappings[name]
+        self.version = shared.version
+
+    def predict_image(self, pil_image):
+        return self.shared.predict_image(pil_image)[self.name]
+
+    def predict_tensor(self, batch, top_k=3, return_probs=False):
+        return self.shared.head_results(self.name, batch, top_k=top_k, return_probs=return_probs)
+
+    def get_stats(self):
+        return {
+            'classes': [_label_for(self.mapping, k) for k in sorted(self.mapping, key=int)],
+            'total_predictions': self.shared.total_predictions,
+            'shared_backbone': True
+        }
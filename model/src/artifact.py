@@ -0,0 +1,100 @@
+"""Single-file serving artifacts: weights, class mapping and calibration together.
+
+An artifact is a regular `torch.save` zip archive that holds only tensors
+and plain containers, so it loads with `weights_only=True, mmap=True`. The
+weights stay backed by the file's pages instead of being copied into each
+process, which lets gunicorn workers serving the same artifact share one
+page-cached copy. The model is built on the meta device and the mapped
+tensors are assigned into it, so no throwaway random init is allocated.
+
+Per-class bias and temperature are folded into the final linear layer when
+the artifact is built, so serving applies no calibration at runtime; the
+values are kept in the file only as a record of what was folded.
+
+Build one with `build_artifact.py`; serve it with `ModelRunner(artifact_path=...)`.
+"""
+
+import copy
+import json
+import logging
+from pathlib import Path
+
+import torch
+
+from src.inference import build_efficientnet_b0, fold_calibration
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = 'healthycoffee-artifact-v1'
+
+# Architectures an artifact can name, keyed by `arch`
+ARCHITECTURES = {
+    'efficientnet_b0': build_efficientnet_b0,
+}
+
+
+def read_bias_file(path):
+    """Per-class additive logit bias from a `per_class_bias.json` (dict with `bias`, or a bare list)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    bias = data.get('bias') if isinstance(data, dict) else data
+    return [float(b) for b in bias] if bias is not None else None
+
+
+def read_temperature_file(path):
+    """Temperature from a `temperature_scaling.json` written by `temperature_scaling.py`."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    temperature = data.get('temperature') if isinstance(data, dict) else data
+    return float(temperature) if temperature is not None else None
+
+
+def save_artifact(model, mapping, out_path, per_class_bias=None, temperature=None, arch='efficientnet_b0'):
+    """Write `model`'s weights, `mapping` and calibration to one file.
+
+    `per_class_bias` and `temperature` are folded into a copy of the final
+    linear layer; `model` itself is left unchanged.
+    """
+    if arch not in ARCHITECTURES:
+        raise ValueError(f'Unknown architecture {arch!r}')
+    if per_class_bias is not None and len(per_class_bias) != len(mapping):
+        raise ValueError(f'per_class_bias has {len(per_class_bias)} entries for {len(mapping)} classes')
+    if per_class_bias is not None or temperature is not None:
+        model = fold_calibration(copy.deepcopy(model).cpu(), per_class_bias, temperature)
+    state_dict = {k: v.detach().cpu().contiguous() for k, v in model.state_dict().items()}
+    torch.save({
+        'format': ARTIFACT_FORMAT,
+        'arch': arch,
+        'num_classes': len(mapping),
+        'state_dict': state_dict,
+        'mapping': mapping,
+        'per_class_bias': [float(b) for b in per_class_bias] if per_class_bias is not None else None,
+        'temperature': float(temperature) if temperature is not None else None,
+        'calibration_folded': True,
+    }, str(out_path))
+
+
+def load_artifact(path, device='cpu'):
+    """Load an artifact written by `save_artifact`, memory-mapping its weights.
+
+    Returns `(model, mapping, calibration)`; `calibration` records the
+    `per_class_bias` and `temperature` already folded into the weights.
+    """
+    ckpt = torch.load(str(path), map_location='cpu', mmap=True, weights_only=True)
+    if not isinstance(ckpt, dict) or ckpt.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f'{path} is not a {ARTIFACT_FORMAT} artifact')
+    build = ARCHITECTURES.get(ckpt.get('arch'))
+    if build is None:
+        raise ValueError(f"{path}: unknown architecture {ckpt.get('arch')!r}")
+    if not ckpt.get('calibration_folded'):
+        raise ValueError(f'{path}: calibration was not folded at build time; rebuild with build_artifact.py')
+
+    with torch.device('meta'):
+        model = build(ckpt['num_classes'])
+    model.load_state_dict(ckpt['state_dict'], assign=True)
+    model.eval()
+    if torch.device(device).type != 'cpu':
+        model.to(device)
+    calibration = {'per_class_bias': ckpt.get('per_class_bias'), 'temperature': ckpt.get('temperature')}
+    logger.info(f'Loaded artifact {Path(path).name} ({ckpt["num_classes"]} classes, mmap)')
+    return model, ckpt['mapping'], calibration
@@ -0,0 +1,48 @@
+"""Labelled image folders for offline model building and export.
+
+Datasets are laid out as one sub-folder per class (e.g.
+`train_dataset/diseases/<class name>/*.jpg`); folder names are matched
+against the class mapping case-insensitively, ignoring `_`/`-`.
+"""
+
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from src.inference import VAL_TRANSFORM
+
+
+def _normalize(name):
+    return name.strip().lower().replace('_', ' ').replace('-', ' ')
+
+
+def collect_paths_labels(data_dir, mapping):
+    """Collect `(path, label)` pairs from class sub-folders, skipping unknown classes."""
+    name_to_idx = {_normalize(v['name']): int(k) for k, v in mapping.items()}
+    paths, labels = [], []
+    data_dir = Path(data_dir)
+    if not data_dir.exists():
+        return paths, labels
+    for class_dir in sorted(data_dir.iterdir()):
+        if not class_dir.is_dir():
+            continue
+        idx = name_to_idx.get(_normalize(class_dir.name))
+        if idx is None:
+            print('Skipping unknown class folder', class_dir.name)
+            continue
+        for p in sorted(class_dir.glob('*.jpg')):
+            paths.append(str(p))
+            labels.append(idx)
+    return paths, labels
+
+
+def load_calibration_set(data_dir, mapping, limit=None):
+    """`(inputs, labels)` from class sub-folders of `data_dir`, VAL_TRANSFORM-ed into one tensor."""
+    paths, labels = collect_paths_labels(data_dir, mapping)
+    if limit:
+        paths, labels = paths[:limit], labels[:limit]
+    if not paths:
+        return None, None
+    inputs = torch.stack([VAL_TRANSFORM(Image.open(p).convert('RGB')) for p in paths])
+    return inputs, torch.tensor(labels, dtype=torch.long)
@@ -0,0 +1,177 @@
+"""
+On-disk, append-only store for interactive learning memory.
+
+Each store is three files in one directory:
+- `<name>.f32`   — raw float32 rows of L2-normalized embeddings, appended;
+- `<name>.jsonl` — one metadata record per row (label, prediction,
+                   confidence, correct, timestamp), appended after the row;
+- `<name>.lock`  — advisory lock: exclusive for writers, shared for readers.
+
+The metadata index is authoritative: a row only exists once its record is
+written, so a crash between the two appends leaves an ignored trailing row.
+Any number of processes (e.g. gunicorn workers) can append; readers map the
+vectors with `np.memmap` (zero-copy, page cache shared between workers) and
+pick up new rows with `refresh()`. `compact()` rewrites both files keeping
+the most recent rows and swaps them in atomically; every instance, the
+compacting one included, notices the new generation and reports it from
+its next `refresh()`, so callers know row numbers changed.
+
+Within a process, the file lock is taken together with a thread lock, so
+request threads sharing one instance never read the index into it twice.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines: single process only
+    fcntl = None
+
+
+class EmbeddingStore:
+    def __init__(self, directory, name, dim=1280):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.dim = dim
+        self.vectors_path = self.directory / f'{name}.f32'
+        self.index_path = self.directory / f'{name}.jsonl'
+        self.lock_path = self.directory / f'{name}.lock'
+        for path in (self.vectors_path, self.index_path):
+            path.touch(exist_ok=True)
+        self.generation = None
+        self.metadata = []
+        self._offset = 0
+        self._vectors = None
+        self._rewritten = False  # seen by _refresh(), not yet reported by refresh()
+        self._thread_lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.metadata)
+
+    @contextmanager
+    def _locked(self, shared=False):
+        # flock is per open file, so threads of one process would not exclude each other
+        with self._thread_lock, open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _generation(self):
+        # compact() replaces the index file, so its inode identifies the generation
+        return os.stat(self.index_path).st_ino
+
+    def refresh(self):
+        """Pick up rows appended by any process.
+
+        Returns True if the store was rewritten by `compact()` (in this or
+        another process) since the previous `refresh()`; row numbers from
+        before then are no longer valid.
+        """
+        with self._locked(shared=True):
+            self._refresh()
+            rewritten, self._rewritten = self._rewritten, False
+        return rewritten
+
+    def _refresh(self):
+        generation = self._generation()
+        rewritten = self.generation is not None and generation != self.generation
+        if generation != self.generation:
+            self.generation, self.metadata, self._offset = generation, [], 0
+            self._rewritten = self._rewritten or rewritten
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # record still being written
+                self.metadata.append(json.loads(line))
+                self._offset += len(line)
+        if self._vectors is None or rewritten or self._vectors.shape[0] < len(self.metadata):
+            self._vectors = self._map(len(self.metadata))
+        return rewritten
+
+    def _map(self, rows):
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+
+    def vectors(self, start=0):
+        """Zero-copy [n, dim] view of the normalized embeddings from row `start` on."""
+        return self._vectors[start:len(self.metadata)]
+
+    def find_last(self, **fields):
+        """Newest row whose metadata has all of `fields`, as `(embedding, record)`, or None.
+
+        The embedding is copied out of the mapping, so it stays valid after a
+        later `compact()`.
+        """
+        with self._locked(shared=True):
+            self._refresh()
+            for row in range(len(self.metadata) - 1, -1, -1):
+                record = self.metadata[row]
+                if all(record.get(k) == v for k, v in fields.items()):
+                    return np.array(self._vectors[row]), record
+        return None
+
+    def append(self, embedding, **metadata):
+        """Append one embedding with its metadata; returns the new row number."""
+        row = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if row.shape[0] != self.dim:
+            raise ValueError(f'expected a {self.dim}-d embedding, got {row.shape[0]}')
+        norm = np.linalg.norm(row)
+        if norm > 0:
+            row = (row / norm).astype(np.float32)
+        record = {'timestamp': time.time(), **metadata}
+        with self._locked():
+            self._refresh()
+            rows = len(self.metadata)
+            with open(self.vectors_path, 'r+b') as f:
+                # Drop a trailing row left by an interrupted append
+                f.truncate(rows * self.dim * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(row.tobytes())
+            with open(self.index_path, 'r+b') as f:
+                # ...and a partial record, so the new one starts on its own line
+                f.truncate(self._offset)
+                f.seek(self._offset)
+                f.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+            self._refresh()
+        return rows
+
+    def compact(self, keep_last=None, max_rows=None):
+        """Rewrite the store keeping the newest `keep_last` rows (all by default), dropping partial writes.
+
+        With `max_rows`, only compact if the store holds more rows than that
+        (checked under the lock, so concurrent triggers compact once).
+        Only one process compacts at a time (the writer lock is held
+        throughout); every instance's next `refresh()` returns True.
+        Returns the number of rows kept, or None if nothing was done.
+        """
+        with self._locked():
+            self._refresh()
+            if max_rows is not None and len(self.metadata) <= max_rows:
+                return None
+            start = 0 if keep_last is None else max(0, len(self.metadata) - keep_last)
+            vectors_tmp = self.vectors_path.with_suffix('.f32.tmp')
+            index_tmp = self.index_path.with_suffix('.jsonl.tmp')
+            np.ascontiguousarray(self.vectors(start)).tofile(vectors_tmp)
+            with open(index_tmp, 'w', encoding='utf-8') as f:
+                for record in self.metadata[start:]:
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(index_tmp, self.index_path)
+            self._vectors = None
+            self._refresh()
+        return len(self.metadata)
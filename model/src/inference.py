@@ -4,9 +4,12 @@ from PIL import Image
 import json
 import numpy as np
 from pathlib import Path
-from collections import deque
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import OrderedDict, deque
 import logging
+import threading
+
+from src.preprocessing import preprocess_pil
+from src.utils import weights_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -20,48 +23,62 @@ VAL_TRANSFORM = transforms.Compose([
 ])
 
 # Optimized PIL-based preprocessing for speed
-def fast_preprocess_image(image):
-    """Fast PIL-based preprocessing without torchvision transforms"""
-    # Resize to 256, then center crop to 224
-    width, height = image.size
-    if width > height:
-        new_width = int(256 * width / height)
-        new_height = 256
-    else:
-        new_width = 256
-        new_height = int(256 * height / width)
-    image = image.resize((new_width, new_height), Image.BILINEAR)
-
-    # Center crop
-    left = (new_width - 224) // 2
-    top = (new_height - 224) // 2
-    right = left + 224
-    bottom = top + 224
-    image = image.crop((left, top, right, bottom))
-
-    # Convert to tensor and normalize
-    img_array = np.array(image).astype(np.float32) / 255.0
-    img_array = (img_array - [0.485, 0.456, 0.406]) / [0.229, 0.224, 0.225]
-    img_tensor = torch.from_numpy(img_array).permute(2, 0, 1).float()
-    return img_tensor.unsqueeze(0)
+def fast_preprocess_image(image, out=None):
+    """Fast PIL-based preprocessing without torchvision transforms.
+
+    Same output as VAL_TRANSFORM; see `src.preprocessing.preprocess_pil`
+    for the `out=` buffer.
+    """
+    return preprocess_pil(image, out=out)
+
+def top_k_from_probs(probs, mapping, k=3):
+    """Top-k `{'class', 'class_index', 'confidence'}` entries from a 1-D probability tensor."""
+    k = min(k, probs.shape[0])
+    values, indices = torch.topk(probs, k)
+    top = []
+    for conf, idx in zip(values.tolist(), indices.tolist()):
+        info = mapping.get(str(idx), {}) if mapping else {}
+        top.append({
+            'class': info.get('name') or info.get('label') or str(idx),
+            'class_index': idx,
+            'confidence': round(conf, 4)
+        })
+    return top
+
+
+def build_efficientnet_b0(num_classes):
+    """EfficientNet-B0 with a `num_classes` head and no pretrained weights.
+
+    Every caller loads a fine-tuned state dict straight after, so fetching
+    the ImageNet weights (and allocating the 1000-class head) is wasted work
+    and would need network access on a cold cache.
+    """
+    return models.efficientnet_b0(weights=None, num_classes=num_classes)
+
+
+def forward_with_embedding(model, batch):
+    """Run an EfficientNet once, returning `(logits, pooled penultimate embedding)`.
+
+    Same computation as `model(batch)` (features -> avgpool -> flatten ->
+    classifier), keeping the flattened pooled features on the way.
+    """
+    embedding = torch.flatten(model.avgpool(model.features(batch)), 1)
+    return model.classifier(embedding), embedding
+
 
 class TorchClassifier:
     def __init__(self, model_path, classes_path):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model, self.classes = self.load_model_and_mapping(model_path, classes_path)
+        # A missing file falls back to the random-weight mock model below;
+        # 'missing' still changes the cache key once real weights appear
+        self.version = f'pth:{weights_fingerprint(model_path)}' if Path(model_path).is_file() else 'pth:missing'
         self.model.to(self.device)
         self.model.float()  # Convert model to float precision
         self.model.eval()
-        # Flag whether an external per-class bias was applied
-        self.applied_bias = False
-        # Try to apply a saved per-class bias (per_class_bias.json) if available
-        try:
-            applied = torch.nn.Module._apply_saved_bias_to_model_helper(self.model, model_path)
-            if applied:
-                self.applied_bias = True
-        except Exception:
-            # Non-fatal: leave model unchanged if bias application fails
-            pass
+        # Try to apply a saved per-class bias (per_class_bias.json) if available;
+        # flag whether it was
+        self.applied_bias = _apply_saved_bias_to_model(self.model, model_path)
 
     def load_model_and_mapping(self, weights_path, mapping_path):
         # Be tolerant of relative mapping paths. If the provided mapping_path
@@ -84,8 +101,7 @@ class TorchClassifier:
         except Exception:
             mapping = {}
         num_classes = len(mapping)
-        model = models.efficientnet_b0(weights="IMAGENET1K_V1")
-        model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, num_classes)
+        model = build_efficientnet_b0(num_classes)
 
         # Handle both single .pth files and directories (old PyTorch format)
         try:
@@ -129,23 +145,52 @@ class TorchClassifier:
         model.eval()
         return model, mapping
 
-    def predict(self, image_input, confidence_threshold=0.3):
+    def _input_tensor(self, image_input):
         # Handle both PIL Image objects and file paths
-        if isinstance(image_input, str):
+        if isinstance(image_input, (str, Path)):
             image = Image.open(image_input).convert("RGB")
         else:
             # Assume it's already a PIL Image
             image = image_input.convert("RGB") if hasattr(image_input, 'convert') else image_input
 
         # Use fast preprocessing for speed
-        input_tensor = fast_preprocess_image(image).to(self.device)
+        return fast_preprocess_image(image)
 
-        # Use inference_mode for faster inference (PyTorch 1.9+)
+    def predict(self, image_input, confidence_threshold=0.3):
+        return self.predict_tensor(self._input_tensor(image_input), confidence_threshold)[0]
+
+    def predict_with_embedding(self, image_input, confidence_threshold=0.3):
+        """`(result, embedding)` from a single forward pass.
+
+        `embedding` is the pooled penultimate-layer feature vector (1-D numpy
+        float32) used by the interactive learning memory.
+        """
         with torch.inference_mode():
-            outputs = self.model(input_tensor)
-            probs = torch.nn.functional.softmax(outputs[0], dim=0)
-            confidence, predicted_idx = torch.max(probs, dim=0)
+            logits, embedding = forward_with_embedding(self.model, self._input_tensor(image_input).to(self.device))
+            probs = torch.nn.functional.softmax(logits, dim=1).cpu()
+        return self._result_from_probs(probs[0], confidence_threshold), embedding[0].cpu().numpy()
+
+    def predict_tensor(self, batch, confidence_threshold=0.3, top_k=3):
+        """Predict from an already-normalized NCHW tensor; one result per row.
 
+        Each result carries the `top_k` classes from the same forward pass.
+        """
+        batch = batch if batch.ndim == 4 else batch.unsqueeze(0)
+
+        # Use inference_mode for faster inference (PyTorch 1.9+)
+        with torch.inference_mode():
+            outputs = self.model(batch.to(self.device))
+            probs = torch.nn.functional.softmax(outputs, dim=1).cpu()
+        results = []
+        for p in probs:
+            result = self._result_from_probs(p, confidence_threshold)
+            if top_k:
+                result['top_k'] = top_k_from_probs(p, self.classes, top_k)
+            results.append(result)
+        return results
+
+    def _result_from_probs(self, probs, confidence_threshold):
+        confidence, predicted_idx = torch.max(probs, dim=0)
         conf = confidence.item()
         idx = str(predicted_idx.item())
         info = self.classes.get(idx, {"name": idx})
@@ -190,15 +235,38 @@ def load_model_and_mapping(weights_path, mapping_path):
     except Exception:
         mapping = {}
     num_classes = len(mapping)
-    model = models.efficientnet_b0(weights="IMAGENET1K_V1")
-    model.classifier[1] = torch.nn.Linear(model.classifier[1].in_features, num_classes)
+    model = build_efficientnet_b0(num_classes)
     state_dict = torch.load(weights_path, map_location="cpu")
     model.load_state_dict(state_dict)
     model.eval()
     return model, mapping
 
 
-# Helpers to optionally apply a saved per-class additive bias to the final linear
+def fold_calibration(model, per_class_bias=None, temperature=None):
+    """Bake a per-class logit bias and a temperature into the final linear layer.
+
+    softmax((Wx + b + bias) / T) == softmax((W/T)x + (b + bias)/T), so an
+    exported model with the calibration folded in needs no runtime step.
+    Raises ValueError if the bias does not match the number of classes.
+    """
+    final_linear = model.classifier[1]
+    if not isinstance(final_linear, torch.nn.Linear) or final_linear.bias is None:
+        raise ValueError('model has no final linear layer with a bias to fold into')
+    with torch.no_grad():
+        if per_class_bias is not None:
+            b = torch.as_tensor(per_class_bias, dtype=final_linear.bias.dtype, device=final_linear.bias.device)
+            if b.numel() != final_linear.bias.numel():
+                raise ValueError(f'per_class_bias has {b.numel()} entries for {final_linear.bias.numel()} classes')
+            final_linear.bias += b
+        if temperature and temperature != 1.0:
+            final_linear.weight /= temperature
+            final_linear.bias /= temperature
+    return model
+
+
+# Legacy .pth loading: look for a saved per-class bias next to the weights.
+# Artifacts and exported models have it folded in at build time instead
+# (see build_artifact.py / export_torchscript.py).
 def _apply_saved_bias_to_model(model, weights_path):
     try:
         # Candidate locations for a saved bias file
@@ -219,23 +287,12 @@ def _apply_saved_bias_to_model(model, weights_path):
             return False
 
         # Apply to final linear bias if shapes match
-        try:
-            final_linear = model.classifier[1]
-            if isinstance(final_linear, torch.nn.Linear) and final_linear.bias is not None:
-                b = torch.tensor(bias, dtype=final_linear.bias.dtype, device=final_linear.bias.device)
-                if b.numel() == final_linear.bias.numel():
-                    with torch.no_grad():
-                        final_linear.bias += b.to(final_linear.bias.device)
-                    return True
-        except Exception:
-            return False
+        fold_calibration(model, per_class_bias=bias)
+        return True
     except Exception:
         return False
 
 
-# Attach helper as a method used by TorchClassifier instances
-setattr(torch.nn.Module, '_apply_saved_bias_to_model_helper', staticmethod(_apply_saved_bias_to_model))
-
 def run_inference(model, mapping, image_path, model_name=""):
     image = Image.open(image_path).convert("RGB")
     input_tensor = VAL_TRANSFORM(image).unsqueeze(0)
@@ -254,146 +311,332 @@ def run_inference(model, mapping, image_path, model_name=""):
         "recommendation": info.get("recommendation", "")
     }
 
+def _unit_rows(vectors):
+    """L2-normalize float32 rows; zero rows stay zero (cosine similarity 0, as sklearn)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _top_k(sims, k):
+    """Indices of the `k` largest similarities, best first."""
+    if sims.shape[0] > k:
+        idx = np.argpartition(-sims, k - 1)[:k]
+    else:
+        idx = np.arange(sims.shape[0])
+    return idx[np.argsort(-sims[idx], kind='stable')]
+
+
 class InteractiveMemory:
-    """Stores high-confidence predictions in memory for reference"""
-    def __init__(self, max_size=1000):
-        self.memory = deque(maxlen=max_size)
+    """Stores high-confidence predictions in memory for reference.
+
+    Embeddings live in one contiguous float32 matrix of unit rows used as a
+    ring buffer of `max_size` (oldest entries are overwritten, like the
+    bounded deque it replaces), so `find_similar` is a single matrix-vector
+    product plus `argpartition`. Once more than `ann_threshold` entries are
+    stored, searches go through a coarse cluster index (`ann_probes`
+    nearest centroids) instead of scanning every row. With the default
+    `max_size` of 1000 the threshold is never reached and every search is
+    exact; the index only matters for memories of tens of thousands of
+    entries (raise `max_size`, and lower `ann_threshold` if needed).
+
+    Flask serves requests on several threads, so adds and searches hold
+    one lock: a search never sees a row whose embedding is not written yet.
+    """
+    def __init__(self, max_size=1000, ann_threshold=20000, ann_probes=8):
+        self.max_size = max_size
         self.confidence_threshold = 0.85
+        self.ann_threshold = ann_threshold
+        self.ann_probes = ann_probes
+        self._lock = threading.Lock()
+        self._matrix = None      # [capacity, dim] unit rows, grown up to max_size
+        self._items = []         # metadata per row
+        self._next = 0           # ring write position once full
+        self._centroids = None   # coarse index, built lazily above ann_threshold
+        self._assign = None
+        self._indexed = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def memory(self):
+        """Stored items, oldest first."""
+        with self._lock:
+            return self._items[self._next:] + self._items[:self._next]
 
     def add_interaction(self, image_embedding, prediction, confidence, true_label=None):
         if confidence > self.confidence_threshold:
-            self.memory.append({
-                'embedding': image_embedding,  # From EfficientNet's penultimate layer
+            self._add(_unit_rows(np.ravel(image_embedding)), {
                 'prediction': prediction,
                 'confidence': confidence,
                 'true_label': true_label if true_label else prediction
             })
 
-    def find_similar(self, current_embedding, threshold=0.7):
-        """Find similar past cases using cosine similarity"""
-        similarities = []
-        for memory_item in self.memory:
-            sim = cosine_similarity(current_embedding.reshape(1, -1),
-                                  memory_item['embedding'].reshape(1, -1))[0][0]
-            if sim > threshold:
-                similarities.append((sim, memory_item))
-
-        return sorted(similarities, reverse=True)[:5]  # Top 5 most similar
+    def _add(self, unit, item):
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.empty((min(64, self.max_size), unit.shape[0]), dtype=np.float32)
+            count = len(self._items)
+            if count < self.max_size:
+                if count == self._matrix.shape[0]:
+                    grown = np.empty((min(2 * count, self.max_size), self._matrix.shape[1]), dtype=np.float32)
+                    grown[:count] = self._matrix
+                    self._matrix = grown
+                row = count
+            else:
+                row = self._next
+            # Write the row before publishing its item
+            self._matrix[row] = unit
+            if self._centroids is not None:
+                self._assign[row] = int(np.argmax(self._centroids @ unit))
+                self._indexed += 1
+            if count < self.max_size:
+                self._items.append(item)
+            else:
+                self._items[row] = item
+                self._next = (row + 1) % self.max_size
+
+    def _candidates(self, query):
+        count = len(self._items)
+        if count < self.ann_threshold:
+            return None
+        # Re-cluster once half the rows were added after the last build
+        if self._centroids is None or self._indexed > count // 2:
+            self._build_index()
+        probes = _top_k(self._centroids @ query, self.ann_probes)
+        return np.flatnonzero(np.isin(self._assign[:count], probes))
+
+    def _build_index(self, iterations=5):
+        rows = self._matrix[:len(self._items)]
+        nlist = max(1, int(np.sqrt(rows.shape[0])))
+        rng = np.random.default_rng(0)
+        centroids = rows[rng.choice(rows.shape[0], nlist, replace=False)].copy()
+        sample = rows[rng.choice(rows.shape[0], min(rows.shape[0], 64 * nlist), replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _unit_rows(centroids)
+        assign = np.empty(self.max_size, dtype=np.int32)
+        for start in range(0, rows.shape[0], 4096):
+            chunk = rows[start:start + 4096]
+            assign[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        self._centroids, self._assign, self._indexed = centroids, assign, 0
+
+    def find_similar(self, current_embedding, threshold=0.7, k=5):
+        """Find the `k` most similar past cases above `threshold` (cosine similarity)"""
+        query = _unit_rows(np.ravel(current_embedding))
+        with self._lock:
+            if not self._items:
+                return []
+            candidates = self._candidates(query)
+            rows = self._matrix[:len(self._items)] if candidates is None else self._matrix[candidates]
+            sims = rows @ query
+            hits = np.flatnonzero(sims > threshold)
+            best = hits[_top_k(sims[hits], k)]
+            if candidates is not None:
+                return [(float(sims[i]), self._items[candidates[i]]) for i in best]
+            return [(float(sims[i]), self._items[i]) for i in best]
+
+
+class EmbeddingRing:
+    """Fixed-capacity ring buffer of L2-normalized float32 embeddings (oldest overwritten)."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rows = None
+        self.count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, embedding):
+        unit = _unit_rows(np.ravel(embedding))
+        if self.rows is None:
+            self.rows = np.zeros((self.capacity, unit.shape[0]), dtype=np.float32)
+        self.rows[self._next] = unit
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
 
 
 class AdaptiveClassifier:
     """Uses feature embeddings to find similar past cases and boost confidence"""
     def __init__(self, base_model, max_memory_per_class=50):
         self.base_model = base_model
-        self.feature_memory = {}  # disease_class -> list of feature vectors
+        self.feature_memory = {}  # disease_class -> EmbeddingRing of unit feature vectors
         self.confidence_boost = 0.1  # Boost for familiar patterns
+        self.boost_threshold = 0.8  # High similarity threshold
+        self.similar_threshold = 0.7
         self.max_memory_per_class = max_memory_per_class  # Limit memory per class
+        # All classes' rows stacked for the single similarity pass, rebuilt after updates
+        self._stacked = None
+        self._stacked_class = None
 
-    def predict_with_memory(self, image_path):
-        # Get base prediction
-        base_result = self.base_model.predict(image_path)
-
-        # Get feature embedding (second-to-last layer)
-        feature_vector = self.get_feature_embedding(image_path)
+    def predict_with_memory(self, image_path, return_embedding=False):
+        # Base prediction and feature embedding (second-to-last layer) from one forward pass
+        base_result, feature_vector = self.base_model.predict_with_embedding(image_path)
 
-        # Check against memory for similar cases
-        memory_confidence_boost = self.check_feature_similarity(feature_vector)
+        # Check against memory for similar cases (one pass for boost and count)
+        memory_confidence_boost, similar_cases = self.memory_similarity(feature_vector)
 
         # Adjust confidence based on memory matches
         adjusted_confidence = min(base_result.get('confidence', 0.5) + memory_confidence_boost, 1.0)
 
-        return {
+        result = {
             'class': base_result.get('class', base_result.get('prediction', 'unknown')),
             'confidence': adjusted_confidence,
             'base_confidence': base_result.get('confidence', adjusted_confidence),
             'memory_boost': memory_confidence_boost,
-            'similar_cases': self.get_similar_cases(feature_vector),
+            'similar_cases': similar_cases,
             'class_index': base_result.get('class_index', 0),
             'description': base_result.get('description', ''),
             'recommendation': base_result.get('recommendation', '')
         }
+        return (result, feature_vector) if return_embedding else result
 
     def get_feature_embedding(self, image_path):
         """Extract feature embedding from penultimate layer"""
-        image = Image.open(image_path).convert("RGB")
-        input_tensor = VAL_TRANSFORM(image).unsqueeze(0).to(self.base_model.device)
+        input_tensor = self.base_model._input_tensor(image_path).to(self.base_model.device)
 
-        with torch.no_grad():
+        with torch.inference_mode():
             # Get features from the layer before classifier
             features = self.base_model.model.features(input_tensor)
             features = self.base_model.model.avgpool(features)
             features = torch.flatten(features, 1)
             return features.cpu().numpy().flatten()
 
+    def _stacked_memory(self):
+        if self._stacked is None:
+            rings = [r for r in self.feature_memory.values() if len(r)]
+            if not rings:
+                return None, None
+            self._stacked = np.concatenate([r.rows[:len(r)] for r in rings])
+            self._stacked_class = np.repeat(np.arange(len(rings)), [len(r) for r in rings])
+        return self._stacked, self._stacked_class
+
+    def memory_similarity(self, feature_vector):
+        """`(confidence boost, similar-case count)` from one similarity pass over all classes.
+
+        The boost is `confidence_boost` per class with any stored vector above
+        `boost_threshold`; the count is every stored vector above
+        `similar_threshold`.
+        """
+        stacked, owner = self._stacked_memory()
+        if stacked is None:
+            return 0.0, 0
+        sims = stacked @ _unit_rows(np.ravel(feature_vector))
+        boosted_classes = np.unique(owner[sims > self.boost_threshold]).size
+        return boosted_classes * self.confidence_boost, int(np.count_nonzero(sims > self.similar_threshold))
+
     def check_feature_similarity(self, feature_vector):
         """Check if current features match stored patterns"""
-        boost = 0.0
-        for class_name, stored_features in self.feature_memory.items():
-            for stored_feature in stored_features:
-                sim = cosine_similarity(feature_vector.reshape(1, -1),
-                                      stored_feature.reshape(1, -1))[0][0]
-                if sim > 0.8:  # High similarity threshold
-                    boost += self.confidence_boost
-                    break  # Only boost once per class
-        return boost
+        return self.memory_similarity(feature_vector)[0]
 
     def get_similar_cases(self, feature_vector):
         """Get count of similar cases in memory"""
-        count = 0
-        for stored_features in self.feature_memory.values():
-            for stored_feature in stored_features:
-                sim = cosine_similarity(feature_vector.reshape(1, -1),
-                                      stored_feature.reshape(1, -1))[0][0]
-                if sim > 0.7:
-                    count += 1
-        return count
-
-    def update_memory(self, image_path, confirmed_diagnosis):
-        """Update memory with confirmed cases"""
-        feature_vector = self.get_feature_embedding(image_path)
+        return self.memory_similarity(feature_vector)[1]
 
-        if confirmed_diagnosis not in self.feature_memory:
-            self.feature_memory[confirmed_diagnosis] = []
+    def update_memory(self, image_path, confirmed_diagnosis, feature_vector=None):
+        """Update memory with confirmed cases (pass `feature_vector` to skip recomputing it)"""
+        if feature_vector is None:
+            feature_vector = self.get_feature_embedding(image_path)
 
+        if confirmed_diagnosis not in self.feature_memory:
+            # Keep only recent examples to prevent memory bloat
+            self.feature_memory[confirmed_diagnosis] = EmbeddingRing(self.max_memory_per_class)
         self.feature_memory[confirmed_diagnosis].append(feature_vector)
-
-        # Keep only recent examples to prevent memory bloat
-        if len(self.feature_memory[confirmed_diagnosis]) > self.max_memory_per_class:
-            self.feature_memory[confirmed_diagnosis].pop(0)
+        self._stacked = None
 
 
 class ConfidenceCalibrator:
-    """Dynamically adjusts confidence estimates based on recent performance"""
-    def __init__(self):
-        self.prediction_history = deque(maxlen=500)
+    """Dynamically adjusts confidence estimates based on recent performance.
+
+    Per-class counters and reliability-diagram bins over the sliding
+    `prediction_history` window are updated in O(1) as entries are appended
+    and evicted, so recording and `get_stats()` (including expected
+    calibration error) stay cheap enough to run on every request.
+    """
+    def __init__(self, window=500, n_bins=10, min_samples=10):
+        self.prediction_history = deque(maxlen=window)
         self.calibration_map = {}  # class -> confidence calibration factor
+        self.class_stats = {}  # class -> {'total', 'correct'} over the window
+        self.min_samples = min_samples
+        self.n_bins = n_bins
+        # Reliability diagram: per confidence bin, count / sum of confidence / correct
+        self.bin_counts = np.zeros(n_bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(n_bins, dtype=np.float64)
+        self.bin_correct = np.zeros(n_bins, dtype=np.int64)
 
     def record_prediction(self, prediction, was_correct):
-        self.prediction_history.append({
+        item = {
             'predicted_class': prediction['class'],
             'confidence': prediction['confidence'],
             'correct': was_correct
-        })
-        self.update_calibration()
+        }
+        if len(self.prediction_history) == self.prediction_history.maxlen:
+            self._update_stats(self.prediction_history[0], -1)
+        self.prediction_history.append(item)
+        self._update_stats(item, 1)
+
+    def _bin(self, confidence):
+        return min(max(int(confidence * self.n_bins), 0), self.n_bins - 1)
+
+    def _update_stats(self, item, sign):
+        cls = item['predicted_class']
+        stats = self.class_stats.setdefault(cls, {'total': 0, 'correct': 0})
+        stats['total'] += sign
+        stats['correct'] += sign * bool(item['correct'])
+        if stats['total'] > self.min_samples:  # Minimum samples
+            # Simple calibration: adjust confidence toward actual accuracy
+            self.calibration_map[cls] = stats['correct'] / stats['total']
+        elif stats['total'] == 0:
+            del self.class_stats[cls]
+
+        b = self._bin(item['confidence'])
+        self.bin_counts[b] += sign
+        self.bin_confidence[b] += sign * item['confidence']
+        self.bin_correct[b] += sign * bool(item['correct'])
 
     def update_calibration(self):
-        """Analyze recent performance per class"""
-        class_stats = {}
+        """Rebuild every statistic from `prediction_history` (normally maintained incrementally)"""
+        self.class_stats = {}
+        self.bin_counts[:] = 0
+        self.bin_confidence[:] = 0.0
+        self.bin_correct[:] = 0
         for item in self.prediction_history:
-            cls = item['predicted_class']
-            if cls not in class_stats:
-                class_stats[cls] = {'total': 0, 'correct': 0}
-
-            class_stats[cls]['total'] += 1
-            if item['correct']:
-                class_stats[cls]['correct'] += 1
+            self._update_stats(item, 1)
+
+    def expected_calibration_error(self):
+        total = self.bin_counts.sum()
+        if not total:
+            return None
+        filled = self.bin_counts > 0
+        gap = np.abs(self.bin_correct[filled] - self.bin_confidence[filled])
+        return float(gap.sum() / total)
+
+    def reliability_diagram(self):
+        """Per-bin `{'range', 'count', 'mean_confidence', 'accuracy'}` over the window"""
+        bins = []
+        for b in range(self.n_bins):
+            count = int(self.bin_counts[b])
+            bins.append({
+                'range': [b / self.n_bins, (b + 1) / self.n_bins],
+                'count': count,
+                'mean_confidence': float(self.bin_confidence[b] / count) if count else None,
+                'accuracy': float(self.bin_correct[b] / count) if count else None,
+            })
+        return bins
 
-        # Update calibration factors
-        for cls, stats in class_stats.items():
-            if stats['total'] > 10:  # Minimum samples
-                actual_accuracy = stats['correct'] / stats['total']
-                # Simple calibration: adjust confidence toward actual accuracy
-                self.calibration_map[cls] = actual_accuracy
+    def get_stats(self):
+        return {
+            'samples': len(self.prediction_history),
+            'calibrated_classes': len(self.calibration_map),
+            'ece': self.expected_calibration_error(),
+            'reliability': self.reliability_diagram(),
+        }
 
     def apply_calibration(self, prediction):
         class_key = prediction.get('class', prediction.get('prediction', ''))
@@ -405,8 +648,11 @@ class ConfidenceCalibrator:
 
 class InteractiveCoffeeDiagnosis:
     """Main wrapper combining all interactive learning mechanisms"""
+    TASKS = ('disease', 'deficiency')
+
     def __init__(self, disease_model_path, disease_classes_path,
-                 deficiency_model_path, deficiency_classes_path):
+                 deficiency_model_path, deficiency_classes_path, store_dir=None, recent_size=64,
+                 store_max_rows=4000, pending_size=1024):
         self.disease_classifier = AdaptiveClassifier(
             TorchClassifier(disease_model_path, disease_classes_path)
         )
@@ -422,16 +668,101 @@ class InteractiveCoffeeDiagnosis:
 
         self.last_disease_prediction = None
         self.last_deficiency_prediction = None
-
-    def diagnose(self, image_path):
-        """Enhanced diagnosis with interactive learning"""
-        # Get predictions with memory
-        disease_result = self.disease_classifier.predict_with_memory(image_path)
-        deficiency_result = self.deficiency_classifier.predict_with_memory(image_path)
-
-        # Get feature embeddings for memory lookup
-        disease_features = self.disease_classifier.get_feature_embedding(image_path)
-        deficiency_features = self.deficiency_classifier.get_feature_embedding(image_path)
+        self.last_disease_features = None
+        self.last_deficiency_features = None
+
+        # Recent diagnoses by image key (e.g. upload hash), so feedback can
+        # refer to a diagnosis without a server-side image path
+        self.recent = OrderedDict()
+        self.recent_size = recent_size
+
+        # Flask serves requests on several threads: syncing, learning and
+        # the `recent` / `last_*` bookkeeping go through this lock
+        self._lock = threading.RLock()
+
+        # Optional on-disk learning memory shared by all workers and kept
+        # across restarts; in-process structures are rebuilt from it. Once a
+        # store exceeds `store_max_rows` it is compacted to the rows the
+        # bounded in-memory structures can still use. Keyed diagnoses are
+        # also written to `<task>_pending` stores (the newest `pending_size`
+        # are kept), so feedback reaching another worker can still be applied.
+        self.stores = {}
+        self.pending = {}
+        self._synced = {}
+        self.store_max_rows = store_max_rows
+        self.pending_size = pending_size
+        if store_dir:
+            from src.embedding_store import EmbeddingStore
+            self.stores = {task: EmbeddingStore(store_dir, task) for task in self.TASKS}
+            self.pending = {task: EmbeddingStore(store_dir, f'{task}_pending') for task in self.TASKS}
+            self.sync()
+
+    def _reset_learning(self, task):
+        getattr(self, f'{task}_classifier').feature_memory = {}
+        getattr(self, f'{task}_classifier')._stacked = None
+        setattr(self, f'{task}_memory', InteractiveMemory())
+        setattr(self, f'{task}_calibrator', ConfidenceCalibrator())
+
+    def _learn(self, task, features, record):
+        """Apply one feedback record to the in-process memory, classifier and calibrator"""
+        with self._lock:
+            getattr(self, f'{task}_memory').add_interaction(
+                features, record['prediction'], record['confidence'], record['label'])
+            getattr(self, f'{task}_classifier').update_memory(None, record['label'], features)
+            getattr(self, f'{task}_calibrator').record_prediction(
+                {'class': record['prediction'], 'confidence': record['confidence']}, record['correct'])
+
+    def sync(self):
+        """Replay feedback appended to the stores (by any worker) since the last sync."""
+        with self._lock:
+            for task, store in self.stores.items():
+                if store.refresh() or self._synced.get(task, 0) > len(store):
+                    # Compacted: row numbers changed, rebuild from the new files
+                    self._reset_learning(task)
+                    self._synced[task] = 0
+                # Older rows would fall out of the bounded in-memory structures anyway
+                start = max(self._synced.get(task, 0), len(store) - getattr(self, f'{task}_memory').max_size)
+                for features, record in zip(store.vectors(start), store.metadata[start:]):
+                    self._learn(task, np.array(features), record)
+                self._synced[task] = len(store)
+
+    def _remember(self, key, diagnosis):
+        """Keep a keyed diagnosis for feedback, in this process and (with stores) for every worker"""
+        with self._lock:
+            self.recent[key] = diagnosis
+            self.recent.move_to_end(key)
+            while len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+        for task, store in self.pending.items():
+            prediction, features = diagnosis[task]
+            store.append(features, key=key, prediction=prediction['class'], confidence=prediction['confidence'])
+            if len(store) > 2 * self.pending_size:
+                store.compact(keep_last=self.pending_size, max_rows=2 * self.pending_size)
+
+    def _find_diagnosis(self, key):
+        """A diagnosis recorded under `key` by this or (with stores) any other worker, or None"""
+        with self._lock:
+            if key in self.recent:
+                return self.recent[key]
+        found = {}
+        for task, store in self.pending.items():
+            row = store.find_last(key=key)
+            if row is not None:
+                features, record = row
+                found[task] = ({'class': record['prediction'], 'confidence': record['confidence']}, features)
+        return found or None
+
+    def diagnose(self, image_path, key=None):
+        """Enhanced diagnosis with interactive learning.
+
+        Pass `key` (e.g. the upload's content hash) to allow feedback on this
+        diagnosis later via `provide_feedback(image_key=key, ...)`.
+        """
+        if self.stores:
+            self.sync()
+        # Predictions with memory; the embeddings come from the same forward pass
+        disease_result, disease_features = self.disease_classifier.predict_with_memory(image_path, return_embedding=True)
+        deficiency_result, deficiency_features = self.deficiency_classifier.predict_with_memory(image_path, return_embedding=True)
 
         # Check interactive memory for similar cases
         disease_similar = self.disease_memory.find_similar(disease_features)
@@ -441,9 +772,15 @@ class InteractiveCoffeeDiagnosis:
         disease_result['confidence'] = self.disease_calibrator.apply_calibration(disease_result)
         deficiency_result['confidence'] = self.deficiency_calibrator.apply_calibration(deficiency_result)
 
-        # Store last predictions for feedback
-        self.last_disease_prediction = disease_result
-        self.last_deficiency_prediction = deficiency_result
+        # Store last predictions (and their embeddings) for feedback
+        with self._lock:
+            self.last_disease_prediction = disease_result
+            self.last_deficiency_prediction = deficiency_result
+            self.last_disease_features = disease_features
+            self.last_deficiency_features = deficiency_features
+        if key is not None:
+            self._remember(key, {'disease': (disease_result, disease_features),
+                                 'deficiency': (deficiency_result, deficiency_features)})
 
         # Prepare enhanced response
         response = {
@@ -458,60 +795,79 @@ class InteractiveCoffeeDiagnosis:
                 'certainty_level': self.get_certainty_level(deficiency_result['confidence'])
             },
             'learning_stats': {
-                'disease_memory_size': len(self.disease_memory.memory),
-                'deficiency_memory_size': len(self.deficiency_memory.memory),
+                'disease_memory_size': len(self.disease_memory),
+                'deficiency_memory_size': len(self.deficiency_memory),
                 'disease_calibration_classes': len(self.disease_calibrator.calibration_map),
-                'deficiency_calibration_classes': len(self.deficiency_calibrator.calibration_map)
+                'deficiency_calibration_classes': len(self.deficiency_calibrator.calibration_map),
+                'disease_ece': self.disease_calibrator.expected_calibration_error(),
+                'deficiency_ece': self.deficiency_calibrator.expected_calibration_error()
             },
             'status': 'success'
         }
 
         return response
 
-    def provide_feedback(self, image_path, disease_feedback=None, deficiency_feedback=None):
-        """User provides feedback on the diagnosis"""
-        disease_features = self.disease_classifier.get_feature_embedding(image_path)
-        deficiency_features = self.deficiency_classifier.get_feature_embedding(image_path)
+    def provide_feedback(self, image_path=None, disease_feedback=None, deficiency_feedback=None, image_key=None):
+        """User provides feedback on the diagnosis.
 
-        feedback_applied = {'disease': False, 'deficiency': False}
-
-        # Update disease memory and calibration
-        if disease_feedback and self.last_disease_prediction:
-            true_label = disease_feedback
-            self.disease_memory.add_interaction(
-                disease_features,
-                self.last_disease_prediction['class'],
-                self.last_disease_prediction['confidence'],
-                true_label
-            )
-            self.disease_classifier.update_memory(image_path, true_label)
-
-            # Record calibration data
-            was_correct = (self.last_disease_prediction['class'] == true_label)
-            self.disease_calibrator.record_prediction(self.last_disease_prediction, was_correct)
-            feedback_applied['disease'] = True
-
-        # Update deficiency memory and calibration
-        if deficiency_feedback and self.last_deficiency_prediction:
-            true_label = deficiency_feedback
-            self.deficiency_memory.add_interaction(
-                deficiency_features,
-                self.last_deficiency_prediction['class'],
-                self.last_deficiency_prediction['confidence'],
-                true_label
-            )
-            self.deficiency_classifier.update_memory(image_path, true_label)
-
-            # Record calibration data
-            was_correct = (self.last_deficiency_prediction['class'] == true_label)
-            self.deficiency_calibrator.record_prediction(self.last_deficiency_prediction, was_correct)
-            feedback_applied['deficiency'] = True
+        The diagnosis is found by `image_key` (as passed to `diagnose`) or
+        else is the last one. Its embeddings are reused unless an
+        `image_path` is given, in which case one embedding pass runs per
+        model that receives feedback. With a store configured, feedback is
+        appended to it and picked up by every worker, and a keyed diagnosis
+        made by another worker is found in the pending stores.
+        """
+        recent = self._find_diagnosis(image_key) if image_key is not None else None
+        if image_key is not None and recent is None:
+            return {"status": "unknown_image", "feedback_applied": {'disease': False, 'deficiency': False}}
 
+        feedback_applied = {'disease': False, 'deficiency': False}
+        with self._lock:
+            for task, true_label in (('disease', disease_feedback), ('deficiency', deficiency_feedback)):
+                if not true_label:
+                    continue
+                if recent is not None:
+                    prediction, features = recent.get(task, (None, None))
+                else:
+                    prediction = getattr(self, f'last_{task}_prediction')
+                    features = getattr(self, f'last_{task}_features')
+                    if image_path is not None:
+                        features = getattr(self, f'{task}_classifier').get_feature_embedding(image_path)
+                if not prediction or features is None:
+                    continue
+
+                record = {
+                    'label': true_label,
+                    'prediction': prediction['class'],
+                    'confidence': prediction['confidence'],
+                    'correct': prediction['class'] == true_label
+                }
+                if task in self.stores:
+                    store = self.stores[task]
+                    store.append(features, **record)
+                    if self.store_max_rows and len(store) > self.store_max_rows:
+                        store.compact(keep_last=getattr(self, f'{task}_memory').max_size, max_rows=self.store_max_rows)
+                else:
+                    self._learn(task, features, record)
+                feedback_applied[task] = True
+
+            if self.stores:
+                self.sync()
+
+            return {
+                "status": "feedback_incorporated",
+                "disease_memory_size": len(self.disease_memory),
+                "deficiency_memory_size": len(self.deficiency_memory),
+                "feedback_applied": feedback_applied
+            }
+
+    def get_learning_stats(self):
+        """Memory sizes and calibration statistics (ECE, reliability bins) per model"""
         return {
-            "status": "feedback_incorporated",
-            "disease_memory_size": len(self.disease_memory.memory),
-            "deficiency_memory_size": len(self.deficiency_memory.memory),
-            "feedback_applied": feedback_applied
+            'disease_memory_size': len(self.disease_memory),
+            'deficiency_memory_size': len(self.deficiency_memory),
+            'disease_calibration': self.disease_calibrator.get_stats(),
+            'deficiency_calibration': self.deficiency_calibrator.get_stats()
         }
 
     def get_certainty_level(self, confidence):
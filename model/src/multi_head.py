@@ -0,0 +1,101 @@
+"""Shared-backbone EfficientNet-B0 with separate disease and deficiency heads.
+
+Both production classifiers are EfficientNet-B0 models that only differ in
+their final linear layer, so running them separately computes the same
+`features` trunk twice. `MultiHeadEfficientNet` keeps one trunk and two
+classifier heads and returns both sets of logits from a single forward pass.
+"""
+
+import torch
+import torch.nn as nn
+from torchvision import models
+import logging
+
+from src.inference import load_model_and_mapping, _apply_saved_bias_to_model
+
+logger = logging.getLogger(__name__)
+
+MULTIHEAD_FORMAT = 'multihead-efficientnet_b0'
+HEADS = ('disease', 'deficiency')
+
+
+def _make_head(in_features, num_classes, dropout=0.2):
+    # Same layout as torchvision's `efficientnet_b0().classifier` so the
+    # single-task checkpoints map 1:1 onto the heads.
+    return nn.Sequential(nn.Dropout(p=dropout, inplace=True), nn.Linear(in_features, num_classes))
+
+
+class MultiHeadEfficientNet(nn.Module):
+    def __init__(self, num_disease_classes, num_deficiency_classes):
+        super().__init__()
+        backbone = models.efficientnet_b0(weights=None)
+        in_features = backbone.classifier[1].in_features
+        self.features = backbone.features
+        self.avgpool = backbone.avgpool
+        self.disease_head = _make_head(in_features, num_disease_classes)
+        self.deficiency_head = _make_head(in_features, num_deficiency_classes)
+
+    def embed(self, x):
+        """Pooled penultimate embedding, shape [N, 1280]."""
+        x = self.features(x)
+        x = self.avgpool(x)
+        return torch.flatten(x, 1)
+
+    def forward(self, x):
+        emb = self.embed(x)
+        return self.disease_head(emb), self.deficiency_head(emb)
+
+
+def build_from_checkpoints(disease_weights, disease_mapping_path, deficiency_weights, deficiency_mapping_path):
+    """Assemble a multi-head model from the two single-task `.pth` files.
+
+    The trunk and disease head come from the disease checkpoint; the
+    deficiency head is copied from the deficiency checkpoint. Because that
+    head was trained on a different trunk, it must be re-fitted with
+    `build_multihead.py --finetune` before serving; the script will not
+    save an un-refitted model without `--allow-unfitted`.
+
+    Each checkpoint's saved per-class bias (`per_class_bias.json`, as
+    applied by `TorchClassifier`) is folded into its head before copying,
+    so switching to the shared-backbone model does not change predictions.
+
+    Returns `(model, disease_mapping, deficiency_mapping)`.
+    """
+    disease_model, disease_mapping = load_model_and_mapping(disease_weights, disease_mapping_path)
+    deficiency_model, deficiency_mapping = load_model_and_mapping(deficiency_weights, deficiency_mapping_path)
+    for weights, single in ((disease_weights, disease_model), (deficiency_weights, deficiency_model)):
+        if _apply_saved_bias_to_model(single, weights):
+            logger.info(f'Folded saved per-class bias for {weights} into its head')
+
+    model = MultiHeadEfficientNet(len(disease_mapping), len(deficiency_mapping))
+    model.features.load_state_dict(disease_model.features.state_dict())
+    model.disease_head.load_state_dict(disease_model.classifier.state_dict())
+    model.deficiency_head.load_state_dict(deficiency_model.classifier.state_dict())
+    model.eval()
+    return model, disease_mapping, deficiency_mapping
+
+
+def save_multihead(model, disease_mapping, deficiency_mapping, out_path):
+    torch.save({
+        'format': MULTIHEAD_FORMAT,
+        'state_dict': model.state_dict(),
+        'disease_mapping': disease_mapping,
+        'deficiency_mapping': deficiency_mapping,
+    }, str(out_path))
+
+
+def load_multihead(path, device='cpu'):
+    """Load a checkpoint written by `save_multihead`.
+
+    Returns `(model, disease_mapping, deficiency_mapping)`.
+    """
+    ckpt = torch.load(str(path), map_location=device)
+    if not isinstance(ckpt, dict) or ckpt.get('format') != MULTIHEAD_FORMAT:
+        raise ValueError(f'{path} is not a {MULTIHEAD_FORMAT} checkpoint')
+    disease_mapping = ckpt['disease_mapping']
+    deficiency_mapping = ckpt['deficiency_mapping']
+    model = MultiHeadEfficientNet(len(disease_mapping), len(deficiency_mapping))
+    model.load_state_dict(ckpt['state_dict'])
+    model.to(device)
+    model.eval()
+    return model, disease_mapping, deficiency_mapping
@@ -1,31 +1,97 @@
 import torch
+from io import BytesIO
 from PIL import Image
 import numpy as np
 
-def preprocess_image(img_path):
-    """Fast PIL-based preprocessing for speed optimization"""
-    # Load image with PIL
-    image = Image.open(img_path).convert("RGB")
+RESIZE = 256
+CROP = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# ToTensor + Normalize folded into one multiply-add on the uint8 pixels:
+# (p / 255 - mean) / std == p * SCALE + OFFSET, precomputed per channel in float32
+SCALE = (1.0 / (255.0 * np.asarray(STD))).astype(np.float32).reshape(3, 1, 1)
+OFFSET = (-np.asarray(MEAN) / np.asarray(STD)).astype(np.float32).reshape(3, 1, 1)
+
 
-    # Resize to 256, then center crop to 224
+def decode_image(data, min_side=RESIZE, draft=True, reduce=False):
+    """Decode an upload (bytes or file object) to RGB, shrinking during decode where possible.
+
+    `draft`: for JPEGs, let libjpeg downscale in the DCT domain (1/2, 1/4 or
+    1/8) to the smallest size whose sides are still >= `min_side`. A 12MP
+    phone photo decodes at 1/8 scale, which is far cheaper than a full
+    decode followed by a resize.
+    `reduce`: for other formats (PNG, WebP, ...) which cannot decode at
+    reduced size, box-reduce by an integer factor right after decoding so the
+    bilinear resize runs on a smaller image. Off by default; see
+    `decode_parity.py` for its effect on predictions.
+    """
+    image = Image.open(BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+    drafted = draft and image.format == "JPEG"
+    if drafted:
+        image.draft("RGB", (min_side, min_side))
+    image = image.convert("RGB")
+    if reduce and not drafted:
+        factor = min(image.size) // min_side
+        if factor >= 2:
+            image = image.reduce(factor)
+    return image
+
+
+def resize_center_crop(image, size=RESIZE, crop=CROP):
+    """Resize the short side to `size` (bilinear) and center-crop to `crop`, as VAL_TRANSFORM does."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
     width, height = image.size
     if width > height:
-        new_width = int(256 * width / height)
-        new_height = 256
+        new_width = int(size * width / height)
+        new_height = size
     else:
-        new_width = 256
-        new_height = int(256 * height / width)
-    image = image.resize((new_width, new_height), Image.BILINEAR)
-
-    # Center crop
-    left = (new_width - 224) // 2
-    top = (new_height - 224) // 2
-    right = left + 224
-    bottom = top + 224
-    image = image.crop((left, top, right, bottom))
-
-    # Convert to tensor and normalize
-    img_array = np.array(image).astype(np.float32) / 255.0
-    img_array = (img_array - [0.485, 0.456, 0.406]) / [0.229, 0.224, 0.225]
-    img_tensor = torch.from_numpy(img_array).permute(2, 0, 1).float()
-    return img_tensor.unsqueeze(0)
+        new_width = size
+        new_height = int(size * height / width)
+    if (new_width, new_height) != (width, height):
+        image = image.resize((new_width, new_height), Image.BILINEAR)
+
+    # Same rounding as torchvision's CenterCrop
+    left = int(round((new_width - crop) / 2.0))
+    top = int(round((new_height - crop) / 2.0))
+    return image.crop((left, top, left + crop, top + crop))
+
+
+def normalize_into(pixels, out):
+    """Write normalized CHW float32 for HWC uint8 `pixels` into `out` (numpy array or tensor).
+
+    No float64 upcast and no temporaries beyond `out` itself.
+    """
+    out = out.numpy() if isinstance(out, torch.Tensor) else out
+    np.multiply(np.asarray(pixels).transpose(2, 0, 1), SCALE, out=out)
+    np.add(out, OFFSET, out=out)
+    return out
+
+
+def preprocess_pil(image, out=None):
+    """PIL image -> normalized [1, 3, 224, 224] float32 tensor.
+
+    Pass `out` (a [1, 3, 224, 224] or [3, 224, 224] float32 tensor) to write
+    into a preallocated buffer instead of allocating one.
+    """
+    if out is None:
+        out = torch.empty(1, 3, CROP, CROP, dtype=torch.float32)
+    normalize_into(resize_center_crop(image), out.view(3, CROP, CROP))
+    return out if out.ndim == 4 else out.unsqueeze(0)
+
+
+def preprocess_batch(images, out=None):
+    """Preprocess PIL images into one [N, 3, 224, 224] batch, optionally reusing `out`."""
+    if out is None:
+        out = torch.empty(len(images), 3, CROP, CROP, dtype=torch.float32)
+    for i, image in enumerate(images):
+        normalize_into(resize_center_crop(image), out[i])
+    return out
+
+
+def preprocess_image(img_path):
+    """Fast PIL-based preprocessing for speed optimization"""
+    # Load image with PIL
+    image = Image.open(img_path).convert("RGB")
+    return preprocess_pil(image)
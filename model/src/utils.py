@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from typing import Iterable
 
@@ -11,4 +12,13 @@ def allowed_file(filename: str) -> bool:
     """
     if not filename or not isinstance(filename, str):
         return False
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
\ No newline at end of file
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def weights_fingerprint(path) -> str:
+    """
+    Identify a weights file by name, modification time and size, so a
+    retrained or re-exported model gets a new identity without hashing it.
+    """
+    st = os.stat(path)
+    return f"{Path(path).name}@{st.st_mtime_ns:x}-{st.st_size:x}"
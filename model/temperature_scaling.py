@@ -2,8 +2,9 @@
 """Temperature scaling calibration for model confidence.
 
 Fits a single temperature parameter on a validation set by minimizing
-negative log-likelihood. Applies temperature to logits at inference time
-and writes before/after metrics.
+negative log-likelihood and writes it with before/after metrics to
+`temperature_scaling.json`. Serving picks it up once it is folded into the
+model with `build_artifact.py --temperature` (or the export scripts).
 """
 
 import torch
@@ -324,6 +324,128 @@ class TestFileValidation:
         assert is_valid == False
         assert "File too large" in error
 
+class TestInferencePipeline:
+    """Tests for the single-pass upload inference pipeline"""
+
+    def _jpeg_upload(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (320, 240), color='green').save(buf, format='JPEG')
+        buf.seek(0)
+        return {'image': ('leaf.jpg', buf, 'image/jpeg')}
+
+    def test_upload_runs_each_model_once(self):
+        """Each runner is invoked exactly once and stage timings are reported"""
+        import model.app as appmod
+
+        calls = {'disease': 0, 'deficiency': 0}
+
+        class _CountingRunner:
+            def __init__(self, name):
+                self.name = name
+                self.mapping = None
+
+            def predict_image(self, image):
+                calls[self.name] += 1
+                return {'class': 'Healthy', 'confidence': 0.9, 'class_index': 0}
+
+        requests_before = appmod.metrics['total_requests']
+        with patch.object(appmod, 'disease_runner', _CountingRunner('disease')), \
+                patch.object(appmod, 'deficiency_runner', _CountingRunner('deficiency')):
+            response = requests.post(f"{TEST_BASE_URL}/api/v1/upload-image", files=self._jpeg_upload())
+
+        assert response.status_code == 200
+        assert calls == {'disease': 1, 'deficiency': 1}
+        assert appmod.metrics['total_requests'] == requests_before + 1
+
+        timings = response.json()["debug"]["timings"]
+        for stage in ["decode", "preprocess", "disease", "deficiency", "recommendations"]:
+            assert stage in timings
+            assert timings[stage] >= 0
+
+    def test_repeated_upload_served_from_prediction_cache(self):
+        """A retried upload of the same photo skips inference and is counted as a cache hit"""
+        import model.app as appmod
+
+        calls = []
+
+        class _CountingRunner:
+            mapping = None
+
+            def predict_image(self, image):
+                calls.append(1)
+                return {'class': 'Healthy', 'confidence': 0.9, 'class_index': 0}
+
+        appmod.prediction_cache.clear()
+        hits_before = appmod.prediction_cache.hits
+        # Keep the governor from trimming caches between the two uploads
+        with patch.object(appmod, 'disease_runner', _CountingRunner()), \
+                patch.object(appmod, 'deficiency_runner', _CountingRunner()), \
+                patch.object(appmod.memory_governor, 'hard_limit_mb', float('inf')):
+            first = requests.post(f"{TEST_BASE_URL}/api/v1/upload-image", files=self._jpeg_upload())
+            second = requests.post(f"{TEST_BASE_URL}/api/v1/upload-image", files=self._jpeg_upload())
+
+        assert first.status_code == 200 and second.status_code == 200
+        assert len(calls) == 2
+        assert first.json()['debug']['cache'] == 'miss'
+        assert second.json()['debug']['cache'] == 'hit'
+        assert second.json()['disease_prediction'] == first.json()['disease_prediction']
+        assert appmod.prediction_cache.hits == hits_before + 1
+        appmod.prediction_cache.clear()
+
+    def test_interactive_fallback_formats_top3(self):
+        """The interactive fallback returns `top3` like the upload endpoint, not the raw `top_k`"""
+        import model.app as appmod
+
+        class _Runner:
+            mapping = None
+
+            def predict_image(self, image):
+                return {'class': 'Healthy', 'confidence': 0.9, 'class_index': 0,
+                        'top_k': [{'class': 'Healthy', 'confidence': 0.9}]}
+
+        with patch.object(appmod, 'disease_runner', _Runner()), \
+                patch.object(appmod, 'deficiency_runner', _Runner()), \
+                patch.object(appmod, 'interactive_system', None, create=True):
+            response = requests.post(f"{TEST_BASE_URL}/api/interactive-diagnose", files=self._jpeg_upload())
+
+        assert response.status_code == 200
+        for key in ('disease_prediction', 'deficiency_prediction'):
+            prediction = response.json()[key]
+            assert 'top_k' not in prediction
+            assert prediction['top3'] == [{'class': 'Healthy', 'confidence': 0.9}]
+
+    def test_replaced_scheduler_is_closed(self):
+        """Swapping the runner closes the old batch scheduler instead of leaking its workers"""
+        import model.app as appmod
+
+        class _Runner:
+            def predict_tensor(self, batch):
+                return [{'class': 'Healthy', 'confidence': 0.9, 'class_index': 0}] * len(batch)
+
+        with patch.object(appmod, 'BATCHING_ENABLED', True), patch.dict(appmod._schedulers, clear=True):
+            old = appmod.get_scheduler('disease', _Runner())
+            new = appmod.get_scheduler('disease', _Runner())
+            assert new is not old
+            assert old.get_stats()['closed'] and not new.get_stats()['closed']
+            new.close()
+
+    def test_model_version_loads_runners_first(self):
+        """The cache key names the loaded weights, even on the first request"""
+        import model.app as appmod
+
+        class _Runner:
+            def __init__(self, version):
+                self.version = version
+
+        def _load():
+            appmod.disease_runner, appmod.deficiency_runner = _Runner('quant:d.pt@1'), _Runner('quant:n.pt@1')
+            return appmod.disease_runner, appmod.deficiency_runner
+
+        with patch.object(appmod, 'disease_runner', None), patch.object(appmod, 'deficiency_runner', None), \
+                patch.object(appmod, 'get_runners', side_effect=_load):
+            assert appmod.model_version().endswith('|quant:d.pt@1|quant:n.pt@1')
+
+
 class TestIntegration:
     """Integration tests that require full app setup"""
 
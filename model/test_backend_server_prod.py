@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory upload path of backend_server_prod.py
+
+The module builds its runner at import time, so it is imported with a stub
+runner in place of `ModelRunner` and does not need the trained models.
+"""
+
+import importlib
+import io
+import os
+import sys
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import serving_utils
+
+
+class StubRunner:
+    def __init__(self, *args, **kwargs):
+        self.sizes = []
+
+    def predict_batch_pil(self, images):
+        self.sizes.extend(img.size for img in images)
+        return [{'class': 'Healthy', 'confidence': 1.0} for _ in images]
+
+
+@pytest.fixture
+def server():
+    sys.modules.pop('backend_server_prod', None)
+    with patch.object(serving_utils, 'ModelRunner', StubRunner):
+        module = importlib.import_module('backend_server_prod')
+    yield module
+    module.batcher.close()
+    sys.modules.pop('backend_server_prod', None)
+
+
+def _png_upload(size=(512, 512)):
+    # Noise does not compress, so the upload is well past werkzeug's
+    # 500 KB in-memory spooling threshold
+    pixels = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+class TestInMemoryUploads:
+    """Uploads are decoded from memory and bounded by MAX_CONTENT_LENGTH"""
+
+    def test_upload_never_touches_disk(self, server):
+        upload = _png_upload()
+        assert len(upload.getvalue()) > 500 * 1024
+
+        def no_disk(*args, **kwargs):
+            raise AssertionError('upload spooled to a temporary file')
+
+        with patch('werkzeug.formparser.SpooledTemporaryFile', no_disk), \
+                patch('tempfile.SpooledTemporaryFile', no_disk), \
+                patch('tempfile.TemporaryFile', no_disk), \
+                patch('tempfile.NamedTemporaryFile', no_disk):
+            response = server.app.test_client().post(
+                '/predict', data={'images': (upload, 'leaf.png')}, content_type='multipart/form-data'
+            )
+
+        assert response.status_code == 200
+        assert response.get_json()['results'] == [{'class': 'Healthy', 'confidence': 1.0}]
+        assert server.runner.sizes == [(512, 512)]
+
+    def test_oversized_upload_is_rejected(self, server):
+        upload = _png_upload()
+        with patch.dict(server.app.config, {'MAX_CONTENT_LENGTH': 64 * 1024}):
+            response = server.app.test_client().post(
+                '/predict', data={'images': (upload, 'leaf.png')}, content_type='multipart/form-data'
+            )
+
+        assert response.status_code == 413
+        assert server.runner.sizes == []
+
+    def test_missing_field_is_rejected(self, server):
+        response = server.app.test_client().post('/predict', data={}, content_type='multipart/form-data')
+        assert response.status_code == 400
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process micro-batching scheduler (batching.py)
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batching import BatchScheduler, DeadlineExceeded, Histogram, runner_batch_fn
+
+
+class TestBatchScheduler:
+    """Coalescing, flushing and deadline behaviour"""
+
+    def test_concurrent_requests_are_coalesced(self):
+        calls = []
+        gate = threading.Event()
+
+        def process(items):
+            gate.wait(timeout=5)
+            calls.append(list(items))
+            return [x * 10 for x in items]
+
+        scheduler = BatchScheduler(process, max_batch_size=4, max_wait=0.05)
+        futures = [scheduler.submit(i) for i in range(4)]
+        gate.set()
+
+        assert [f.result(timeout=5) for f in futures] == [0, 10, 20, 30]
+        assert calls == [[0, 1, 2, 3]]
+        assert scheduler.get_stats()['batch_size']['count'] == 1
+
+    def test_lone_request_flushes_after_max_wait(self):
+        scheduler = BatchScheduler(lambda items: items, max_batch_size=16, max_wait=0.02)
+        start = time.monotonic()
+        assert scheduler.predict('leaf', timeout=5) == 'leaf'
+        assert time.monotonic() - start < 1.0
+
+    def test_expired_deadline_is_not_run(self):
+        seen = []
+        blocker = threading.Event()
+
+        def process(items):
+            seen.extend(items)
+            blocker.wait(timeout=5)
+            return items
+
+        scheduler = BatchScheduler(process, max_batch_size=1, max_wait=0.0)
+        first = scheduler.submit('first')
+        time.sleep(0.05)  # worker is now blocked on the first batch
+        late = scheduler.submit('late', deadline=time.monotonic() + 0.01)
+        time.sleep(0.05)
+        blocker.set()
+
+        assert first.result(timeout=5) == 'first'
+        with pytest.raises(DeadlineExceeded):
+            late.result(timeout=5)
+        assert 'late' not in seen
+        assert scheduler.get_stats()['expired_total'] == 1
+
+    def test_batch_errors_propagate(self):
+        def process(items):
+            raise ValueError('boom')
+
+        scheduler = BatchScheduler(process, max_batch_size=2, max_wait=0.0)
+        with pytest.raises(ValueError):
+            scheduler.predict('x', timeout=5)
+
+    def test_multiple_workers_run_batches_concurrently(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def process(items):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return items
+
+        scheduler = BatchScheduler(process, max_batch_size=1, max_wait=0.0, num_workers=2)
+        futures = [scheduler.submit(i) for i in range(2)]
+        assert [f.result(timeout=5) for f in futures] == [0, 1]
+        assert peak[0] == 2
+
+    def test_close_drains_queued_requests(self):
+        scheduler = BatchScheduler(lambda items: items, max_batch_size=4, max_wait=10.0)
+        futures = [scheduler.submit(i) for i in range(3)]
+        scheduler.close(drain=True, timeout=5)
+
+        # max_wait is 10s, so these were flushed by close() rather than the timer
+        assert [f.result(timeout=0) for f in futures] == [0, 1, 2]
+        with pytest.raises(RuntimeError):
+            scheduler.submit('late')
+
+    def test_close_without_drain_fails_pending(self):
+        scheduler = BatchScheduler(lambda items: items, max_batch_size=4, max_wait=10.0)
+        future = scheduler.submit('x')
+        scheduler.close(drain=False, timeout=5)
+        with pytest.raises(RuntimeError):
+            future.result(timeout=0)
+
+    def test_cancelled_requests_are_skipped(self):
+        seen = []
+        blocker = threading.Event()
+
+        def process(items):
+            seen.extend(items)
+            blocker.wait(timeout=5)
+            return items
+
+        scheduler = BatchScheduler(process, max_batch_size=1, max_wait=0.0)
+        first = scheduler.submit('first')
+        time.sleep(0.05)  # worker is now blocked on the first batch
+        dropped = scheduler.submit('dropped')
+        assert dropped.cancel()
+        blocker.set()
+
+        assert first.result(timeout=5) == 'first'
+        assert scheduler.predict('after', timeout=5) == 'after'
+        assert seen == ['first', 'after']
+        scheduler.close(drain=False, timeout=5)
+
+    def test_runner_batch_fn_concatenates_tensors(self):
+        class _Runner:
+            def predict_tensor(self, batch):
+                return [{'rows': batch.shape[0]} for _ in range(batch.shape[0])]
+
+        process = runner_batch_fn(_Runner())
+        results = process([torch.zeros(1, 3, 224, 224), torch.zeros(3, 224, 224)])
+        assert results == [{'rows': 2}, {'rows': 2}]
+
+
+def test_histogram_cumulative_buckets():
+    h = Histogram((1, 2, 4))
+    for v in (1, 2, 3, 10):
+        h.observe(v)
+    snap = h.snapshot()
+    assert snap['buckets'] == {'1': 1, '2': 2, '4': 3, '+Inf': 4}
+    assert snap['count'] == 4
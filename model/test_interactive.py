@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Tests for the interactive learning components in src/inference.py
+"""
+
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from src.embedding_store import EmbeddingStore
+from src.inference import (AdaptiveClassifier, ConfidenceCalibrator, InteractiveCoffeeDiagnosis, InteractiveMemory, TorchClassifier,
+                           build_efficientnet_b0, forward_with_embedding)
+
+
+def _cosine(a, b):
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+class TestInteractiveMemory:
+    """Ring-buffer embedding matrix and top-k similarity search"""
+
+    def test_ring_buffer_keeps_most_recent(self):
+        memory = InteractiveMemory(max_size=100)
+        rng = np.random.default_rng(0)
+        for i in range(250):
+            memory.add_interaction(rng.normal(size=16), f'case{i}', 0.9)
+        memory.add_interaction(rng.normal(size=16), 'ignored', 0.5)  # below confidence threshold
+        assert len(memory) == 100
+        assert [item['prediction'] for item in memory.memory] == [f'case{i}' for i in range(150, 250)]
+
+    def test_find_similar_matches_bruteforce(self):
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(4, 64))
+        embeddings = [centers[i % 4] + 0.5 * rng.normal(size=64) for i in range(120)]
+        memory = InteractiveMemory(max_size=80)
+        for i, e in enumerate(embeddings):
+            memory.add_interaction(e, i, 0.95)
+        query = centers[2] + 0.5 * rng.normal(size=64)
+
+        expected = sorted(((_cosine(query, e), i) for i, e in enumerate(embeddings[-80:], start=40)), reverse=True)
+        expected = [(s, i) for s, i in expected if s > 0.5][:5]
+        found = memory.find_similar(query, threshold=0.5)
+        assert [item['prediction'] for _, item in found] == [i for _, i in expected]
+        np.testing.assert_allclose([s for s, _ in found], [s for s, _ in expected], rtol=1e-5)
+        assert InteractiveMemory().find_similar(query) == []
+
+    def test_approximate_index_finds_near_neighbours(self):
+        rng = np.random.default_rng(2)
+        centers = rng.normal(size=(20, 32))
+        memory = InteractiveMemory(max_size=3000, ann_threshold=1000)
+        for i in range(2000):
+            memory.add_interaction(centers[i % 20] + 0.3 * rng.normal(size=32), i % 20, 0.9)
+        found = memory.find_similar(centers[7], threshold=0.5)
+        assert memory._centroids is not None
+        assert len(found) == 5
+        assert all(item['prediction'] == 7 for _, item in found)
+
+    def test_concurrent_adds_and_searches(self):
+        memory = InteractiveMemory(max_size=200)
+        vector = np.ones(64)
+        errors = []
+
+        def writer():
+            for i in range(1000):
+                memory.add_interaction(vector, i, 0.9)
+
+        def reader():
+            try:
+                for _ in range(300):
+                    # Every published row is the same unit vector
+                    for sim, _ in memory.find_similar(vector, threshold=-2):
+                        assert sim == pytest.approx(1.0, abs=1e-5)
+            except AssertionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert len(memory) == 200
+
+
+class TestAdaptiveClassifier:
+    """Vectorized per-class similarity against the original per-pair loops"""
+
+    def _classifier(self, vectors_by_class, max_per_class=50):
+        clf = AdaptiveClassifier(base_model=None, max_memory_per_class=max_per_class)
+        for name, vectors in vectors_by_class.items():
+            for v in vectors:
+                clf.get_feature_embedding = lambda _path, v=v: v
+                clf.update_memory('unused.jpg', name)
+        return clf
+
+    def test_boost_and_count_match_pairwise_loops(self):
+        rng = np.random.default_rng(3)
+        centers = rng.normal(size=(3, 32))
+        memory = {f'class{c}': [centers[c] + 0.4 * rng.normal(size=32) for _ in range(10)] for c in range(3)}
+        clf = self._classifier(memory)
+        query = centers[1] + 0.2 * rng.normal(size=32)
+
+        sims = {name: [_cosine(query, v) for v in vs] for name, vs in memory.items()}
+        expected_boost = sum(0.1 for s in sims.values() if any(x > 0.8 for x in s))
+        expected_count = sum(x > 0.7 for s in sims.values() for x in s)
+        boost, count = clf.memory_similarity(query)
+        assert boost == expected_boost and count == expected_count
+        assert clf.check_feature_similarity(query) == boost
+        assert clf.get_similar_cases(query) == count
+        assert AdaptiveClassifier(base_model=None).memory_similarity(query) == (0.0, 0)
+
+    def test_per_class_memory_is_bounded(self):
+        rng = np.random.default_rng(4)
+        vectors = rng.normal(size=(12, 8))
+        clf = self._classifier({'rust': list(vectors)}, max_per_class=5)
+        assert len(clf.feature_memory['rust']) == 5
+        # Only the five most recent vectors remain
+        stored = clf.feature_memory['rust'].rows
+        latest = vectors[-5:] / np.linalg.norm(vectors[-5:], axis=1, keepdims=True)
+        assert stored.shape == (5, 8)
+        np.testing.assert_allclose((stored @ latest.T).max(axis=0), 1.0, atol=1e-5)
+
+
+def _classifier(num_classes):
+    """TorchClassifier over a randomly initialized EfficientNet-B0, counting trunk passes"""
+    clf = TorchClassifier.__new__(TorchClassifier)
+    clf.device = torch.device('cpu')
+    clf.model = build_efficientnet_b0(num_classes).eval()
+    clf.classes = {str(i): {'name': f'class{i}'} for i in range(num_classes)}
+    clf.trunk_passes = 0
+    clf.model.features.register_forward_hook(lambda *_: setattr(clf, 'trunk_passes', clf.trunk_passes + 1))
+    return clf
+
+
+class TestForwardWithEmbedding:
+    """Logits and the pooled embedding come out of one forward pass"""
+
+    def test_matches_separate_passes(self):
+        torch.manual_seed(0)
+        model = build_efficientnet_b0(4).eval()
+        x = torch.randn(2, 3, 224, 224)
+        with torch.inference_mode():
+            logits, embedding = forward_with_embedding(model, x)
+            torch.testing.assert_close(logits, model(x))
+            torch.testing.assert_close(embedding, torch.flatten(model.avgpool(model.features(x)), 1))
+        assert embedding.shape == (2, 1280)
+
+    def test_interactive_diagnosis_runs_one_pass_per_model(self):
+        disease, deficiency = _classifier(3), _classifier(4)
+        with patch('src.inference.TorchClassifier', side_effect=[disease, deficiency]):
+            system = InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json')
+
+        image = Image.new('RGB', (320, 240), color=(40, 120, 30))
+        result = system.diagnose(image)
+        assert result['status'] == 'success'
+        assert (disease.trunk_passes, deficiency.trunk_passes) == (1, 1)
+
+        # Feedback on the last diagnosis reuses its embeddings
+        feedback = system.provide_feedback(disease_feedback='class0', deficiency_feedback='class1')
+        assert feedback['feedback_applied'] == {'disease': True, 'deficiency': True}
+        assert (disease.trunk_passes, deficiency.trunk_passes) == (1, 1)
+        assert len(system.disease_classifier.feature_memory['class0']) == 1
+
+
+class TestConfidenceCalibrator:
+    """Sliding-window statistics kept incrementally match a full rescan"""
+
+    def test_incremental_matches_rescan(self):
+        rng = np.random.default_rng(5)
+        calibrator = ConfidenceCalibrator(window=50)
+        for _ in range(200):
+            cls = f'class{rng.integers(3)}'
+            calibrator.record_prediction({'class': cls, 'confidence': float(rng.random())}, bool(rng.random() < 0.7))
+
+        incremental = ({k: dict(v) for k, v in calibrator.class_stats.items()}, dict(calibrator.calibration_map),
+                       calibrator.expected_calibration_error(), calibrator.bin_counts.copy())
+        calibrator.update_calibration()
+        assert incremental[0] == calibrator.class_stats
+        assert incremental[1] == calibrator.calibration_map
+        assert incremental[2] == pytest.approx(calibrator.expected_calibration_error())
+        assert (incremental[3] == calibrator.bin_counts).all()
+        assert calibrator.bin_counts.sum() == 50
+
+    def test_ece_and_reliability(self):
+        calibrator = ConfidenceCalibrator()
+        assert calibrator.expected_calibration_error() is None
+        for correct in (True, True, False, False):
+            calibrator.record_prediction({'class': 'rust', 'confidence': 0.95}, correct)
+        # Confidence 0.95 against 50% accuracy
+        assert calibrator.expected_calibration_error() == pytest.approx(0.45)
+        top_bin = calibrator.reliability_diagram()[-1]
+        assert top_bin['count'] == 4 and top_bin['accuracy'] == 0.5
+        assert 'rust' not in calibrator.calibration_map  # needs more than min_samples
+
+
+class TestEmbeddingStore:
+    """Append-only memory-mapped store shared between readers and writers"""
+
+    def test_append_refresh_and_compact(self, tmp_path):
+        writer = EmbeddingStore(tmp_path, 'disease', dim=8)
+        reader = EmbeddingStore(tmp_path, 'disease', dim=8)
+        rng = np.random.default_rng(6)
+        vectors = rng.normal(size=(5, 8))
+        for i, v in enumerate(vectors):
+            assert writer.append(v, label=f'class{i}') == i
+
+        assert len(reader) == 0
+        assert reader.refresh() is False
+        assert len(reader) == 5 and reader.metadata[4]['label'] == 'class4'
+        assert isinstance(reader.vectors(), np.memmap)
+        np.testing.assert_allclose(reader.vectors(), vectors / np.linalg.norm(vectors, axis=1, keepdims=True), rtol=1e-6)
+
+        assert writer.compact(keep_last=2) == 2
+        assert reader.refresh() is True
+        assert [m['label'] for m in reader.metadata] == ['class3', 'class4']
+        np.testing.assert_allclose(reader.vectors()[0], vectors[3] / np.linalg.norm(vectors[3]), rtol=1e-6)
+
+    def test_compacting_instance_sees_the_rewrite(self, tmp_path):
+        store = EmbeddingStore(tmp_path, 'disease', dim=4)
+        for i in range(5):
+            store.append(np.full(4, i + 1.0), label=f'class{i}')
+        assert store.compact(keep_last=5, max_rows=5) is None  # not over the limit
+        assert store.refresh() is False
+
+        assert store.compact(keep_last=2) == 2
+        assert store.refresh() is True
+        assert store.refresh() is False
+        # Appending after a compaction continues from the compacted rows
+        assert store.append(np.ones(4), label='new') == 2
+        assert [m['label'] for m in EmbeddingStore(tmp_path, 'disease', dim=4).metadata] == ['class3', 'class4', 'new']
+
+    def test_interrupted_append_is_ignored(self, tmp_path):
+        store = EmbeddingStore(tmp_path, 'deficiency', dim=4)
+        store.append(np.ones(4), label='a')
+        # A crash after writing the vector but before its record
+        with open(store.vectors_path, 'ab') as f:
+            f.write(np.zeros(4, dtype=np.float32).tobytes())
+        with open(store.index_path, 'ab') as f:
+            f.write(b'{"label":')
+        reopened = EmbeddingStore(tmp_path, 'deficiency', dim=4)
+        assert len(reopened) == 1
+        reopened.append(np.full(4, 2.0), label='b')
+        assert [m['label'] for m in EmbeddingStore(tmp_path, 'deficiency', dim=4).metadata] == ['a', 'b']
+        assert store.vectors_path.stat().st_size == 2 * 4 * 4
+
+    def test_concurrent_refreshes_read_each_row_once(self, tmp_path):
+        writer = EmbeddingStore(tmp_path, 'disease', dim=4)
+        reader = EmbeddingStore(tmp_path, 'disease', dim=4)
+        for i in range(1000):
+            writer.append(np.full(4, i + 1.0), label=f'class{i}')
+
+        barrier = threading.Barrier(8)
+
+        def refresh():
+            barrier.wait()
+            reader.refresh()
+
+        threads = [threading.Thread(target=refresh) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert [m['label'] for m in reader.metadata] == [f'class{i}' for i in range(1000)]
+        assert reader.vectors().shape == (1000, 4)
+        assert reader.find_last(label='class7')[1]['label'] == 'class7'
+        assert reader.find_last(label='nope') is None
+
+    def test_feedback_persists_across_workers(self, tmp_path):
+        def worker():
+            with patch('src.inference.TorchClassifier', side_effect=[_classifier(3), _classifier(4)]):
+                return InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json', store_dir=tmp_path)
+
+        first, second = worker(), worker()
+        image = Image.new('RGB', (300, 260), color=(90, 140, 60))
+        diagnosis = first.diagnose(image, key='abc123')
+        result = first.provide_feedback(image_key='abc123', disease_feedback='class2')
+        assert result['feedback_applied'] == {'disease': True, 'deficiency': False}
+        assert first.provide_feedback(image_key='missing', disease_feedback='class2')['status'] == 'unknown_image'
+
+        # Another worker, and a restarted one, pick the feedback up from disk
+        second.sync()
+        restarted = worker()
+        for system in (first, second, restarted):
+            assert len(system.disease_classifier.feature_memory['class2']) == 1
+            assert len(system.disease_calibrator.prediction_history) == 1
+        record = restarted.stores['disease'].metadata[0]
+        assert record['prediction'] == diagnosis['disease_prediction']['class']
+
+    def test_feedback_reaches_a_different_worker(self, tmp_path):
+        def worker():
+            with patch('src.inference.TorchClassifier', side_effect=[_classifier(3), _classifier(4)]):
+                return InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json', store_dir=tmp_path)
+
+        first, second = worker(), worker()
+        diagnosis = first.diagnose(Image.new('RGB', (300, 260), color=(90, 140, 60)), key='abc123')
+
+        # The load balancer sends the feedback to a worker that never saw the image
+        assert 'abc123' not in second.recent
+        result = second.provide_feedback(image_key='abc123', deficiency_feedback='class3')
+        assert result['feedback_applied'] == {'disease': False, 'deficiency': True}
+        record = second.stores['deficiency'].metadata[0]
+        assert record['prediction'] == diagnosis['deficiency_prediction']['class']
+        assert record['confidence'] == diagnosis['deficiency_prediction']['confidence']
+        first.sync()
+        assert len(first.deficiency_classifier.feature_memory['class3']) == 1
+
+    def test_pending_diagnoses_are_bounded(self, tmp_path):
+        with patch('src.inference.TorchClassifier', side_effect=[_classifier(3), _classifier(4)]):
+            system = InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json', store_dir=tmp_path,
+                                                recent_size=1, pending_size=2)
+        image = Image.new('RGB', (300, 260), color=(90, 140, 60))
+        for key in ('a', 'b', 'c', 'd', 'e'):
+            system.diagnose(image, key=key)
+
+        assert [m['key'] for m in system.pending['disease'].metadata] == ['d', 'e']
+        assert list(system.recent) == ['e']
+        assert system.provide_feedback(image_key='d', disease_feedback='class1')['feedback_applied']['disease']
+        assert system.provide_feedback(image_key='a', disease_feedback='class1')['status'] == 'unknown_image'
+
+    def test_concurrent_syncs_replay_each_row_once(self, tmp_path):
+        with patch('src.inference.TorchClassifier', side_effect=[_classifier(3), _classifier(4)]):
+            system = InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json', store_dir=tmp_path)
+        other = EmbeddingStore(tmp_path, 'disease')
+        rng = np.random.default_rng(7)
+        for i in range(100):
+            other.append(rng.normal(size=1280), label=f'class{i % 3}', prediction='class0', confidence=0.9,
+                         correct=i % 3 == 0)
+
+        barrier = threading.Barrier(6)
+
+        def sync():
+            barrier.wait()
+            system.sync()
+
+        threads = [threading.Thread(target=sync) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert system._synced['disease'] == 100
+        assert len(system.disease_calibrator.prediction_history) == 100
+        assert len(system.disease_memory) == 100
+
+    def test_feedback_compacts_large_stores(self, tmp_path):
+        with patch('src.inference.TorchClassifier', side_effect=[_classifier(3), _classifier(4)]):
+            system = InteractiveCoffeeDiagnosis('d.pth', 'd.json', 'n.pth', 'n.json', store_dir=tmp_path, store_max_rows=3)
+        system.disease_memory.max_size = 2
+        image = Image.new('RGB', (300, 260), color=(90, 140, 60))
+        system.diagnose(image, key='leaf')
+        for label in ('class0', 'class1', 'class2', 'class0'):
+            system.provide_feedback(image_key='leaf', disease_feedback=label)
+
+        # The fourth append pushed the store past 3 rows: it kept the newest 2
+        store = system.stores['disease']
+        assert [m['label'] for m in store.metadata] == ['class2', 'class0']
+        assert store.vectors_path.stat().st_size == 2 * 1280 * 4
+        # ...and this process rebuilt its memory from the compacted store
+        assert system._synced['disease'] == 2
+        assert len(system.disease_calibrator.prediction_history) == 2
+        system.provide_feedback(image_key='leaf', disease_feedback='class1')
+        assert len(system.disease_calibrator.prediction_history) == 3
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the threshold-driven memory governor (memory_governor.py)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import memory_governor
+from memory_governor import MemoryGovernor
+from serving_utils import TensorPool
+
+
+class TestMemoryGovernor:
+    """Collection and cache trimming only above the configured limits"""
+
+    def test_below_soft_limit_does_nothing(self):
+        gov = MemoryGovernor(soft_limit_mb=1e9, hard_limit_mb=2e9, check_interval=0)
+        cleared = []
+        gov.register_trim('cache', lambda: cleared.append(1))
+        assert gov.check() is None
+        stats = gov.get_stats()
+        assert stats['checks_total'] == 1
+        assert stats['collections_total'] == 0
+        assert not cleared
+
+    def test_soft_limit_collects_without_trimming(self):
+        gov = MemoryGovernor(soft_limit_mb=0, hard_limit_mb=1e9, check_interval=0)
+        cleared = []
+        gov.register_trim('cache', lambda: cleared.append(1))
+        assert gov.check() == 'collect'
+        assert gov.get_stats()['collections_total'] == 1
+        assert not cleared
+
+    def test_hard_limit_trims_registered_caches(self):
+        gov = MemoryGovernor(soft_limit_mb=0, hard_limit_mb=0, check_interval=0)
+        pool = TensorPool(max_per_size=1, pin_memory=False)
+        pool.release(pool.acquire(2))
+        gov.register_trim('pool', pool.clear, pool.pooled_bytes)
+        assert gov.get_stats()['caches']['pool'] > 0
+
+        assert gov.check() == 'trim'
+        stats = gov.get_stats()
+        assert stats['trims_total'] == 1
+        assert stats['caches']['pool'] == 0
+        assert stats['last_action']['action'] == 'trim'
+
+    def test_checks_are_rate_limited(self):
+        gov = MemoryGovernor(soft_limit_mb=0, hard_limit_mb=1e9, check_interval=60)
+        assert gov.check() == 'collect'
+        assert gov.check() is None
+        assert gov.check(force=True) == 'collect'
+        assert gov.get_stats()['checks_total'] == 2
+
+    def test_ineffective_collection_backs_off(self):
+        gov = MemoryGovernor(soft_limit_mb=0, hard_limit_mb=1e9, check_interval=0, min_freed_mb=1e9)
+        assert gov.check() == 'collect'
+        # Nothing was freed and RSS has not grown: no collection on every check
+        assert gov.check() is None
+        stats = gov.get_stats()
+        assert stats['collections_total'] == 1 and stats['backoffs_total'] == 1
+        assert stats['backoff_seconds'] > 0
+        assert gov.check(force=True) == 'collect'
+        assert gov.get_stats()['backoff_seconds'] == 2 * stats['backoff_seconds']
+
+    def test_limits_follow_post_load_baseline(self):
+        gov = MemoryGovernor(soft_limit_mb=380, hard_limit_mb=450, check_interval=0,
+                             soft_headroom_mb=64, hard_headroom_mb=128, max_mb=600)
+        assert gov.limits() == (380, 450)
+        gov.set_baseline(400)
+        assert gov.limits() == (464, 528)
+        gov.set_baseline(100)
+        assert gov.limits() == (380, 450)
+
+    def test_raised_limits_are_capped(self, caplog):
+        # max_mb defaults to the configured hard limit
+        gov = MemoryGovernor(soft_limit_mb=380, hard_limit_mb=450, check_interval=0,
+                             soft_headroom_mb=64, hard_headroom_mb=128)
+        gov.set_baseline(400)
+        assert gov.limits() == (450, 450)
+        assert not caplog.records
+
+        with caplog.at_level('WARNING', logger='memory_governor'):
+            gov.set_baseline(470)
+        assert gov.limits() == (450, 450)
+        assert 'memory ceiling' in caplog.text
+        assert gov.get_stats()['max_mb'] == 450
+
+    def test_tensor_bytes_are_reported(self):
+        gov = MemoryGovernor()
+        pool = TensorPool(max_per_size=1, pin_memory=False)
+        pool.release(pool.acquire(2))
+        gov.register_trim('pool', pool.clear, nbytes=pool.pooled_bytes)
+        assert gov.get_stats()['tensor_mb']['pool'] == round(2 * 3 * 224 * 224 * 4 / 1024 / 1024, 2)
+
+    def test_rss_is_reported(self):
+        assert memory_governor.rss_mb() > 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for the exact and near-duplicate prediction caches (prediction_cache.py)
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from prediction_cache import NearDuplicateCache, PredictionCache, dhash, hamming
+
+DISEASE = {'class': 'Rust', 'confidence': 0.9, 'class_index': 3}
+DEFICIENCY = {'class': 'Healthy', 'confidence': 0.8, 'class_index': 0}
+
+
+def _leaf(seed=0, size=(640, 480)):
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 255, (6, 8, 3), dtype=np.uint8)
+    return Image.fromarray(coarse).resize(size, Image.BICUBIC)
+
+
+def _reencode(image, scale=0.5, quality=60):
+    small = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+    buf = io.BytesIO()
+    small.save(buf, 'JPEG', quality=quality)
+    return Image.open(io.BytesIO(buf.getvalue())).convert('RGB')
+
+
+class TestPredictionCache:
+    """LRU/TTL behaviour and memory bound of the exact-hash tier"""
+
+    def test_hit_returns_copy(self):
+        cache = PredictionCache(max_entries=4)
+        cache.put('k', {'debug': {'cache': 'miss'}})
+        hit = cache.get('k')
+        hit['debug']['cache'] = 'hit'
+        assert cache.get('k') == {'debug': {'cache': 'miss'}}
+        assert cache.get('other') is None
+        assert cache.get_stats()['hits'] == 2 and cache.get_stats()['misses'] == 1
+
+    def test_evicts_by_count_and_bytes(self):
+        cache = PredictionCache(max_entries=2, max_bytes=10 ** 6)
+        for key in 'abc':
+            cache.put(key, {'v': key})
+        assert cache.get('a') is None and len(cache) == 2
+
+        cache = PredictionCache(max_entries=100, max_bytes=200)
+        for key in 'abcd':
+            cache.put(key, {'v': key * 60})
+        assert cache.bytes <= 200
+        assert cache.get_stats()['evictions'] >= 2
+
+    def test_expired_entries_miss(self):
+        cache = PredictionCache(ttl=-1)
+        cache.put('k', {'v': 1})
+        assert cache.get('k') is None
+        assert cache.get_stats()['expirations'] == 1
+
+
+class TestNearDuplicateCache:
+    """dHash matching of re-encoded uploads and the off/shadow/on switch"""
+
+    def test_reencoded_image_is_near_duplicate(self):
+        image = _leaf()
+        assert hamming(dhash(image), dhash(_reencode(image))) <= 4
+        assert hamming(dhash(image), dhash(_leaf(seed=1))) > 4
+
+    def test_modes(self):
+        image = _leaf()
+        phash = dhash(image)
+        with pytest.raises(ValueError):
+            NearDuplicateCache(mode='maybe')
+
+        off = NearDuplicateCache(mode='off')
+        off.put(phash, 'v1', DISEASE, DEFICIENCY)
+        assert off.lookup(phash, 'v1') is None
+
+        cache = NearDuplicateCache(mode='shadow')
+        cache.put(phash, 'v1', DISEASE, DEFICIENCY)
+        cached = cache.lookup(dhash(_reencode(image)), 'v1')
+        assert cached == (DISEASE, DEFICIENCY)
+        assert cache.lookup(phash, 'v2') is None
+        assert cache.record_shadow(cached, DISEASE, DEFICIENCY)
+        assert not cache.record_shadow(cached, DISEASE, {'class': 'Nitrogen'})
+        stats = cache.get_stats()
+        assert stats['hits'] == 1 and stats['lookups'] == 2
+        assert stats['shadow_agreement'] == 0.5
+
+    def test_low_confidence_not_stored(self):
+        cache = NearDuplicateCache(mode='on', min_confidence=0.85)
+        cache.put(1, 'v1', DISEASE, DEFICIENCY)
+        assert len(cache) == 0
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for the precompiled recommendation tables (src/recommendations.py)
+"""
+
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from src.recommendations import (DISEASE_RECOMMENDATIONS, get_additional_recommendations,
+                                 get_structured_recommendations, get_uncertain_disease_recs)
+
+
+class TestStructuredRecommendations:
+    """Table lookups with the confidence-dependent severity overlay"""
+
+    def test_severity_overlay_follows_confidence(self):
+        low = get_structured_recommendations('Leaf rust', 'Healthy', disease_confidence=0.5)
+        high = get_structured_recommendations('Leaf rust', 'Healthy', disease_confidence=0.9)
+        assert low['disease_recommendations']['current_severity'] == 'Moderate'
+        assert high['disease_recommendations']['current_severity'] == 'High'
+        assert get_structured_recommendations('Cerscospora', 'Healthy', 0.9)['disease_recommendations']['current_severity'] == 'Moderate'
+        # The base table is not modified by the overlay
+        assert DISEASE_RECOMMENDATIONS['Leaf rust']['current_severity'] == 'Moderate'
+
+    def test_unknown_classes_fall_back_to_uncertain(self):
+        recs = get_structured_recommendations('Unknown', 'Unknown')
+        assert json.loads(json.dumps(recs['disease_recommendations'])) == get_uncertain_disease_recs()
+        assert recs['deficiency_recommendations']['basic'] == ('Conduct comprehensive soil analysis',)
+        assert 'Unknown' not in DISEASE_RECOMMENDATIONS
+
+    def test_additional_recommendations(self):
+        recs = get_additional_recommendations('Phoma', 'iron-Fe')
+        assert recs['deficiency_recommendations_simple'] == 'Fe-EDDHA chelate (1-2g/L foliar)'
+        assert recs['disease_recommendations_simple'].endswith('...')
+
+    def test_tables_are_read_only(self):
+        recs = get_structured_recommendations('Leaf rust', 'Healthy', disease_confidence=0.9)
+        disease = recs['disease_recommendations']
+        with pytest.raises(TypeError):
+            disease['overview'] = 'changed'
+        with pytest.raises(TypeError):
+            disease['integrated_management']['chemical_control'] += ('changed',)
+        # Still serializable and copyable like plain dicts
+        assert json.loads(json.dumps(recs))['products'] == list(recs['products'])
+        assert copy.deepcopy(recs)['disease_recommendations'] is disease
+        # The uncertain fallbacks are handed out as private, mutable copies
+        mine = get_uncertain_disease_recs()
+        mine['symptoms'].append('changed')
+        assert get_uncertain_disease_recs()['symptoms'] == ['Ambiguous symptoms detected']
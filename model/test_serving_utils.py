@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Tests for the serving runners in serving_utils.py
+
+Models are built with random weights so the tests do not depend on the
+trained checkpoints being present.
+"""
+
+import os
+import sys
+import json
+from unittest.mock import patch
+
+import pytest
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serving_utils import BATCH_POOL, ModelRunner, MultiHeadRunner, PreprocessCache, TensorPool, manifest_variants, preprocess_image
+from src.multi_head import MultiHeadEfficientNet, build_from_checkpoints, save_multihead
+from src.artifact import load_artifact, save_artifact
+from src.inference import TorchClassifier, build_efficientnet_b0, fold_calibration
+from export_torchscript import accuracy_gate, export_static_quantized, quantization_engine, quantize_static
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DISEASE_MAPPING = os.path.join(MODEL_DIR, 'models/leaf_diseases/class_mapping_diseases.json')
+DEFICIENCY_MAPPING = os.path.join(MODEL_DIR, 'models/leaf_deficiencies/class_mapping_deficiencies.json')
+
+
+def _load_mapping(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def leaf_image():
+    return Image.new('RGB', (320, 240), color='green')
+
+
+@pytest.fixture
+def scripted_path(tmp_path):
+    """Tiny TorchScript classifier over the disease mapping."""
+    model = torch.nn.Sequential(
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(3, len(_load_mapping(DISEASE_MAPPING)))
+    ).eval()
+    path = tmp_path / 'tiny_scripted.pt'
+    torch.jit.script(model).save(str(path))
+    return path
+
+
+@pytest.fixture
+def multihead_path(tmp_path):
+    disease_mapping = _load_mapping(DISEASE_MAPPING)
+    deficiency_mapping = _load_mapping(DEFICIENCY_MAPPING)
+    model = MultiHeadEfficientNet(len(disease_mapping), len(deficiency_mapping))
+    path = tmp_path / 'multihead.pth'
+    save_multihead(model, disease_mapping, deficiency_mapping, path)
+    return path
+
+
+class TestSharedPreprocessing:
+    """One preprocessed tensor can be fed to any number of runners"""
+
+    def test_predict_tensor_matches_predict_image(self, scripted_path, leaf_image):
+        runner = ModelRunner(scripted_path=str(scripted_path), mapping_path=DISEASE_MAPPING)
+        tensor = preprocess_image(leaf_image)
+
+        from_tensor = runner.predict_tensor(tensor)[0]
+        from_image = runner.predict_image(leaf_image)
+
+        assert tensor.shape == (1, 3, 224, 224)
+        assert from_tensor['class'] == from_image['class']
+        assert from_tensor['confidence'] == from_image['confidence']
+
+    def test_version_tracks_the_weights_file(self, scripted_path):
+        runner = ModelRunner(scripted_path=str(scripted_path), mapping_path=DISEASE_MAPPING)
+        assert runner.version.startswith('scripted:tiny_scripted.pt@')
+        # Re-exported weights on the same backend get a new version
+        st = scripted_path.stat()
+        os.utime(scripted_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert ModelRunner(scripted_path=str(scripted_path), mapping_path=DISEASE_MAPPING).version != runner.version
+
+    def test_missing_pth_falls_back_to_mock_model(self, tmp_path, leaf_image):
+        classifier = TorchClassifier(str(tmp_path / 'nope.pth'), DISEASE_MAPPING)
+        assert classifier.version == 'pth:missing'
+        assert classifier.model.classifier[1].out_features == len(_load_mapping(DISEASE_MAPPING))
+
+    def test_top_k_from_same_forward_pass(self, scripted_path, leaf_image):
+        runner = ModelRunner(scripted_path=str(scripted_path), mapping_path=DISEASE_MAPPING)
+        result = runner.predict_tensor(preprocess_image(leaf_image), top_k=3, return_probs=True)[0]
+
+        assert len(result['top_k']) == 3
+        assert result['top_k'][0]['class'] == result['class']
+        assert result['top_k'][0]['confidence'] == result['confidence']
+        confidences = [t['confidence'] for t in result['top_k']]
+        assert confidences == sorted(confidences, reverse=True)
+        assert len(result['probabilities']) == len(runner.mapping)
+        assert abs(sum(result['probabilities']) - 1.0) < 1e-4
+
+    def test_vectorized_preprocess_matches_val_transform(self):
+        from src.inference import VAL_TRANSFORM
+        from src.preprocessing import preprocess_batch
+
+        images = [Image.effect_noise((333, 250), 64).convert('RGB'), Image.new('L', (240, 500), color=90)]
+        expected = torch.stack([VAL_TRANSFORM(img.convert('RGB')) for img in images])
+
+        out = torch.empty(1, 3, 224, 224)
+        assert preprocess_image(images[0], out=out) is out
+        assert torch.allclose(out[0], expected[0], atol=1e-5)
+        assert torch.allclose(preprocess_batch(images), expected, atol=1e-5)
+
+    def test_draft_decode_keeps_resize_input_large_enough(self):
+        import io
+        from src.preprocessing import decode_image
+
+        buf = io.BytesIO()
+        Image.effect_noise((2048, 1536), 32).convert('RGB').save(buf, 'JPEG')
+        full = decode_image(buf.getvalue(), draft=False)
+        drafted = decode_image(buf.getvalue())
+
+        assert full.size == (2048, 1536)
+        assert min(drafted.size) >= 256 and drafted.size[0] < 2048
+        assert float((preprocess_image(full) - preprocess_image(drafted)).abs().mean()) < 0.1
+
+    def test_preprocess_cache_reuses_tensor(self, leaf_image):
+        cache = PreprocessCache(max_entries=2)
+        first = cache.get_or_compute('abc', leaf_image)
+        second = cache.get_or_compute('abc', leaf_image)
+        assert first is second
+        assert cache.get_stats()['hits'] == 1
+
+        cache.get_or_compute('def', leaf_image)
+        cache.get_or_compute('ghi', leaf_image)
+        assert cache.get_stats()['entries'] == 2
+        assert cache.get_or_compute('abc', leaf_image) is not first
+
+
+class TestBatchBufferPool:
+    """Batched prediction reuses pooled input buffers and masks failed images"""
+
+    def test_buffers_are_reused(self):
+        pool = TensorPool(max_per_size=1)
+        with pool.batch(4) as first:
+            pass
+        with pool.batch(4) as second:
+            assert second is first
+        with pool.batch(2) as other:
+            assert other.shape == (2, 3, 224, 224)
+        assert pool.get_stats()['hits'] == 1
+        assert pool.get_stats()['allocations'] == 2
+
+    def test_failed_images_are_masked(self, scripted_path, leaf_image, tmp_path):
+        runner = ModelRunner(scripted_path=str(scripted_path), mapping_path=DISEASE_MAPPING)
+        good = tmp_path / 'leaf.jpg'
+        leaf_image.save(good)
+        bad = tmp_path / 'broken.jpg'
+        bad.write_bytes(b'not an image')
+
+        allocations = BATCH_POOL.get_stats()['allocations']
+        results = runner.predict_batch([str(good), str(bad), str(good)])
+        runner.predict_batch([str(good), str(bad), str(good)])
+
+        assert results[1]['class_index'] == -1 and 'error' in results[1]
+        assert results[0]['class'] == results[2]['class'] == runner.predict_image(leaf_image)['class']
+        assert runner.get_stats()['total_predictions'] == 5
+        assert BATCH_POOL.get_stats()['allocations'] - allocations <= 1
+
+
+class TestMultiHeadRunner:
+    """Shared-backbone runner returns both predictions from one trunk pass"""
+
+    def test_single_trunk_pass(self, multihead_path, leaf_image):
+        runner = MultiHeadRunner(multihead_path)
+        trunk_calls = []
+        runner.model_nn.features.register_forward_hook(lambda *a: trunk_calls.append(1))
+
+        results = runner.predict_image(leaf_image)
+
+        assert len(trunk_calls) == 1
+        assert set(results) == {'disease', 'deficiency'}
+        assert results['disease']['class'] in [v['name'] for v in runner.mappings['disease'].values()]
+        assert results['deficiency']['class'] in [v['name'] for v in runner.mappings['deficiency'].values()]
+        assert 0 <= results['disease']['confidence'] <= 1
+
+    def test_head_views(self, multihead_path, leaf_image):
+        runner = MultiHeadRunner(multihead_path)
+        disease = runner.head('disease')
+        deficiency = runner.head('deficiency')
+
+        assert disease.shared is deficiency.shared
+        assert len(disease.get_stats()['classes']) == len(runner.mappings['disease'])
+        assert deficiency.predict_image(leaf_image)['class_index'] < len(runner.mappings['deficiency'])
+
+    def test_views_share_one_trunk_pass_per_tensor(self, multihead_path, leaf_image):
+        runner = MultiHeadRunner(multihead_path)
+        trunk_calls = []
+        runner.model_nn.features.register_forward_hook(lambda *a: trunk_calls.append(1))
+        batch = preprocess_image(leaf_image)
+
+        disease = runner.head('disease').predict_tensor(batch)
+        deficiency = runner.head('deficiency').predict_tensor(batch)
+        assert len(trunk_calls) == 1
+        assert runner.get_stats()['trunk_passes_saved'] == 1
+        direct = runner.predict_tensor(batch)[0]
+        assert disease[0]['top_k'] == direct['disease']['top_k']
+        assert deficiency[0]['top_k'] == direct['deficiency']['top_k']
+
+        # A different tensor (or the same one written in place) is a fresh pass
+        trunk_calls.clear()
+        runner.head('disease').predict_tensor(batch)
+        batch.mul_(0.5)
+        runner.head('deficiency').predict_tensor(batch)
+        assert len(trunk_calls) == 2
+
+    def test_build_folds_saved_bias(self, tmp_path):
+        disease_mapping = _load_mapping(DISEASE_MAPPING)
+        deficiency_mapping = _load_mapping(DEFICIENCY_MAPPING)
+        paths = {}
+        for name, mapping_path, mapping in (('disease', DISEASE_MAPPING, disease_mapping),
+                                            ('deficiency', DEFICIENCY_MAPPING, deficiency_mapping)):
+            (tmp_path / name).mkdir()
+            paths[name] = tmp_path / name / 'weights.pth'
+            torch.save(build_efficientnet_b0(len(mapping)).state_dict(), paths[name])
+        bias = [0.5] * len(disease_mapping)
+        (tmp_path / 'disease' / 'per_class_bias.json').write_text(json.dumps({'bias': bias}))
+        original = torch.load(paths['disease'])['classifier.1.bias']
+
+        model, _, _ = build_from_checkpoints(paths['disease'], DISEASE_MAPPING, paths['deficiency'], DEFICIENCY_MAPPING)
+
+        assert torch.allclose(model.disease_head[1].bias, original + 0.5)
+        assert torch.equal(model.deficiency_head[1].bias, torch.load(paths['deficiency'])['classifier.1.bias'])
+
+
+class TestArtifact:
+    """Single-file artifacts load memory-mapped with calibration folded in"""
+
+    def test_round_trip_folds_calibration(self, tmp_path, leaf_image):
+        mapping = _load_mapping(DISEASE_MAPPING)
+        model = build_efficientnet_b0(len(mapping)).eval()
+        bias = [0.5 * i for i in range(len(mapping))]
+        path = tmp_path / 'disease_artifact.pt'
+        save_artifact(model, mapping, path, per_class_bias=bias, temperature=2.0)
+
+        runner = ModelRunner(artifact_path=str(path))
+        tensor = preprocess_image(leaf_image)
+        with torch.inference_mode():
+            expected = torch.softmax((model(tensor) + torch.tensor(bias)) / 2.0, dim=1)[0]
+
+        result = runner.predict_tensor(tensor, return_probs=True)[0]
+        assert runner.mapping == mapping
+        assert runner.calibration['temperature'] == 2.0
+        assert result['class_index'] == int(expected.argmax())
+        assert result['probabilities'] == pytest.approx(expected.tolist(), abs=1e-5)
+
+    def test_fold_calibration_matches_logit_adjustment(self):
+        model = build_efficientnet_b0(4).eval()
+        x = torch.randn(2, 3, 224, 224)
+        bias, temperature = [1.0, -2.0, 0.5, 0.0], 1.7
+        with torch.inference_mode():
+            expected = (model(x) + torch.tensor(bias)) / temperature
+        fold_calibration(model, bias, temperature)
+        with torch.inference_mode():
+            assert torch.allclose(model(x), expected, atol=1e-4)
+
+    def test_rejects_other_checkpoints(self, multihead_path):
+        with pytest.raises(ValueError):
+            load_artifact(multihead_path)
+
+    def test_builds_without_pretrained_download(self):
+        def no_download(*args, **kwargs):
+            raise AssertionError('pretrained weights requested')
+
+        with patch('torchvision.models._api.load_state_dict_from_url', no_download), \
+                patch('torch.hub.load_state_dict_from_url', no_download):
+            model = build_efficientnet_b0(5)
+        assert model.classifier[1].out_features == 5
+
+    def test_meta_device_load_matches_load_state_dict(self, tmp_path, leaf_image):
+        mapping = _load_mapping(DISEASE_MAPPING)
+        weights = tmp_path / 'random_init.pth'
+        torch.save(build_efficientnet_b0(len(mapping)).state_dict(), weights)
+
+        reference = build_efficientnet_b0(len(mapping))
+        reference.load_state_dict(torch.load(weights))
+        reference.eval()
+        save_artifact(reference, mapping, tmp_path / 'artifact.pt')
+        loaded, _, _ = load_artifact(tmp_path / 'artifact.pt')
+
+        expected, actual = reference.state_dict(), loaded.state_dict()
+        assert expected.keys() == actual.keys()
+        for name, tensor in expected.items():
+            assert actual[name].device.type == 'cpu', name
+            assert torch.equal(actual[name], tensor), name
+        assert not loaded.training
+        tensor = preprocess_image(leaf_image)
+        with torch.inference_mode():
+            assert torch.equal(loaded(tensor), reference(tensor))
+
+
+class TestOnnxBackend:
+    """ONNX Runtime runner matches the TorchScript runner's results"""
+
+    def test_batched_parity_with_torchscript(self, tmp_path, leaf_image):
+        pytest.importorskip('onnxruntime')
+        pytest.importorskip('onnx')
+        model = torch.nn.Sequential(
+            torch.nn.AdaptiveAvgPool2d(1),
+            torch.nn.Flatten(),
+            torch.nn.Linear(3, len(_load_mapping(DISEASE_MAPPING)))
+        ).eval()
+        scripted = tmp_path / 'tiny_scripted.pt'
+        onnx_path = tmp_path / 'tiny.onnx'
+        torch.jit.script(model).save(str(scripted))
+        torch.onnx.export(model, torch.zeros(1, 3, 224, 224), str(onnx_path), input_names=['input'],
+                          output_names=['output'], dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+
+        onnx_runner = ModelRunner(onnx_path=str(onnx_path), mapping_path=DISEASE_MAPPING, backend='onnx')
+        torch_runner = ModelRunner(scripted_path=str(scripted), onnx_path=str(onnx_path),
+                                   mapping_path=DISEASE_MAPPING, backend='torch')
+        images = [leaf_image, Image.new('RGB', (200, 300), color='brown')]
+
+        onnx_results = onnx_runner.predict_batch_pil(images)
+        torch_results = torch_runner.predict_batch_pil(images)
+
+        assert (onnx_runner.backend, torch_runner.backend) == ('onnx', 'scripted')
+        assert [r['class'] for r in onnx_results] == [r['class'] for r in torch_results]
+        assert set(onnx_results[0]) == set(torch_results[0])
+        assert onnx_results[0]['confidence'] == pytest.approx(torch_results[0]['confidence'], abs=1e-3)
+        assert onnx_runner.get_stats()['total_predictions'] == 2
+
+
+def _toy_conv_net(num_classes):
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, stride=4),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(8, num_classes)
+    ).eval()
+
+
+class TestStaticQuantization:
+    """FX calibration, the accuracy/latency gates and the `_quantized.pt` handoff to `ModelRunner`"""
+
+    @pytest.fixture(autouse=True)
+    def _engine(self):
+        try:
+            quantization_engine()
+        except RuntimeError as e:
+            pytest.skip(str(e))
+
+    def test_calibrated_model_tracks_fp32(self):
+        model = _toy_conv_net(5)
+        inputs = torch.rand(16, 3, 64, 64)
+        quantized = quantize_static(model, inputs)
+
+        report = accuracy_gate(model, quantized, inputs)
+        assert report['top1_agreement'] >= 0.9
+        assert report['passed']
+
+    def test_gate_rejects_bad_model(self, tmp_path):
+        model = _toy_conv_net(5)
+        inputs = torch.rand(16, 3, 64, 64)
+        labels = model(inputs).argmax(dim=1)
+
+        class Wrong(torch.nn.Module):
+            def forward(self, x):
+                logits = model(x)
+                return logits.scatter(1, logits.argmin(dim=1, keepdim=True), 1e6)
+
+        report = accuracy_gate(model, Wrong(), inputs, labels)
+        assert (report['fp32_accuracy'], report['int8_accuracy']) == (1.0, 0.0)
+        assert not report['passed']
+
+        # A rejected export removes any stale file the runner would still load
+        out = tmp_path / 'model_quantized.pt'
+        out.write_bytes(b'stale')
+        report = export_static_quantized(model, inputs, out, max_drop=-1.0)
+        assert not report['passed'] and not report['accuracy_passed']
+        assert not out.exists()
+
+    def test_latency_gate_rejects_slower_int8(self, tmp_path):
+        out = tmp_path / 'model_quantized.pt'
+        report = export_static_quantized(_toy_conv_net(5), torch.rand(8, 3, 64, 64), out,
+                                         min_speedup=1000.0, latency_runs=3)
+        assert report['accuracy_passed']
+        assert not report['latency']['passed'] and not report['passed']
+        assert not out.exists()
+
+    def test_forced_export_loads_through_model_runner(self, tmp_path, leaf_image):
+        mapping = _load_mapping(DISEASE_MAPPING)
+        model = _toy_conv_net(len(mapping))
+        out = tmp_path / 'model_quantized.pt'
+        report = export_static_quantized(model, torch.rand(8, 3, 224, 224), out, max_drop=-1.0, force=True)
+        assert not report['passed']
+        assert out.exists()
+
+        runner = ModelRunner(quant_path=str(out), mapping_path=DISEASE_MAPPING)
+        result = runner.predict_image(leaf_image)
+        assert runner.backend == 'quant'
+        assert result['class'] in [v['name'] for v in mapping.values()]
+
+
+def test_manifest_prefers_fastest_passing_variant(tmp_path, scripted_path):
+    manifest = {'models': {'disease': {'variants': {
+        'scripted': {'path': 'scripted.pt', 'passed': True, 'latency_ms': {'p50': 30.0}},
+        'traced': {'path': 'traced.pt', 'passed': True, 'latency_ms': {'p50': 20.0}},
+        'quantized': {'path': 'quantized.pt', 'passed': False, 'top1_agreement': 0.5},
+    }}}}
+    path = tmp_path / 'export_manifest.json'
+    path.write_text(json.dumps(manifest))
+
+    assert manifest_variants(path, 'disease') == [('traced', tmp_path / 'traced.pt'), ('scripted', tmp_path / 'scripted.pt')]
+
+    # traced.pt is missing, so the runner falls through to the next variant
+    os.replace(scripted_path, tmp_path / 'scripted.pt')
+    runner = ModelRunner(mapping_path=DISEASE_MAPPING, manifest_path=str(path), manifest_name='disease')
+    assert runner.backend == 'scripted'
+
+
+def test_export_keeps_only_passing_variants(tmp_path):
+    from unittest.mock import patch
+    import export_all
+
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(12, 3)).eval()
+    calib, holdout = torch.randn(4, 3, 2, 2), torch.randn(4, 3, 2, 2)
+    with torch.inference_mode():
+        reference = model(holdout)
+    path = tmp_path / 'tiny_scripted.pt'
+
+    result = export_all.export_checked('scripted', model, holdout[:1], calib, holdout, reference, path)
+    assert result['passed'] and path.exists()
+
+    # A variant that fails the gate is deleted, including the one exported before
+    with patch.dict(export_all.PARITY, {'scripted': {'max_logit_diff': 1e-3, 'min_top1_agreement': 1.1}}):
+        result = export_all.export_checked('scripted', model, holdout[:1], calib, holdout, reference, path)
+    assert not result['passed']
+    assert list(tmp_path.iterdir()) == []